@@ -0,0 +1,23 @@
+import importlib
+
+
+# The library API is imported on first use, so that the command line does not load it on startup
+_EXPORTS = {
+    'Port': 'nixnetconfig.api',
+    'XnetConfigError': 'nixnetconfig.utilities',
+    'XnetSystem': 'nixnetconfig.api',
+}
+
+__all__ = ['Port', 'XnetConfigError', 'XnetSystem']
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,21 +1,47 @@
 ﻿import logging
+import os
+from nixnetconfig import cache
+from nixnetconfig import client
+from nixnetconfig import instrumentation
+from nixnetconfig.parser import get_command_arguments
+from nixnetconfig.parser import get_command_name
 from nixnetconfig.parser import get_parser
-from nixnetconfig import utilities
 import sys
 
 
 logger = logging.getLogger('nixnetconfig')
+_log_handlers = []
 
 
 def main(argv=sys.argv[1:]):
+    if not client.is_local(argv):
+        exit_code = client.forward(argv)
+        if exit_code is not None:
+            if exit_code:
+                sys.exit(exit_code)
+            return
+
+    # The driver layer is only imported by commands that run in this process rather than in the daemon
+    from nixnetconfig import locking
+    from nixnetconfig import utilities
     args = parse_args(argv)
     configure_logger(args)
+    cache.configure(enabled=args.cache, refresh=args.refresh)
+    instrumentation.configure(timings=args.timings, trace_file=args.trace)
+    locking.configure(timeout=args.lock_timeout)
 
     try:
-        args.command(**get_command_arguments(args))
-
-        if args.enumerate:
-            utilities.enumerate_xnet_devices()
+        utilities.set_backend(args.backend or os.environ.get('NIXNETCONFIG_BACKEND'))
+        if args.target or args.targets_file:
+            from nixnetconfig import remote
+            targets = remote.parse_targets(args.target, args.targets_file)
+            remote.run_command(
+                get_command_name(argv) or 'enumerate', args.command, get_command_arguments(args), targets, args.target_jobs, args.enumerate)
+        else:
+            args.command(**get_command_arguments(args))
+
+            if args.enumerate:
+                utilities.enumerate_xnet_devices()
 
     except utilities.XnetConfigError as err:
         logger.error(err.message, exc_info=(logger.getEffectiveLevel() == logging.DEBUG))
@@ -25,12 +51,8 @@ def main(argv=sys.argv[1:]):
         logger.error('Operation failed', exc_info=(logger.getEffectiveLevel() == logging.DEBUG))
         sys.exit(1)
 
-
-def get_command_arguments(args):
-    arguments = vars(args).copy()
-    for ignore_argument in ('verbose', 'command', 'enumerate'):
-        arguments.pop(ignore_argument, None)
-    return arguments
+    finally:
+        instrumentation.finish()
 
 
 def configure_logger(args):
@@ -54,12 +76,16 @@ def configure_logger(args):
          1: logging.INFO,
          2: logging.DEBUG,
          }.get(args.verbose, 0))
-    logger.addHandler(stdout_handler)
-    logger.addHandler(stderr_handler)
+    # Replace the handlers of an earlier call, so that main can run any number of times in one process
+    for handler in _log_handlers:
+        logger.removeHandler(handler)
+    _log_handlers[:] = [stdout_handler, stderr_handler]
+    for handler in _log_handlers:
+        logger.addHandler(handler)
 
 
 def parse_args(argv=sys.argv[1:]):
-    parser = get_parser()
+    parser = get_parser(argv)
 
     return parser.parse_args(argv)
 
@@ -0,0 +1,69 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from nixnetconfig import utilities
+import threading
+
+
+_DEFAULT_MAX_WORKERS = 4
+_executor = {'pool': None, 'max_workers': _DEFAULT_MAX_WORKERS}
+_executor_lock = threading.Lock()
+
+
+def configure(max_workers=_DEFAULT_MAX_WORKERS):
+    # Limits how many blocking driver calls run at once across every event loop. A call that timed out
+    # still counts against the limit until the driver returns.
+    if max_workers < 1:
+        raise utilities.XnetConfigError('The number of workers must be at least 1')
+    shutdown(wait=False)
+    _executor['max_workers'] = max_workers
+
+
+def get_executor():
+    with _executor_lock:
+        if _executor['pool'] is None:
+            _executor['pool'] = ThreadPoolExecutor(max_workers=_executor['max_workers'], thread_name_prefix='nixnetconfig')
+        return _executor['pool']
+
+
+def shutdown(wait=True):
+    with _executor_lock:
+        pool, _executor['pool'] = _executor['pool'], None
+    if pool is not None:
+        pool.shutdown(wait=wait)
+
+
+async def run_blocking(function, *args, timeout=None, **kwargs):
+    # Cancelling the task, or running out of time, cancels a call that is still queued. A call that the
+    # driver has already started cannot be interrupted; it keeps its worker thread until the driver
+    # returns, so later calls may wait for that slot, and its result is discarded.
+    future = asyncio.get_running_loop().run_in_executor(get_executor(), functools.partial(function, *args, **kwargs))
+    return await asyncio.wait_for(future, timeout)
+
+
+async def get_system_tree(timeout=None):
+    return await run_blocking(utilities.get_system_tree, timeout=timeout)
+
+
+async def enumerate_xnet_devices(output_format='text', timeout=None):
+    return await run_blocking(utilities.enumerate_xnet_devices, output_format, timeout=timeout)
+
+
+async def rename_xnet_port_name(current_port_name, new_port_name, timeout=None):
+    return await run_blocking(utilities.rename_xnet_port_name, current_port_name, new_port_name, timeout=timeout)
+
+
+async def assign_xnet_port_name(serial_number, port_number, port_name, timeout=None):
+    return await run_blocking(utilities.assign_xnet_port_name, serial_number, port_number, port_name, timeout=timeout)
+
+
+async def blink_xnet_port(port_name, mode, timeout=None):
+    return await run_blocking(utilities.blink_xnet_port, port_name, mode, timeout=timeout)
+
+
+async def upgrade_xnet_firmware(serial_number, timeout=None):
+    return await run_blocking(utilities.upgrade_xnet_firmware, serial_number, timeout=timeout)
+
+
+async def self_test_xnet_device(serial_number, timeout=None):
+    return await run_blocking(utilities.self_test_xnet_device, serial_number, timeout=timeout)
@@ -0,0 +1,180 @@
+from collections import namedtuple
+from collections import OrderedDict
+import contextlib
+import functools
+from nixnetconfig import cache
+from nixnetconfig import locking
+from nixnetconfig import system
+from nixnetconfig.system import SystemTree
+from nixnetconfig import utilities
+
+
+Port = namedtuple('Port', ['name', 'serial_number', 'port_number'])
+
+_BLINK_MODES = {'on': 1, 'off': 0}
+
+
+def _upgrade_firmware(resource):
+    resource.upgrade_firmware(version='0')
+    return resource.firmware_revision
+
+
+def _self_test(resource):
+    resource.self_test()
+
+
+class XnetSystem(object):
+    # Configures NI-XNET hardware from another Python program. The driver session opened on entry serves
+    # every call, and the hardware found by the first lookup is reused until refresh() or a change that
+    # makes it stale. Methods return data and raise XnetConfigError instead of printing.
+    #
+    #   with XnetSystem() as system:
+    #       system.rename('CAN1', 'ENGINE')
+    #       port = system.find_port('ENGINE')
+    def __init__(self, target=None):
+        self.target = target
+        self._session = None
+        self._exit_stack = None
+        self.refresh()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def open(self):
+        if self._session is not None:
+            return
+        exit_stack = contextlib.ExitStack()
+        # Open a session of our own, even when the calling thread has bound one with using_session
+        with utilities.using_target(self.target):
+            self._session = exit_stack.enter_context(utilities.open_session())
+        self._exit_stack = exit_stack
+
+    def close(self):
+        exit_stack, self._exit_stack, self._session = self._exit_stack, None, None
+        self.refresh()
+        if exit_stack is not None:
+            exit_stack.close()
+
+    @property
+    def session(self):
+        if self._session is None:
+            raise utilities.XnetConfigError('XnetSystem is not open, use it in a "with" statement or call open()')
+        return self._session
+
+    def refresh(self):
+        # Forget the hardware read so far, for example after another program changed it
+        self._tree = None
+        self._devices = None
+        self._interfaces = None
+        self._aliases = None
+
+    def enumerate(self):
+        if self._tree is None:
+            self._tree = SystemTree(utilities._XNET_EXPERT_NAME, self.session)
+        return self._tree
+
+    def find_port(self, port_name):
+        (serial_number, port_number), resource = self._find_interface(port_name)
+        return Port(resource.expert_user_alias[0], serial_number, port_number)
+
+    def rename(self, current_port_name, new_port_name):
+        _, resource = self._find_interface(current_port_name)
+        try:
+            with self._changing_interface(resource, current_port_name):
+                resource.rename(new_port_name)
+        finally:
+            self._aliases_changed()
+
+    def assign(self, serial_number, port_number, port_name):
+        device = self._find_device(serial_number)
+        resource = self._interfaces.get((device.serial_number, port_number))
+        if resource is None:
+            raise utilities.PortNotFoundError(
+                port_number, 'Device with serial number "{}" does not have port number {}'.format(serial_number, port_number))
+        try:
+            with self._changing_device(serial_number, resource.connects_to_link_name):
+                resource.rename(port_name)
+        finally:
+            self._aliases_changed()
+
+    def blink(self, port_name, mode):
+        if mode not in _BLINK_MODES:
+            raise utilities.XnetConfigError('Blink mode must be "on" or "off", not "{}"'.format(mode))
+        _, resource = self._find_interface(port_name)
+        with self._changing_interface(resource, port_name):
+            resource.xnet.blink = _BLINK_MODES[mode]
+            resource.save_changes()
+
+    def update(self, serial_number, timeout=None):
+        # Returns the firmware revision of the device after the update. A timeout of None keeps the default
+        # deadline of the operation, which firmware updates do not have, and 0 waits forever. An update that
+        # times out is left to finish.
+        try:
+            return self._operate_device(serial_number, _upgrade_firmware, 'upgrade_xnet_firmware', timeout, interruptible=False)
+        finally:
+            self._hardware_changed()
+
+    def self_test(self, serial_number, timeout=None):
+        from nixnetconfig import history
+        with utilities.using_target(self.target), history.recording(serial_number):
+            self._operate_device(serial_number, _self_test, 'self_test_xnet_device', timeout)
+
+    def _operate_device(self, serial_number, operation, operation_name, timeout, interruptible=True):
+        # Without a deadline the device is operated in the session of the system. A call with a deadline
+        # may be abandoned, so it opens a session of its own on the thread of the deadline.
+        serial_number = self._find_device(serial_number).serial_number
+        with utilities.using_target(self.target), utilities.using_session(self.session):
+            return utilities.call_with_deadline(
+                functools.partial(utilities._operate_device, serial_number, operation),
+                utilities.get_timeout(operation_name, timeout), serial_number, interruptible)
+
+    def _changing_interface(self, resource, port_name):
+        return locking.changing_device(resource.connects_to_link_name, 'the device of interface "{}"'.format(port_name), self.target)
+
+    def _changing_device(self, serial_number, link_name):
+        return locking.changing_device(link_name, utilities._describe_device(serial_number), self.target)
+
+    def _hardware_changed(self):
+        # Resources stay valid after a rename or an update, but the inventories built from them do not
+        self._tree = None
+        cache.invalidate()
+
+    def _aliases_changed(self):
+        # A rename can also take the name of another interface, so the whole alias index is read again
+        self._aliases = None
+        self._hardware_changed()
+
+    def _read_resources(self):
+        # One query returns every xnet device and interface; interfaces are keyed on (serial number, port number)
+        if self._devices is not None:
+            return
+        device_resources, interface_resources = system.find_expert_resources(utilities._XNET_EXPERT_NAME, self.session)
+        self._devices = dict((resource.serial_number.upper(), resource) for resource in device_resources)
+        self._interfaces = OrderedDict()
+        for device_resource, device_interfaces in system.iter_device_interfaces(device_resources, interface_resources):
+            serial_number = device_resource.serial_number
+            for interface_resource in device_interfaces:
+                self._interfaces[(serial_number, interface_resource.xnet.port_number)] = interface_resource
+
+    def _find_device(self, serial_number):
+        self._read_resources()
+        resource = self._devices.get(serial_number.upper())
+        if resource is None:
+            raise utilities.DeviceWithSerialNumberNotFoundError(serial_number)
+        return resource
+
+    def _find_interface(self, port_name):
+        self._read_resources()
+        if self._aliases is None:
+            # Aliases are compared without regard to case, and the first interface with an alias keeps it
+            self._aliases = {}
+            for key, resource in self._interfaces.items():
+                self._aliases.setdefault(resource.expert_user_alias[0].upper(), key)
+        key = self._aliases.get(port_name.upper())
+        if key is None:
+            raise utilities.PortNotFoundError(port_name)
+        return key, self._interfaces[key]
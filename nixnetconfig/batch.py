@@ -0,0 +1,84 @@
+from collections import OrderedDict
+import logging
+from nixnetconfig import parser
+from nixnetconfig import utilities
+import shlex
+import sys
+import time
+
+
+logger = logging.getLogger('nixnetconfig')
+# Options that set up the whole process, so they are given on the batch command line instead of on a line
+_PROCESS_OPTIONS = ('backend', 'cache', 'refresh', 'timings', 'trace', 'lock_timeout')
+
+
+class BatchCommandError(utilities.XnetConfigError):
+    def __init__(self, failed_count, total_count):
+        super().__init__(message='{} of {} batch commands failed'.format(failed_count, total_count))
+
+
+def run_batch(batch_file, keep_going=False):
+    if batch_file == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(batch_file, 'r') as file:
+            lines = file.readlines()
+
+    command_parser = parser.get_parser()
+    timings = OrderedDict()
+    failed_count = 0
+    total_count = 0
+    with utilities.shared_session():
+        for line_number, line in enumerate(lines, 1):
+            argv = shlex.split(line, comments=True)
+            if not argv:
+                continue
+            total_count += 1
+            command_name = parser.get_command_name(argv) or 'enumerate'
+            start_time = time.perf_counter()
+            try:
+                _run_command(command_parser, command_name, argv)
+            except Exception as err:
+                failed_count += 1
+                message = err.message if isinstance(err, utilities.XnetConfigError) else 'Operation failed'
+                print('line {}: FAILED: {}: {}'.format(line_number, line.strip(), message))
+                logger.debug('Batch command failed', exc_info=True)
+                if not keep_going:
+                    break
+            else:
+                elapsed_time = time.perf_counter() - start_time
+                timings.setdefault(command_name, []).append(elapsed_time)
+                print('line {}: OK ({:.3f} s): {}'.format(line_number, elapsed_time, line.strip()))
+
+    _report_timings(timings)
+    if failed_count:
+        raise BatchCommandError(failed_count, total_count)
+
+
+def _run_command(command_parser, command_name, argv):
+    if command_name == 'batch':
+        raise utilities.XnetConfigError('Batch files cannot run other batch files')
+    try:
+        args = command_parser.parse_args(argv)
+    except SystemExit:
+        raise utilities.XnetConfigError('Invalid command')
+    for name in _PROCESS_OPTIONS:
+        if getattr(args, name) != command_parser.get_default(name):
+            raise utilities.XnetConfigError('--{} applies to the whole batch, so give it before the batch command'.format(name.replace('_', '-')))
+    if args.target or args.targets_file:
+        from nixnetconfig import remote
+        targets = remote.parse_targets(args.target, args.targets_file)
+        remote.run_command(command_name, args.command, parser.get_command_arguments(args), targets, args.target_jobs, args.enumerate)
+        return
+    args.command(**parser.get_command_arguments(args))
+    if args.enumerate:
+        utilities.enumerate_xnet_devices()
+
+
+def _report_timings(timings):
+    if not timings:
+        return
+    print('{:<12}{:>8}{:>12}{:>12}'.format('Command', 'Count', 'Total (s)', 'Mean (s)'))
+    for command_name, elapsed_times in timings.items():
+        total_time = sum(elapsed_times)
+        print('{:<12}{:>8}{:>12.3f}{:>12.3f}'.format(command_name, len(elapsed_times), total_time, total_time / len(elapsed_times)))
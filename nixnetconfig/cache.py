@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import tempfile
+import time
+
+
+logger = logging.getLogger('nixnetconfig')
+_CACHE_FORMAT_VERSION = 1
+# The inventory decides which hardware commands act on, so it is kept where other users cannot write it
+_DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.nixnetconfig', 'inventory.json')
+_DEFAULT_TTL = 300.0
+
+_settings = {
+    'enabled': False,
+    'refresh': False,
+    'path': _DEFAULT_CACHE_PATH,
+    'ttl': _DEFAULT_TTL,
+    'in_memory': False,
+}
+_memory = {}
+
+
+def configure(enabled=False, refresh=False, path=None, ttl=None, in_memory=False):
+    # NIXNETCONFIG_CACHE enables the cache without --cache and names the cache file
+    environment_path = os.environ.get('NIXNETCONFIG_CACHE', '')
+    _settings['enabled'] = bool(enabled or environment_path or in_memory)
+    _settings['refresh'] = bool(refresh)
+    _settings['path'] = path or environment_path or _DEFAULT_CACHE_PATH
+    _settings['ttl'] = float(ttl if ttl is not None else os.environ.get('NIXNETCONFIG_CACHE_TTL', _DEFAULT_TTL))
+    # A long-running process keeps the inventory in memory instead of in the file
+    _settings['in_memory'] = bool(in_memory)
+    _memory.clear()
+
+
+def is_enabled():
+    return _settings['enabled']
+
+
+def load(backend=None):
+    # The inventory only serves the backend that built it, so that a simulated system never stands in
+    # for the installed driver, or the other way around. A backend of None is the installed driver.
+    if not _settings['enabled'] or _settings['refresh']:
+        return None
+    if _settings['in_memory']:
+        return _check_content(_memory.get('content'), backend)
+    try:
+        with open(_settings['path'], 'r') as cache_file:
+            content = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    return _check_content(content, backend)
+
+
+def _check_content(content, backend):
+    if not isinstance(content, dict) or content.get('version') != _CACHE_FORMAT_VERSION:
+        return None
+    if content.get('backend') != backend:
+        logger.debug('Inventory cache describes another backend')
+        return None
+    age = time.time() - content.get('created', 0)
+    if not 0 <= age <= _settings['ttl']:
+        logger.debug('Inventory cache expired')
+        return None
+    logger.debug('Using inventory cache')
+    return content['system']
+
+
+def store(system, backend=None):
+    if not _settings['enabled']:
+        return
+    content = {'version': _CACHE_FORMAT_VERSION, 'created': time.time(), 'backend': backend, 'system': system}
+    if _settings['in_memory']:
+        _memory['content'] = content
+        _settings['refresh'] = False
+        return
+    # Readers may open the file at any time, so write a private copy and atomically swap it in
+    directory = os.path.dirname(_settings['path'])
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix='.inventory-')
+        try:
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(content, cache_file)
+            os.replace(temporary_path, _settings['path'])
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+    except OSError as err:
+        logger.debug('Could not write inventory cache: {}'.format(err))
+    else:
+        # After a rebuild, later reads in the same invocation can use the fresh file
+        _settings['refresh'] = False
+
+
+def invalidate():
+    if _settings['in_memory']:
+        _memory.clear()
+        return
+    try:
+        os.remove(_settings['path'])
+    except OSError:
+        pass
@@ -0,0 +1,50 @@
+import json
+from nixnetconfig.parser import get_command_name
+import os
+import sys
+
+
+# Commands that always run in the invoking process
+LOCAL_COMMANDS = ('serve', 'batch')
+# Options that keep a command running, which would tie up the daemon, that measure the invoking process, that
+# connect to other systems, or that change settings the daemon chose when it started
+LOCAL_OPTIONS = ('-w', '--watch', '--timings', '--trace', '--target', '--targets-file', '--backend', '--lock-timeout')
+
+
+def is_local(argv):
+    return get_command_name(argv) in LOCAL_COMMANDS or any(argument.split('=', 1)[0] in LOCAL_OPTIONS for argument in argv)
+
+
+def get_socket_path():
+    # The default socket is kept private to the user, next to the inventory cache
+    return os.environ.get('NIXNETCONFIG_SOCKET') or os.path.join(os.path.expanduser('~'), '.nixnetconfig', 'daemon.sock')
+
+
+def is_supported():
+    import socket
+    return hasattr(socket, 'AF_UNIX')
+
+
+def forward(argv):
+    # Returns the exit code of the command run by the daemon, or None when no daemon is running
+    # Without a daemon, the socket module is never imported
+    socket_path = get_socket_path()
+    if not os.path.exists(socket_path) or not is_supported():
+        return None
+    import socket
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            connection.connect(socket_path)
+        except OSError:
+            return None
+        # The daemon resolves file arguments against the directory the command was invoked from
+        request = {'argv': list(argv), 'cwd': os.getcwd()}
+        connection.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        with connection.makefile('r', encoding='utf-8') as response_file:
+            response = json.loads(response_file.readline())
+    finally:
+        connection.close()
+    sys.stdout.write(response['stdout'])
+    sys.stderr.write(response['stderr'])
+    return response['exit_code']
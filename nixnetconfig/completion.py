@@ -0,0 +1,172 @@
+import argparse
+import os
+from nixnetconfig import parser
+from nixnetconfig import utilities
+import tempfile
+
+
+# Tab completion runs entirely in the shell: commands and options are written into the completion script,
+# and interface names and serial numbers are read from a small snapshot file. The script starts a
+# background refresh of the snapshot when it is missing or older than a minute, so that a tab press never
+# waits for the driver, or even for Python. Like the inventory cache, the snapshot describes the hardware
+# of one user, so it is kept where other users can neither read nor plant it.
+_DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.expanduser('~'), '.nixnetconfig', 'completion.txt')
+
+# Positional arguments, by destination, whose values are interface names, serial numbers or file names
+_POSITIONAL_KINDS = {
+    'current_port_name': 'interfaces',
+    'port_names': 'interfaces',
+    'serial_number': 'serial_numbers',
+    'serial_numbers': 'serial_numbers',
+    'batch_file': 'files',
+    'plan_file': 'files',
+}
+
+_BASH_SCRIPT = r'''# nixnetconfig completion for bash and zsh. Load it with:
+#   source <(nixnetconfig completion {shell})
+{zsh_prelude}_nixnetconfig_snapshot='{snapshot_path}'
+
+_nixnetconfig_values() {{
+    local kind=$1 line
+    if [[ ! -s $_nixnetconfig_snapshot || -n $(find "$_nixnetconfig_snapshot" -mmin +1 2>/dev/null) ]]; then
+        mkdir -p -m 700 "$(dirname "$_nixnetconfig_snapshot")" 2>/dev/null
+        touch "$_nixnetconfig_snapshot" 2>/dev/null
+        (nixnetconfig completion --update-snapshot "$_nixnetconfig_snapshot" >/dev/null 2>&1 &)
+    fi
+    [[ -r $_nixnetconfig_snapshot ]] || return
+    while read -r line; do
+        if [[ ${{line%% *}} == "$kind" ]]; then
+            echo "${{line#* }}"
+        fi
+    done < "$_nixnetconfig_snapshot"
+}}
+
+_nixnetconfig() {{
+    local cur=${{COMP_WORDS[COMP_CWORD]}} prev=${{COMP_WORDS[COMP_CWORD-1]}}
+    local command='' index positional_count=0 word skip=0 kind options positionals
+    local value_options='{value_options}'
+    for (( index=1; index < COMP_CWORD; index++ )); do
+        word=${{COMP_WORDS[index]}}
+        if (( skip )); then
+            skip=0
+        elif [[ $word == -* ]]; then
+            [[ " $value_options " == *" $word "* ]] && skip=1
+        elif [[ -z $command ]]; then
+            command=$word
+        else
+            (( positional_count++ ))
+        fi
+    done
+
+    case $command in
+{command_cases}
+        *) options='{global_options}'; positionals='commands' ;;
+    esac
+
+    case "$command $prev" in
+{option_cases}
+    esac
+
+    if [[ $cur == -* ]]; then
+        COMPREPLY=($(compgen -W "$options" -- "$cur"))
+        return
+    fi
+    local kinds=($positionals)
+    if (( positional_count < ${{#kinds[@]}} )); then
+        kind=${{kinds[positional_count]}}
+    else
+        kind=${{kinds[${{#kinds[@]}}-1]}}
+        [[ $kind == *'*' ]] || kind=''
+    fi
+    case ${{kind%\*}} in
+        commands) COMPREPLY=($(compgen -W '{commands}' -- "$cur")) ;;
+        interfaces|serial_numbers) COMPREPLY=($(compgen -W "$(_nixnetconfig_values "${{kind%\*}}")" -- "$cur")) ;;
+        files) COMPREPLY=($(compgen -f -- "$cur")) ;;
+        choices:*) local choices=${{kind%\*}}; choices=${{choices#choices:}}; COMPREPLY=($(compgen -W "${{choices//,/ }}" -- "$cur")) ;;
+        *) COMPREPLY=() ;;
+    esac
+}}
+
+complete -F _nixnetconfig nixnetconfig
+'''
+
+
+def get_snapshot_path():
+    return os.environ.get('NIXNETCONFIG_COMPLETION_SNAPSHOT') or _DEFAULT_SNAPSHOT_PATH
+
+
+def _option_strings(argument_parser):
+    return [option for action in argument_parser._actions for option in action.option_strings]
+
+
+def _value_options(argument_parser):
+    return [option for action in argument_parser._actions if action.option_strings and action.nargs != 0 for option in action.option_strings]
+
+
+def _positional_kinds(argument_parser):
+    kinds = []
+    for action in argument_parser._actions:
+        if action.option_strings:
+            continue
+        kind = 'choices:' + ','.join(action.choices) if action.choices else _POSITIONAL_KINDS.get(action.dest, 'none')
+        # Arguments that take any number of values keep completing the same kind
+        kinds.append(kind + ('*' if action.nargs in ('*', '+') else ''))
+    return kinds
+
+
+def generate_script(shell='bash'):
+    root = parser.get_parser()
+    subparsers = next(action for action in root._actions if isinstance(action, argparse._SubParsersAction))
+
+    command_cases = []
+    option_cases = []
+    value_options = set(_value_options(root))
+    global_options = set(_option_strings(root))
+    for command_name, command_parser in [('*', root)] + list(subparsers.choices.items()):
+        if command_parser is not root:
+            command_cases.append("        {}) options='{}'; positionals='{}' ;;".format(
+                command_name, ' '.join(_option_strings(command_parser)), ' '.join(_positional_kinds(command_parser))))
+        value_options.update(_value_options(command_parser))
+        for action in command_parser._actions:
+            # Options shared by every command are completed once, whatever the command
+            if not action.option_strings or action.nargs == 0:
+                continue
+            if command_parser is not root and global_options.issuperset(action.option_strings):
+                continue
+            if action.choices:
+                generator = "COMPREPLY=($(compgen -W '{}' -- \"$cur\"))".format(' '.join(action.choices))
+            elif action.metavar == 'FILE':
+                generator = 'COMPREPLY=($(compgen -f -- "$cur"))'
+            else:
+                generator = 'COMPREPLY=()'
+            pattern = '|'.join('{}" {}"'.format(command_name, option) for option in action.option_strings)
+            option_cases.append('        {}) {}; return ;;'.format(pattern, generator))
+
+    return _BASH_SCRIPT.format(
+        shell=shell,
+        zsh_prelude='autoload -U +X bashcompinit && bashcompinit\n' if shell == 'zsh' else '',
+        snapshot_path=get_snapshot_path().replace("'", "'\\''"),
+        global_options=' '.join(_option_strings(root)),
+        value_options=' '.join(sorted(value_options)),
+        commands=' '.join(subparsers.choices),
+        command_cases='\n'.join(command_cases),
+        option_cases='\n'.join(option_cases))
+
+
+def write_snapshot(tree, path=None):
+    path = path or get_snapshot_path()
+    interfaces = [interface.name for device in tree.iter_devices() for interface in device.interfaces]
+    serial_numbers = [device.serial_num for device in tree.iter_devices()]
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    descriptor, temporary_file = tempfile.mkstemp(prefix='.completion-', suffix='.tmp', dir=directory)
+    with os.fdopen(descriptor, 'w') as file:
+        file.write('interfaces {}\nserial_numbers {}\n'.format(' '.join(interfaces), ' '.join(serial_numbers)))
+    os.replace(temporary_file, path)
+
+
+def print_completion(shell='bash', snapshot_file=None):
+    if snapshot_file:
+        write_snapshot(utilities.get_system_tree(), snapshot_file)
+        return
+    print(generate_script(shell), end='')
@@ -0,0 +1,75 @@
+from collections import namedtuple
+import json
+from nixnetconfig import utilities
+import re
+import sys
+
+
+CURRENT = 'current'
+OUTDATED = 'outdated'
+UNKNOWN = 'unknown'
+
+FirmwareStatus = namedtuple('FirmwareStatus', [
+    'serial_number', 'product_name', 'chassis', 'firmware_revision', 'installed_revision', 'status'])
+
+
+def revision_key(revision):
+    # Orders revisions such as "19072316" or "20.5.1" by their numbers, so that "9" comes before "10"
+    return tuple(int(number) for number in re.findall(r'\d+', revision))
+
+
+def read_available_revisions(serial_numbers):
+    # The newest firmware revision that the driver software of the target makes available for each device.
+    # Every revision is a driver call of its own, so this is read only for the devices being compared,
+    # and never as part of the hardware inventory.
+    from nixnetconfig import locking
+    revisions = {}
+    with locking.reading(), utilities.open_session() as session:
+        device_filter = session.create_filter()
+        device_filter.is_device = True
+        for resource in session.find_hardware(filter=device_filter, expert_names=[utilities._XNET_EXPERT_NAME]):
+            serial_number = resource.serial_number
+            if serial_number in serial_numbers:
+                revisions[serial_number] = max(resource.available_firmware_version, key=revision_key, default='')
+    return revisions
+
+
+def get_firmware_status(serial_numbers=None, expected_revision=None):
+    # Compares the revisions reported in the hardware inventory of the target with the newest firmware its
+    # driver software makes available for each device; nothing is written to the devices
+    tree = utilities.get_system_tree()
+    devices = [(device, '') for device in tree.devices]
+    devices.extend((device, a_chassis.name) for a_chassis in tree.chassis for device in a_chassis.devices)
+    devices = [(device, chassis) for device, chassis in devices if not serial_numbers or device.serial_num in serial_numbers]
+    available_revisions = {} if expected_revision else read_available_revisions(set(device.serial_num for device, _ in devices))
+
+    statuses = []
+    for device, chassis in devices:
+        installed_revision = expected_revision or available_revisions.get(device.serial_num, '')
+        if not installed_revision or not device.firmware_revision:
+            status = UNKNOWN
+        elif revision_key(device.firmware_revision) >= revision_key(installed_revision):
+            status = CURRENT
+        else:
+            status = OUTDATED
+        statuses.append(FirmwareStatus(device.serial_num, device.name, chassis, device.firmware_revision, installed_revision, status))
+    return statuses
+
+
+def report_firmware_status(expected_revision=None, output_format='text', stream=None):
+    stream = stream or sys.stdout
+    statuses = get_firmware_status(expected_revision=expected_revision)
+    if output_format == 'json':
+        json.dump({'devices': [status._asdict() for status in statuses]}, stream, indent=2)
+        stream.write('\n')
+        return
+
+    header = ('Serial', 'Product', 'Chassis', 'Firmware', 'Installed', 'Status')
+    rows = [header] + [
+        (status.serial_number, status.product_name, status.chassis, status.firmware_revision, status.installed_revision or '-', status.status)
+        for status in statuses]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    for row in rows:
+        stream.write('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() + '\n')
+    counts = [sum(1 for status in statuses if status.status == name) for name in (CURRENT, OUTDATED, UNKNOWN)]
+    stream.write('{} current, {} outdated, {} unknown\n'.format(*counts))
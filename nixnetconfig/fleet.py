@@ -0,0 +1,277 @@
+from collections import Counter
+from collections import namedtuple
+from collections import OrderedDict
+from nixnetconfig import instrumentation
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.connection
+from nixnetconfig.journal import Journal
+from nixnetconfig.journal import JournalError
+from nixnetconfig import locking
+from nixnetconfig import utilities
+import time
+
+
+logger = logging.getLogger('nixnetconfig')
+_DEFAULT_JOBS = 4
+# Seconds that a worker may outlive its deadline, so that it can report the timeout itself, before it is killed
+_KILL_GRACE_PERIOD = 5.0
+# Workers that may be flashing a device are never killed, see utilities.call_with_deadline
+_UNINTERRUPTIBLE_OPERATIONS = ('upgrade_xnet_firmware',)
+# Workers are started from daemon request threads and target threads, and forking a process with other
+# threads and the driver library loaded can deadlock the child, so workers start a fresh interpreter
+_WORKER_START_METHOD = 'spawn'
+
+FleetTarget = namedtuple('FleetTarget', ['serial_number', 'chassis'])
+FleetResult = namedtuple('FleetResult', ['serial_number', 'chassis', 'passed', 'duration', 'message'])
+
+
+class FleetOperationError(utilities.XnetConfigError):
+    def __init__(self, failed_count, total_count):
+        super().__init__(message='{} of {} devices failed'.format(failed_count, total_count))
+
+
+def update_xnet_firmware(serial_numbers, all_devices=False, jobs=_DEFAULT_JOBS, per_chassis=1, if_outdated=False,
+                         journal_file=None, resume_file=None, timeout=None):
+    with utilities.using_timeout(timeout):
+        _update_xnet_firmware(serial_numbers, all_devices, jobs, per_chassis, if_outdated, journal_file, resume_file)
+
+
+def _update_xnet_firmware(serial_numbers, all_devices, jobs, per_chassis, if_outdated, journal_file, resume_file):
+    journal, completed = open_journal('upgrade_xnet_firmware', journal_file, resume_file)
+    serial_numbers = resume_selection(journal, resume_file, serial_numbers, all_devices)
+    # Devices whose firmware is known to match the installed firmware are skipped; unknown revisions are updated
+    current = set()
+    if if_outdated:
+        from nixnetconfig import firmware
+        current = set(
+            status.serial_number for status in firmware.get_firmware_status(None if all_devices else serial_numbers)
+            if status.status == firmware.CURRENT)
+
+    if len(serial_numbers) == 1 and not all_devices and journal is None:
+        if serial_numbers[0] in current:
+            report_skipped(1, 1, [])
+            return
+        utilities.upgrade_xnet_firmware(serial_numbers[0])
+        return
+    targets = skip_completed(select_journaled_targets(journal, serial_numbers, all_devices), completed, journal)
+    selected_targets = [target for target in targets if target.serial_number not in current]
+    results = run_operation('upgrade_xnet_firmware', selected_targets, jobs, per_chassis, journal) if selected_targets else []
+    if if_outdated:
+        report_skipped(len(targets) - len(selected_targets), len(targets), results)
+    report_results(results)
+
+
+def self_test_xnet_devices(serial_numbers, all_devices=False, chassis=None, jobs=_DEFAULT_JOBS, journal_file=None, resume_file=None,
+                           timeout=None, if_older_than=None):
+    with utilities.using_timeout(timeout):
+        _self_test_xnet_devices(serial_numbers, all_devices, chassis, jobs, journal_file, resume_file, if_older_than)
+
+
+def _self_test_xnet_devices(serial_numbers, all_devices, chassis, jobs, journal_file, resume_file, if_older_than):
+    journal, completed = open_journal('self_test_xnet_device', journal_file, resume_file)
+    serial_numbers = resume_selection(journal, resume_file, serial_numbers, all_devices, chassis)
+    # Devices that passed a self-test within if_older_than seconds are skipped
+    recent = set()
+    if if_older_than is not None:
+        from nixnetconfig import history
+        recent = history.passed_since(time.time() - if_older_than)
+
+    if len(serial_numbers) == 1 and not all_devices and chassis is None and journal is None:
+        if serial_numbers[0] in recent:
+            report_recently_passed(1, 1, if_older_than)
+            return
+        utilities.self_test_xnet_device(serial_numbers[0])
+        return
+    targets = skip_completed(select_journaled_targets(journal, serial_numbers, all_devices, chassis), completed, journal)
+    selected_targets = [target for target in targets if target.serial_number not in recent]
+    if if_older_than is not None:
+        report_recently_passed(len(targets) - len(selected_targets), len(targets), if_older_than)
+    results = run_operation('self_test_xnet_device', selected_targets, jobs, journal=journal) if selected_targets else []
+    report_results(results)
+
+
+def open_journal(operation, journal_file=None, resume_file=None):
+    # Resuming appends to the journal of the interrupted run and skips the devices it records as finished
+    if resume_file:
+        journal = Journal(resume_file, operation)
+        return journal, journal.completed()
+    if journal_file:
+        return Journal(journal_file, operation), set()
+    return None, set()
+
+
+def resume_selection(journal, resume_file, serial_numbers, all_devices=False, chassis=None):
+    # A resumed run that selects no devices of its own continues with the devices its journal selected
+    if not resume_file or serial_numbers or all_devices or chassis is not None:
+        return serial_numbers
+    selection = journal.selection()
+    if selection is None:
+        raise JournalError('Journal "{}" does not record which devices it selected, so specify them again'.format(journal.path))
+    return selection
+
+
+def select_journaled_targets(journal, serial_numbers, all_devices=False, chassis=None):
+    # The selection is the first entry of a run, so that the run can be resumed without repeating it
+    targets = select_targets(serial_numbers, all_devices, chassis)
+    if journal is not None:
+        journal.record_selection(target.serial_number for target in targets)
+    return targets
+
+
+def skip_completed(targets, completed, journal):
+    remaining = [target for target in targets if target.serial_number not in completed]
+    if completed:
+        print('Skipped {} of {} devices that finished in journal "{}"'.format(len(targets) - len(remaining), len(targets), journal.path))
+    return remaining
+
+
+def select_targets(serial_numbers, all_devices=False, chassis=None):
+    if not serial_numbers and not all_devices and chassis is None:
+        raise utilities.XnetConfigError('Specify at least one serial number, a chassis, or --all')
+
+    tree = utilities.get_system_tree()
+    devices = OrderedDict((device.serial_num, FleetTarget(device.serial_num, '')) for device in tree.devices)
+    for a_chassis in tree.chassis:
+        devices.update((device.serial_num, FleetTarget(device.serial_num, a_chassis.name)) for device in a_chassis.devices)
+
+    if all_devices:
+        return list(devices.values())
+    targets = [target for target in devices.values() if chassis is not None and target.chassis.upper() == chassis.upper()]
+    if chassis is not None and not targets:
+        raise utilities.XnetConfigError('Could not find a chassis "{}" with NI-XNET devices'.format(chassis))
+    for serial_number in serial_numbers:
+        if serial_number not in devices:
+            raise utilities.DeviceWithSerialNumberNotFoundError(serial_number)
+        if devices[serial_number] not in targets:
+            targets.append(devices[serial_number])
+    return targets
+
+
+def spread_across_chassis(targets):
+    # Interleave the chassis so that the first workers started land on different backplanes
+    by_chassis = OrderedDict()
+    for target in targets:
+        by_chassis.setdefault(target.chassis, []).append(target)
+    interleaved = itertools.zip_longest(*by_chassis.values())
+    return [target for group in interleaved for target in group if target is not None]
+
+
+def run_operation(function_name, targets, jobs=_DEFAULT_JOBS, per_chassis=None, journal=None):
+    pending = spread_across_chassis(targets)
+    running = {}
+    active_per_chassis = Counter()
+    results = {}
+    context = multiprocessing.get_context(_WORKER_START_METHOD)
+    timeout = utilities.get_timeout(function_name)
+
+    while pending or running:
+        for target in list(pending):
+            if len(running) >= max(jobs, 1):
+                break
+            # Devices outside a chassis share no backplane, so only devices in a chassis count against its limit
+            if per_chassis is not None and target.chassis and active_per_chassis[target.chassis] >= max(per_chassis, 1):
+                continue
+            pending.remove(target)
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=run_worker, args=(
+                    function_name, target.serial_number, sender, utilities.current_target(), utilities.current_timeout(),
+                    utilities.get_backend(), locking.get_timeout(), instrumentation.is_enabled()),
+                daemon=True)
+            process.start()
+            sender.close()
+            start_time = time.perf_counter()
+            deadline = start_time + timeout + _KILL_GRACE_PERIOD if timeout is not None else None
+            running[process.sentinel] = (target, process, receiver, start_time, deadline)
+            active_per_chassis[target.chassis] += 1
+            if journal is not None:
+                journal.record(Journal.STARTED, target.serial_number)
+            print('{}: started'.format(target.serial_number), flush=True)
+
+        # Workers that are stuck in the driver past their deadline are killed, and the run moves on. A worker
+        # that may be flashing its device is reported instead, and keeps its place until it exits, so that the
+        # limits of the run still hold.
+        deadlines = [deadline for _, _, _, _, deadline in running.values() if deadline is not None]
+        ready = multiprocessing.connection.wait(list(running), max(min(deadlines) - time.perf_counter(), 0) if deadlines else None)
+        now = time.perf_counter()
+        expired = [sentinel for sentinel, (_, _, _, _, deadline) in running.items() if sentinel not in ready and deadline is not None and now >= deadline]
+        for sentinel in list(ready) + expired:
+            target, process, receiver, start_time, _ = running.pop(sentinel)
+            if sentinel in expired and function_name in _UNINTERRUPTIBLE_OPERATIONS:
+                running[sentinel] = (target, process, receiver, start_time, None)
+            else:
+                if sentinel in expired:
+                    process.kill()
+                process.join()
+                active_per_chassis[target.chassis] -= 1
+            if target.serial_number in results:
+                # The worker was reported when its deadline passed
+                receiver.close()
+                continue
+            if sentinel in expired:
+                passed, message = False, utilities.OperationTimeoutError(target.serial_number, timeout).message
+            else:
+                try:
+                    passed, message, events = receiver.recv()
+                    instrumentation.replay(events)
+                except EOFError:
+                    passed, message = False, 'Worker exited with code {}'.format(process.exitcode)
+            if sentinel not in running:
+                receiver.close()
+            result = FleetResult(target.serial_number, target.chassis, passed, time.perf_counter() - start_time, message)
+            results[target.serial_number] = result
+            if journal is not None:
+                journal.record(Journal.FINISHED if passed else Journal.FAILED, target.serial_number, message)
+            print('{}: {} ({:.1f} s){}'.format(
+                result.serial_number, 'passed' if passed else 'failed', result.duration, ': ' + message if message else ''), flush=True)
+
+    return [results[target.serial_number] for target in targets]
+
+
+def run_worker(function_name, serial_number, connection, target=None, timeout=None, backend=None, lock_timeout=None, instrumented=False):
+    # A spawned worker starts with the default settings, so it selects the backend and lock timeout of the
+    # parent again. A forked worker must not reuse a session bound in the parent process, and keeps the
+    # simulated system it inherited. The driver calls of an instrumented worker are sent with its result,
+    # for the hooks of the parent.
+    utilities._thread_state.session = None
+    locking.configure(timeout=lock_timeout)
+    with instrumentation.collecting(instrumented) as events:
+        try:
+            if backend != utilities.get_backend():
+                utilities.set_backend(backend)
+            with utilities.using_target(target), utilities.using_timeout(timeout):
+                getattr(utilities, function_name)(serial_number)
+        except utilities.XnetConfigError as err:
+            passed, message = False, err.message
+        except Exception as err:
+            passed, message = False, str(err) or type(err).__name__
+        else:
+            passed, message = True, ''
+    try:
+        connection.send((passed, message, events))
+    finally:
+        connection.close()
+
+
+def report_skipped(skipped_count, total_count, results):
+    # The time saved is estimated from the updates that ran alongside the skipped ones
+    durations = [result.duration for result in results if result.passed]
+    estimate = ', saving about {:.0f} s'.format(skipped_count * sum(durations) / len(durations)) if durations and skipped_count else ''
+    print('Skipped {} of {} devices with current firmware{}'.format(skipped_count, total_count, estimate))
+
+
+def report_recently_passed(skipped_count, total_count, if_older_than):
+    from nixnetconfig import history
+    print('Skipped {} of {} devices that passed a self-test in the last {}'.format(skipped_count, total_count, history.format_age(if_older_than)))
+
+
+def report_results(results):
+    print('{:<16}{:<20}{:<8}{:>10}  {}'.format('Serial number', 'Chassis', 'Result', 'Time (s)', 'Message'))
+    for result in results:
+        print('{:<16}{:<20}{:<8}{:>10.1f}  {}'.format(
+            result.serial_number, result.chassis or '-', 'PASS' if result.passed else 'FAIL', result.duration, result.message))
+    failed_count = sum(1 for result in results if not result.passed)
+    if failed_count:
+        raise FleetOperationError(failed_count, len(results))
@@ -0,0 +1,147 @@
+from collections import namedtuple
+from collections import OrderedDict
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from nixnetconfig import utilities
+
+
+logger = logging.getLogger('nixnetconfig')
+_DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser('~'), '.nixnetconfig', 'history.db')
+# The duration trend compares the mean of the latest runs of a device with the mean of all its runs
+_RECENT_RUN_COUNT = 5
+_AGE_UNITS = (('d', 86400), ('h', 3600), ('m', 60), ('s', 1))
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS self_tests (
+    target TEXT NOT NULL,
+    serial_number TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    passed INTEGER NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS self_tests_by_device ON self_tests (target, serial_number, started);
+'''
+
+TestRun = namedtuple('TestRun', ['target', 'serial_number', 'started', 'duration', 'passed', 'message'])
+DeviceHistory = namedtuple('DeviceHistory', [
+    'target', 'serial_number', 'runs', 'passes', 'last_started', 'last_passed', 'mean_duration', 'recent_duration'])
+
+
+def get_history_path():
+    return os.environ.get('NIXNETCONFIG_HISTORY') or _DEFAULT_HISTORY_PATH
+
+
+@contextlib.contextmanager
+def _connect(path=None):
+    path = path or get_history_path()
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Fleet workers record their results concurrently; SQLite serializes the writers
+        connection = sqlite3.connect(path, timeout=30)
+    except (OSError, sqlite3.Error) as err:
+        raise utilities.XnetConfigError('Could not open self-test history "{}": {}'.format(path, err))
+    try:
+        with connection:
+            connection.executescript(_SCHEMA)
+            yield connection
+    except sqlite3.Error as err:
+        raise utilities.XnetConfigError('Could not use self-test history "{}": {}'.format(path, err))
+    finally:
+        connection.close()
+
+
+def record(run, path=None):
+    with _connect(path) as connection:
+        connection.execute('INSERT INTO self_tests VALUES (?, ?, ?, ?, ?, ?)', (
+            run.target, run.serial_number, run.started, run.duration, int(run.passed), run.message))
+
+
+@contextlib.contextmanager
+def recording(serial_number):
+    # Records the self-test that runs in this context. A history that cannot be written does not fail the test.
+    started, start_time = time.time(), time.perf_counter()
+    try:
+        yield
+    except Exception as err:
+        message = err.message if isinstance(err, utilities.XnetConfigError) else str(err) or type(err).__name__
+        _record_quietly(serial_number, started, time.perf_counter() - start_time, False, message)
+        raise
+    _record_quietly(serial_number, started, time.perf_counter() - start_time, True, '')
+
+
+def _record_quietly(serial_number, started, duration, passed, message):
+    try:
+        record(TestRun(utilities.current_target() or '', serial_number, started, duration, passed, message))
+    except utilities.XnetConfigError as err:
+        logger.warning(err.message)
+
+
+def passed_since(since, path=None):
+    # Serial numbers of the devices, on the current target, whose latest self-test passed and started at or
+    # after since. A device that failed after it passed is tested again.
+    with _connect(path) as connection:
+        # SQLite takes the bare passed column from the row with the latest start
+        rows = connection.execute(
+            'SELECT serial_number, passed, MAX(started) FROM self_tests WHERE target = ? GROUP BY serial_number',
+            (utilities.current_target() or '',))
+        return set(serial_number for serial_number, passed, started in rows if passed and started >= since)
+
+
+def summarize(serial_numbers=(), path=None):
+    with _connect(path) as connection:
+        rows = connection.execute(
+            'SELECT target, serial_number, started, duration, passed, message FROM self_tests ORDER BY target, serial_number, started')
+        runs = [TestRun(*row) for row in rows]
+
+    by_device = OrderedDict()
+    for run in runs:
+        if not serial_numbers or run.serial_number in serial_numbers:
+            by_device.setdefault((run.target, run.serial_number), []).append(run)
+    summaries = []
+    for (target, serial_number), device_runs in by_device.items():
+        durations = [run.duration for run in device_runs]
+        recent_durations = durations[-_RECENT_RUN_COUNT:]
+        summaries.append(DeviceHistory(
+            target, serial_number, len(device_runs), sum(1 for run in device_runs if run.passed), device_runs[-1].started,
+            bool(device_runs[-1].passed), sum(durations) / len(durations), sum(recent_durations) / len(recent_durations)))
+    return summaries
+
+
+def format_age(seconds):
+    for unit, unit_seconds in _AGE_UNITS:
+        if seconds >= unit_seconds and seconds % unit_seconds == 0:
+            return '{:g}{}'.format(seconds / unit_seconds, unit)
+    return '{:g}s'.format(seconds)
+
+
+def _format_trend(summary):
+    if summary.runs <= _RECENT_RUN_COUNT or not summary.mean_duration:
+        return '-'
+    return '{:+.0%}'.format(summary.recent_duration / summary.mean_duration - 1)
+
+
+def report_history(serial_numbers=(), output_format='text', stream=None):
+    stream = stream or sys.stdout
+    summaries = summarize(serial_numbers)
+    if output_format == 'json':
+        json.dump({'devices': [summary._asdict() for summary in summaries]}, stream, indent=2)
+        stream.write('\n')
+        return
+    if not summaries:
+        print('No self-test results in "{}"'.format(get_history_path()), file=stream)
+        return
+    print('{:<24}{:>6}{:>11}  {:<18}{:<8}{:>10}{:>13}{:>8}'.format(
+        'Serial number', 'Runs', 'Pass rate', 'Last run', 'Result', 'Mean (s)', 'Last {} (s)'.format(_RECENT_RUN_COUNT), 'Trend'),
+        file=stream)
+    for summary in summaries:
+        # Devices of remote targets are labelled with their target
+        name = '{}/{}'.format(summary.target, summary.serial_number) if summary.target else summary.serial_number
+        print('{:<24}{:>6}{:>11.0%}  {:<18}{:<8}{:>10.1f}{:>13.1f}{:>8}'.format(
+            name, summary.runs, summary.passes / summary.runs, time.strftime('%Y-%m-%d %H:%M', time.localtime(summary.last_started)),
+            'PASS' if summary.last_passed else 'FAIL', summary.mean_duration, summary.recent_duration, _format_trend(summary)),
+            file=stream)
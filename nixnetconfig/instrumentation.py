@@ -0,0 +1,242 @@
+from collections import Counter
+from collections import defaultdict
+from collections import namedtuple
+from collections import OrderedDict
+import contextlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+
+# Calls into the driver are only wrapped while at least one hook is registered, so that an uninstrumented
+# run pays for a single check per session
+CallEvent = namedtuple('CallEvent', ['name', 'start', 'duration', 'thread_id', 'error', 'process_id'])
+
+_hooks = []
+_EXPERT_NAMES = ('xnet',)
+_cli_hooks = {'timings': None, 'trace': None, 'trace_file': None}
+
+
+def add_hook(hook):
+    # hook(event) is called with a CallEvent after every driver call, from the thread that made the call
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def is_enabled():
+    return bool(_hooks)
+
+
+def _emit(event):
+    for hook in list(_hooks):
+        hook(event)
+
+
+@contextlib.contextmanager
+def collecting(enabled=True):
+    # Replaces the hooks of this process with one that collects the events into the yielded list, so that a
+    # worker process can send them to the hooks of its parent with replay. When not enabled, the worker
+    # drops the hooks it inherited from a forked parent and collects nothing.
+    events = []
+    previous_hooks = list(_hooks)
+    _hooks[:] = [events.append] if enabled else []
+    try:
+        yield events
+    finally:
+        _hooks[:] = previous_hooks
+
+
+def replay(events):
+    # Passes events collected by another process to the hooks of this one. Their start times are
+    # comparable, since perf_counter uses a clock that all processes on the system share.
+    for event in events:
+        _emit(event)
+
+
+@contextlib.contextmanager
+def measure(name):
+    error = None
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as err:
+        error = type(err).__name__
+        raise
+    finally:
+        _emit(CallEvent(name, start, time.perf_counter() - start, threading.get_ident(), error, os.getpid()))
+
+
+def _measured_call(name, function):
+    def call(*args, **kwargs):
+        with measure(name):
+            return function(*args, **kwargs)
+    return call
+
+
+class _InstrumentedExpert(object):
+    # Expert properties, such as resource.xnet.port_number, are read and written by the driver
+    def __init__(self, name, target):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_target', target)
+
+    def __getattr__(self, name):
+        with measure('Resource.get {}.{}'.format(self._name, name)):
+            return getattr(self._target, name)
+
+    def __setattr__(self, name, value):
+        with measure('Resource.set {}.{}'.format(self._name, name)):
+            setattr(self._target, name, value)
+
+
+class _InstrumentedResource(object):
+    def __init__(self, target):
+        object.__setattr__(self, '_target', target)
+
+    def __getattr__(self, name):
+        if name in _EXPERT_NAMES:
+            return _InstrumentedExpert(name, getattr(self._target, name))
+        start = time.perf_counter()
+        try:
+            value = getattr(self._target, name)
+        except BaseException as err:
+            _emit(CallEvent('Resource.get ' + name, start, time.perf_counter() - start, threading.get_ident(), type(err).__name__, os.getpid()))
+            raise
+        if callable(value):
+            return _measured_call('Resource.' + name, value)
+        _emit(CallEvent('Resource.get ' + name, start, time.perf_counter() - start, threading.get_ident(), None, os.getpid()))
+        return value
+
+    def __setattr__(self, name, value):
+        with measure('Resource.set ' + name):
+            setattr(self._target, name, value)
+
+
+class _InstrumentedSession(object):
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        return _measured_call('Session.' + name, getattr(self._target, name))
+
+    def find_hardware(self, *args, **kwargs):
+        with measure('Session.find_hardware'):
+            resources = self._target.find_hardware(*args, **kwargs)
+        return self._iterate(iter(resources))
+
+    def _iterate(self, resources):
+        # The driver fetches each resource as the result is iterated
+        while True:
+            with measure('Session.find_hardware next'):
+                resource = next(resources, None)
+            if resource is None:
+                return
+            yield _InstrumentedResource(resource)
+
+
+@contextlib.contextmanager
+def instrumented_session(create_session):
+    with contextlib.ExitStack() as stack:
+        with measure('Session.open'):
+            session = stack.enter_context(create_session())
+        yield _InstrumentedSession(session)
+
+
+class Timings(object):
+    # A hook that collects call counts and latencies, with a histogram of power-of-two millisecond buckets
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = defaultdict(list)
+
+    def __call__(self, event):
+        with self._lock:
+            self._durations[event.name].append(event.duration)
+
+    def counts(self):
+        with self._lock:
+            return dict((name, len(durations)) for name, durations in self._durations.items())
+
+    def histogram(self, name):
+        with self._lock:
+            durations = list(self._durations.get(name, []))
+        buckets = Counter()
+        for duration in durations:
+            milliseconds = duration * 1000.0
+            buckets[2 ** max(0, math.ceil(math.log2(milliseconds))) if milliseconds > 0 else 1] += 1
+        return OrderedDict(('<= {} ms'.format(upper_bound), buckets[upper_bound]) for upper_bound in sorted(buckets))
+
+    def summary(self):
+        rows = []
+        with self._lock:
+            items = sorted(self._durations.items(), key=lambda item: -sum(item[1]))
+        for name, durations in items:
+            ordered = sorted(durations)
+            total = sum(ordered)
+            percentile_95 = ordered[min(len(ordered) - 1, int(math.ceil(0.95 * len(ordered))) - 1)]
+            rows.append((name, len(ordered), total, total / len(ordered), percentile_95, ordered[-1]))
+        return rows
+
+    def write_summary(self, stream=None):
+        stream = stream or sys.stderr
+        rows = self.summary()
+        width = max([len('Call')] + [len(row[0]) for row in rows])
+        stream.write('{:<{}}  {:>7}  {:>10}  {:>10}  {:>10}  {:>10}\n'.format('Call', width, 'Count', 'Total', 'Mean', 'P95', 'Max'))
+        for name, count, total, mean, percentile_95, maximum in rows:
+            stream.write('{:<{}}  {:>7}  {:>8.3f} s  {:>7.2f} ms  {:>7.2f} ms  {:>7.2f} ms\n'.format(
+                name, width, count, total, mean * 1000.0, percentile_95 * 1000.0, maximum * 1000.0))
+
+
+class TraceRecorder(object):
+    # A hook that records every call as a complete event of the Chrome trace event format, which
+    # chrome://tracing and Perfetto can display
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._events = []
+
+    def __call__(self, event):
+        trace_event = {
+            'name': event.name,
+            'cat': 'nisyscfg',
+            'ph': 'X',
+            'ts': round((event.start - self._origin) * 1e6, 3),
+            'dur': round(event.duration * 1e6, 3),
+            'pid': event.process_id,
+            'tid': event.thread_id,
+        }
+        if event.error is not None:
+            trace_event['args'] = {'error': event.error}
+        with self._lock:
+            self._events.append(trace_event)
+
+    def write(self, trace_file):
+        with self._lock:
+            events = list(self._events)
+        with open(trace_file, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+def configure(timings=False, trace_file=None):
+    # Registers the hooks behind the --timings and --trace options
+    if timings:
+        _cli_hooks['timings'] = Timings()
+        add_hook(_cli_hooks['timings'])
+    if trace_file:
+        _cli_hooks['trace'], _cli_hooks['trace_file'] = TraceRecorder(), trace_file
+        add_hook(_cli_hooks['trace'])
+
+
+def finish(stream=None):
+    timings, trace = _cli_hooks['timings'], _cli_hooks['trace']
+    if timings is not None:
+        remove_hook(timings)
+        timings.write_summary(stream)
+    if trace is not None:
+        remove_hook(trace)
+        trace.write(_cli_hooks['trace_file'])
+    _cli_hooks.update(timings=None, trace=None, trace_file=None)
@@ -0,0 +1,83 @@
+import json
+import os
+from nixnetconfig import utilities
+import time
+
+
+class JournalError(utilities.XnetConfigError):
+    pass
+
+
+class Journal(object):
+    # An append-only record of a fleet operation, one JSON object per line. Every line is flushed to disk
+    # before the operation continues, so that an interrupted run leaves a journal it can be resumed from.
+    SELECTED = 'selected'
+    STARTED = 'started'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    def __init__(self, path, operation):
+        self.path = path
+        self.operation = operation
+
+    def read(self):
+        try:
+            with open(self.path, 'r') as file:
+                lines = file.read().splitlines()
+        except FileNotFoundError:
+            raise JournalError('Could not find journal "{}"'.format(self.path))
+        entries = []
+        for line_number, line in enumerate(lines, 1):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Only the last line may have been cut short by a crash
+                if line_number != len(lines):
+                    raise JournalError('Journal "{}" is corrupt at line {}'.format(self.path, line_number))
+        return entries
+
+    def completed(self):
+        # Devices whose latest entry for this operation is a success
+        states = {}
+        for entry in self.read():
+            if entry.get('operation') == self.operation and entry['event'] != self.SELECTED:
+                states[entry['serial_number']] = entry['event']
+        return set(serial_number for serial_number, event in states.items() if event == self.FINISHED)
+
+    def selection(self):
+        # Serial numbers of the devices that the latest run of this operation selected, or None for a
+        # journal that does not record them
+        serial_numbers = None
+        for entry in self.read():
+            if entry.get('operation') == self.operation and entry['event'] == self.SELECTED:
+                serial_numbers = entry['serial_numbers']
+        return serial_numbers
+
+    def record(self, event, serial_number, message=''):
+        entry = {'time': time.time(), 'operation': self.operation, 'serial_number': serial_number, 'event': event}
+        if message:
+            entry['message'] = message
+        self._append(entry)
+
+    def record_selection(self, serial_numbers):
+        self._append({'time': time.time(), 'operation': self.operation, 'event': self.SELECTED, 'serial_numbers': list(serial_numbers)})
+
+    def _append(self, entry):
+        with open(self.path, 'a+b') as file:
+            _drop_line_cut_short(file)
+            file.write((json.dumps(entry) + '\n').encode('utf-8'))
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def _drop_line_cut_short(file):
+    # A crash may have cut the last line short. Appending to it would leave a corrupt line that is no
+    # longer the last one, so the fragment is removed and the next entry starts a line of its own.
+    size = file.seek(0, os.SEEK_END)
+    if size == 0:
+        return
+    file.seek(size - 1)
+    if file.read(1) == b'\n':
+        return
+    file.seek(0)
+    file.truncate(file.read().rfind(b'\n') + 1)
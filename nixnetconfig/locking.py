@@ -0,0 +1,248 @@
+import contextlib
+import glob
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from nixnetconfig import utilities
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+    import msvcrt
+
+
+# Invocations that share the hardware coordinate through advisory lock files. Commands that read take
+# the "read" lock and commands that change a device take the "write" lock, both shared, so that many
+# readers or many writers run at once but readers never run alongside writers. Writers also take an
+# exclusive lock on the device they change, so that two changes to one device run one after another.
+# Self tests and firmware updates keep a device busy for minutes, so they take only the lock of the
+# device and leave the hardware to readers meanwhile. Every holder leaves a note next to the lock, which is quoted when a waiter gives up.
+_DEFAULT_LOCK_DIRECTORY = os.path.join(tempfile.gettempdir(), 'nixnetconfig', 'locks')
+_DEFAULT_TIMEOUT = 60.0
+_POLL_INTERVAL = 0.05
+_UNSAFE_CHARACTERS = re.compile(r'[^A-Za-z0-9._-]')
+_OTHER_GROUP = {'read': 'write', 'write': 'read'}
+
+_settings = {
+    'directory': None,
+    'timeout': None,
+}
+_thread_state = threading.local()
+
+
+class LockTimeoutError(utilities.XnetConfigError):
+    def __init__(self, description, timeout, holders):
+        super().__init__(message='Timed out after {:g} s waiting for {}. The lock is held by {}'.format(
+            timeout, description, '; '.join(holders) if holders else 'another process'))
+
+
+def configure(directory=None, timeout=None):
+    # NIXNETCONFIG_LOCK_DIR and NIXNETCONFIG_LOCK_TIMEOUT apply when no value is given. A timeout of 0
+    # waits forever.
+    _settings['directory'] = directory
+    _settings['timeout'] = timeout
+
+
+def get_directory():
+    return _settings['directory'] or os.environ.get('NIXNETCONFIG_LOCK_DIR') or _DEFAULT_LOCK_DIRECTORY
+
+
+def get_timeout():
+    if _settings['timeout'] is not None:
+        return float(_settings['timeout'])
+    return float(os.environ.get('NIXNETCONFIG_LOCK_TIMEOUT', _DEFAULT_TIMEOUT))
+
+
+if fcntl is not None:
+    def _try_lock(file, shared):
+        try:
+            fcntl.flock(file.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def _unlock(file):
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+else:  # pragma: no cover
+    def _try_lock(file, shared):
+        # Windows has no shared file locks, so readers take turns there
+        file.seek(0)
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def _unlock(file):
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _lock_path(target, *names):
+    name = '.'.join(_UNSAFE_CHARACTERS.sub('_', part) for part in (target or 'local',) + names)
+    return os.path.join(get_directory(), name + '.lock')
+
+
+def _try_open_locked(path, shared):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    file = open(path, 'a+')
+    if _try_lock(file, shared):
+        return file
+    file.close()
+    return None
+
+
+def _release(file):
+    _unlock(file)
+    file.close()
+
+
+def _describe_holder():
+    command = ' '.join([os.path.basename(sys.argv[0])] + sys.argv[1:])
+    return 'pid {} "{}" since {}'.format(os.getpid(), command, time.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def _create_note(note_path):
+    # Anybody may write to the lock directory, so the note is never opened through a file that is already
+    # there, which may be a link to a file of the caller
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_NOFOLLOW', 0)
+    while True:
+        try:
+            return os.fdopen(os.open(note_path, flags, 0o644), 'w')
+        except FileExistsError:
+            # Left by a process that died with the same pid, or put there by someone else
+            os.remove(note_path)
+
+
+@contextlib.contextmanager
+def _holding(path):
+    # The note is locked for as long as the lock is held, which tells it apart from the note of a
+    # process that died
+    note_path = '{}.{}-{}.holder'.format(path, os.getpid(), threading.get_ident())
+    note = _create_note(note_path)
+    _try_lock(note, shared=False)
+    note.write(_describe_holder())
+    note.flush()
+    try:
+        yield
+    finally:
+        _release(note)
+        with contextlib.suppress(OSError):
+            os.remove(note_path)
+
+
+def get_holders(path):
+    holders = []
+    for note_path in sorted(glob.glob(glob.escape(path) + '.*.holder')):
+        try:
+            with open(note_path, 'r') as note:
+                stale = _try_lock(note, shared=False)
+                if stale:
+                    _unlock(note)
+                else:
+                    holders.append(note.read() or 'a starting process')
+            if stale:
+                os.remove(note_path)
+        except OSError:
+            continue
+    return holders
+
+
+def _wait(acquire, description, holders_path):
+    timeout = get_timeout()
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        file = acquire()
+        if file is not None:
+            return file
+        if deadline is not None and time.monotonic() >= deadline:
+            raise LockTimeoutError(description, timeout, get_holders(holders_path))
+        time.sleep(_POLL_INTERVAL)
+
+
+def _try_enter_group(path, other_path):
+    # Nobody of the other group can hold its lock while we hold it exclusively, and nobody of the other
+    # group can get in while we hold our own lock
+    gate = _try_open_locked(other_path, shared=False)
+    if gate is None:
+        return None
+    try:
+        return _try_open_locked(path, shared=True)
+    finally:
+        _release(gate)
+
+
+@contextlib.contextmanager
+def _group(group, target):
+    # A thread that holds either lock already keeps other groups out, so nested commands do not wait on it
+    if getattr(_thread_state, 'depth', 0):
+        _thread_state.depth += 1
+        try:
+            yield
+        finally:
+            _thread_state.depth -= 1
+        return
+    path, other_path = _lock_path(target, group), _lock_path(target, _OTHER_GROUP[group])
+    description = 'changes to the hardware to finish' if group == 'read' else 'reads of the hardware to finish'
+    file = _wait(lambda: _try_enter_group(path, other_path), description, other_path)
+    _thread_state.depth = 1
+    try:
+        with _holding(path):
+            yield
+    finally:
+        _thread_state.depth = 0
+        _release(file)
+
+
+@contextlib.contextmanager
+def reading(target=None):
+    # Held by commands that only read the hardware of the target, or of the local system
+    with _group('read', target or utilities.current_target()):
+        yield
+
+
+@contextlib.contextmanager
+def changing_devices(target=None):
+    # Held by commands that change several devices, around the changing_device lock of each of them
+    with _group('write', target or utilities.current_target()):
+        yield
+
+
+@contextlib.contextmanager
+def changing_device(link_name, description, target=None):
+    # Held by commands that change the device that provides link_name. The link name names the device as
+    # well as its serial number does, and is known to commands that only have one of its interfaces.
+    target = target or utilities.current_target()
+    with _group('write', target), _device(link_name, description, target):
+        yield
+
+
+@contextlib.contextmanager
+def operating_device(link_name, description, target=None):
+    # Held by self tests and firmware updates of the device that provides link_name. Readers of the
+    # hardware do not wait for them, but other changes to the device do.
+    with _device(link_name, description, target or utilities.current_target()):
+        yield
+
+
+@contextlib.contextmanager
+def _device(link_name, description, target):
+    if not hasattr(_thread_state, 'devices'):
+        _thread_state.devices = set()
+    devices = _thread_state.devices
+    if (target, link_name) in devices:
+        yield
+        return
+    path = _lock_path(target, 'device', link_name)
+    file = _wait(lambda: _try_open_locked(path, shared=False), description, path)
+    devices.add((target, link_name))
+    try:
+        with _holding(path):
+            yield
+    finally:
+        devices.discard((target, link_name))
+        _release(file)
@@ -1,6 +1,8 @@
 import argparse
-import nixnetconfig
-import os
+from collections import OrderedDict
+import functools
+import importlib
+import re
 import shutil
 import textwrap
 
@@ -24,6 +26,123 @@ HELP_TEXT = {
             ' displays errors only.',
         'enumerate':
             'Enumerate and display all NI-XNET devices and interfaces.',
+        'cache':
+            'Read the hardware inventory from an on-disk cache instead of'
+            ' querying the driver, if the cache is recent enough. Setting'
+            ' NIXNETCONFIG_CACHE to a file path enables the cache as well.',
+        'refresh':
+            'Query the driver and rebuild the hardware inventory cache.',
+        'format':
+            'Output format. "json", "ndjson" (one JSON record per device) and'
+            ' "csv" (one row per interface) are intended for other programs.'
+            ' "ndjson" and "csv" print each device as soon as it is found.',
+        'watch':
+            'Keep polling the hardware and print only the devices and interfaces'
+            ' that were added, removed or changed, until interrupted. Polling'
+            ' slows down while nothing changes. Use "--format ndjson" for one'
+            ' JSON record per change.',
+        'interval':
+            'Seconds between polls of --watch while the hardware changes. The'
+            ' default is 2.',
+        'lock_timeout':
+            'Seconds to wait for other nixnetconfig commands that use the same'
+            ' hardware. Commands that only read share the hardware, and'
+            ' commands that change different devices run at once. 0 waits'
+            ' forever. The default is taken from NIXNETCONFIG_LOCK_TIMEOUT, or'
+            ' is 60.',
+        'enumerate_jobs':
+            'Discover the chassis of the system on up to N workers at once,'
+            ' each with a driver session of its own. This makes more driver'
+            ' queries than the default of 1, but is faster on systems with'
+            ' many chassis. The report order does not change.',
+        'backend':
+            'Select the hardware backend. "nisyscfg" (the default) uses the'
+            ' installed driver. "sim:<chassis>x<devices>x<ports>" simulates a'
+            ' system of that size, for example "sim:50x17x4,latency=0.01".'
+            ' Options are standalone=<devices outside a chassis>,'
+            ' latency=<seconds per call> and <call>=<seconds> for find_hardware,'
+            ' rename, save_changes, self_test and upgrade_firmware, and'
+            ' get=<seconds per property read>. The default is taken from'
+            ' NIXNETCONFIG_BACKEND.',
+        'timings':
+            'Print the number and duration of driver calls, such as session'
+            ' creation, find_hardware, property reads, rename, save_changes and'
+            ' firmware updates, to stderr when the command completes.',
+        'trace':
+            'Write every driver call to FILE as Chrome trace events, which can'
+            ' be opened in chrome://tracing or Perfetto.',
+        'if_outdated':
+            'Skip the devices whose firmware revision already matches the'
+            ' firmware in the installed NI-XNET software, and report the'
+            ' skipped updates. Devices with an unknown revision are updated.',
+        'journal':
+            'Append the start and the result of the operation on every device'
+            ' to FILE, so that an interrupted run can be resumed.',
+        'resume':
+            'Continue the run recorded in the journal FILE: devices that'
+            ' finished are skipped and the journal is extended. Without'
+            ' serial numbers, the run continues with the devices it selected.',
+        'test_timeout':
+            'Give up on a device whose self-test has not finished after SECONDS'
+            ' and report it as failed. The default is 300; 0 waits forever.',
+        'update_timeout':
+            'Report a device whose firmware update has not finished after'
+            ' SECONDS as failed. The update is left to finish, and the command'
+            ' exits when it does. By default, updates have no time limit.',
+        'if_older_than':
+            'Skip the devices whose last passing self-test is more recent than'
+            ' AGE, a number followed by s, m, h or d, for example "24h", and'
+            ' report the skipped tests.',
+        'query':
+            'Fields are product, serial, firmware, alias, port, chassis and'
+            ' slot. Operators are =, !=, <, <=, >, >= and ~ (glob pattern).'
+            ' Combine comparisons with and, or, not and parentheses, and quote'
+            ' values with spaces. For example: product ~ "*8513" and firmware <'
+            ' 19072316.',
+        'status_format':
+            'Output format. "json" is intended for other programs.',
+        'expected_revision':
+            'Compare the devices with this firmware revision instead of the'
+            ' revisions listed in the installed NI-XNET software.',
+        'target':
+            'Run the command on the remote systems with these host names or IP'
+            ' addresses, separated by commas. The option may be repeated. The'
+            ' output of each system is labelled with its target.',
+        'targets_file':
+            'Read target host names from FILE, one per line. Text after "#" is'
+            ' ignored.',
+        'target_jobs':
+            'Maximum number of targets to connect to concurrently. The default'
+            ' is 8.',
+        'keep_going':
+            'Continue with the remaining commands after a command fails. By'
+            ' default, the batch stops at the first failure.',
+        'all_devices':
+            'Apply the command to all NI-XNET devices in the system.',
+        'jobs':
+            'Maximum number of devices to process concurrently.',
+        'chassis':
+            'Apply the command to all NI-XNET devices in the named chassis.',
+        'blink_chassis':
+            'Apply the command to all NI-XNET interfaces in the named chassis.',
+        'per_chassis':
+            'Maximum number of devices to update concurrently in one chassis.'
+            ' Devices outside a chassis are only limited by --jobs.',
+        'socket':
+            'Path of the daemon socket. The default is taken from'
+            ' NIXNETCONFIG_SOCKET, or a file in ~/.nixnetconfig. Only the user'
+            ' who runs the daemon can connect to it.',
+        'rescan_interval':
+            'Seconds between hardware rescans of the daemon. The daemon also'
+            ' rescans after every command that changes the hardware.',
+        'dry_run':
+            'Print the interface names that would change without renaming them.',
+        'shell':
+            'Shell to print the completion script for. The default is bash.',
+        'snapshot_file':
+            'Write the interface names and serial numbers to the completion'
+            ' snapshot FILE instead of printing the script. The completion'
+            ' script runs this in the background to keep the snapshot current.',
     },
 
     'commands': {
@@ -33,21 +152,84 @@ HELP_TEXT = {
         'rename':
             'Change the name of the current interface.',
         'test':
-            'Run self-test on the device with the specified serial number.',
+            'Run self-test on the devices with the specified serial numbers.'
+            ' Several devices are tested concurrently.',
         'blink':
-            'Turn LED blinking on or off for the interface name.',
+            'Turn LED blinking on or off for the interface names, or for every'
+            ' interface in a chassis. The changes to all interfaces are staged'
+            ' first and then saved together, once per interface.',
         'version':
             'Display the NI-XNET driver version.',
         'update':
-            'Update firmware onto the device of the specified serial number. The'
-            ' update is distributed from installed NI-XNET software.',
+            'Update firmware onto the devices of the specified serial numbers. The'
+            ' update is distributed from installed NI-XNET software. Several'
+            ' devices are updated concurrently, each in its own worker process.',
         'assign':
             'Assign a new interface name using the serial number of the device'
             ' and port number of the interface.',
+        'batch':
+            'Run commands read from a file, one command per line, using a single'
+            ' driver session. Use "-" to read commands from standard input. A'
+            ' line may run on other systems with --target; options that set up'
+            ' the whole run, such as --backend or --cache, go before the batch'
+            ' command.',
+        'serve':
+            'Run a daemon that keeps a driver session and the hardware inventory'
+            ' open. While the daemon runs, other nixnetconfig commands are'
+            ' forwarded to it.',
+        'apply':
+            'Rename interfaces to match a plan file that maps device serial'
+            ' numbers and port numbers to interface names. Only interfaces whose'
+            ' names differ from the plan are renamed. The plan is written in YAML'
+            ' (requires PyYAML) or JSON, for example "01ABCDEF: {1: CAN1, 2: CAN2}".',
+        'firmware-status':
+            'List the devices whose firmware is current, outdated or unknown'
+            ' compared with the firmware in the installed NI-XNET software. No'
+            ' device is updated.',
+        'find':
+            'List the devices and interfaces that match a query. Comparisons'
+            ' on serial, alias and chassis that every match must satisfy are'
+            ' answered by the driver; the rest of the query is evaluated in'
+            ' memory.',
+        'history':
+            'Show the number of self-tests, the pass rate and the trend of the'
+            ' self-test duration of each device, from the results that'
+            ' nixnetconfig records. The results are stored in'
+            ' NIXNETCONFIG_HISTORY, or in .nixnetconfig/history.db in the home'
+            ' directory.',
+        'completion':
+            'Print a bash or zsh completion script, for example'
+            ' "source <(nixnetconfig completion bash)". Commands, options,'
+            ' interface names and serial numbers are completed without starting'
+            ' nixnetconfig.',
     },
 }
 
 
+def parse_age(text):
+    # "90s", "30m", "24h" or "7d", in seconds
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd])\s*', text.lower())
+    if match is None:
+        raise argparse.ArgumentTypeError('invalid age "{}", use a number followed by s, m, h or d'.format(text))
+    return float(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+
+
+def lazy_command(module_name, function_name):
+    # Import the module that implements a command only when the command runs
+    def command(**kwargs):
+        module = importlib.import_module('nixnetconfig.' + module_name)
+        return getattr(module, function_name)(**kwargs)
+    return command
+
+
+def get_command_arguments(args):
+    arguments = vars(args).copy()
+    for ignore_argument in ('verbose', 'command', 'enumerate', 'cache', 'refresh', 'backend', 'timings', 'trace', 'target', 'targets_file',
+                            'target_jobs', 'lock_timeout'):
+        arguments.pop(ignore_argument, None)
+    return arguments
+
+
 def add_help_argument(parser):
     parser.add_argument('-h', '--help', action='help', default=argparse.SUPPRESS, help=HELP_TEXT['options']['help'])
 
@@ -60,69 +242,332 @@ def add_enumerate_argument(parser):
     parser.add_argument('-e', '--enumerate', action='store_true', help=HELP_TEXT['options']['enumerate'])
 
 
-def get_parser():
-    class CustomFormatter(argparse.RawTextHelpFormatter, argparse.RawDescriptionHelpFormatter):
-        def _split_lines(self, text, width):
-            text = self._whitespace_matcher.sub(' ', text).strip()
-            return textwrap.wrap(text, width, break_on_hyphens=False)
+def add_cache_arguments(parser):
+    # Suppressed defaults keep a subcommand from overriding options given before the command
+    parser.add_argument('--cache', action='store_true', default=argparse.SUPPRESS, help=HELP_TEXT['options']['cache'])
+    parser.add_argument('--refresh', action='store_true', default=argparse.SUPPRESS, help=HELP_TEXT['options']['refresh'])
 
-    console_width = shutil.get_terminal_size((80, 20))[0]
-    os.environ['COLUMNS'] = str(console_width)
-    parser_description = '{}\n\n{}'.format(
-        HELP_TEXT['summary'],
-        '\n'.join(textwrap.wrap(
-            HELP_TEXT['description'], console_width - 1, break_on_hyphens=False,
-        )))
 
-    parser = argparse.ArgumentParser(
-        formatter_class=CustomFormatter,
-        description=parser_description,
-        add_help=False)
+def add_lock_timeout_argument(parser):
+    parser.add_argument('--lock-timeout', type=float, metavar='SECONDS', default=argparse.SUPPRESS, help=HELP_TEXT['options']['lock_timeout'])
+
+
+def add_backend_argument(parser):
+    parser.add_argument('--backend', default=argparse.SUPPRESS, help=HELP_TEXT['options']['backend'])
+
+
+def add_instrumentation_arguments(parser):
+    parser.add_argument('--timings', action='store_true', default=argparse.SUPPRESS, help=HELP_TEXT['options']['timings'])
+    parser.add_argument('--trace', metavar='FILE', default=argparse.SUPPRESS, help=HELP_TEXT['options']['trace'])
+
+
+def add_journal_arguments(parser):
+    parser.add_argument('--journal', metavar='FILE', dest='journal_file', default=argparse.SUPPRESS, help=HELP_TEXT['options']['journal'])
+    parser.add_argument('--resume', metavar='FILE', dest='resume_file', default=argparse.SUPPRESS, help=HELP_TEXT['options']['resume'])
 
-    add_help_argument(parser)
-    add_verbose_argument(parser)
-    # Only invoke enumerate_xnet_devices once
-    parser.set_defaults(command=nixnetconfig.utilities.enumerate_xnet_devices, enumerate=False)
-    subparsers = parser.add_subparsers(title="commands")
 
+def add_timeout_argument(parser, help_text):
+    parser.add_argument('--timeout', type=float, metavar='SECONDS', default=argparse.SUPPRESS, help=help_text)
+
+
+def add_target_arguments(parser):
+    parser.add_argument('--target', action='append', metavar='HOST', default=argparse.SUPPRESS, help=HELP_TEXT['options']['target'])
+    parser.add_argument('--targets-file', metavar='FILE', default=argparse.SUPPRESS, help=HELP_TEXT['options']['targets_file'])
+    parser.add_argument('--target-jobs', type=int, metavar='N', default=argparse.SUPPRESS, help=HELP_TEXT['options']['target_jobs'])
+
+
+def add_all_devices_argument(parser):
+    parser.add_argument('-a', '--all', dest='all_devices', action='store_true', help=HELP_TEXT['options']['all_devices'])
+
+
+def add_jobs_argument(parser):
+    parser.add_argument('-j', '--jobs', type=int, default=4, help=HELP_TEXT['options']['jobs'])
+
+
+def add_enumerate_parser(subparsers):
     parser_enumerate = subparsers.add_parser('enumerate', help=HELP_TEXT['commands']['enumerate'])
-    parser_enumerate.set_defaults(command=nixnetconfig.utilities.enumerate_xnet_devices)
+    parser_enumerate.set_defaults(command=lazy_command('utilities', 'enumerate_xnet_devices'))
+    # Only pass a format when one is given, so that enumerate keeps its plain call signature
+    parser_enumerate.add_argument(
+        '-f', '--format', dest='output_format', choices=['text', 'json', 'ndjson', 'csv'], default=argparse.SUPPRESS,
+        help=HELP_TEXT['options']['format'])
+    parser_enumerate.add_argument('-w', '--watch', action='store_true', default=argparse.SUPPRESS, help=HELP_TEXT['options']['watch'])
+    parser_enumerate.add_argument('--interval', type=float, default=argparse.SUPPRESS, help=HELP_TEXT['options']['interval'])
+    parser_enumerate.add_argument(
+        '-j', '--jobs', type=int, metavar='N', default=argparse.SUPPRESS, help=HELP_TEXT['options']['enumerate_jobs'])
     add_verbose_argument(parser_enumerate)
+    add_backend_argument(parser_enumerate)
+    add_instrumentation_arguments(parser_enumerate)
+    add_target_arguments(parser_enumerate)
+    add_cache_arguments(parser_enumerate)
+    add_lock_timeout_argument(parser_enumerate)
+
 
+def add_rename_parser(subparsers):
     parser_rename = subparsers.add_parser('rename', help=HELP_TEXT['commands']['rename'])
-    parser_rename.set_defaults(command=nixnetconfig.utilities.rename_xnet_port_name)
+    parser_rename.set_defaults(command=lazy_command('utilities', 'rename_xnet_port_name'))
     parser_rename.add_argument('current_port_name', metavar='current_name', type=str.upper)
     parser_rename.add_argument('new_port_name', metavar='new_name', type=str.upper)
     add_verbose_argument(parser_rename)
+    add_backend_argument(parser_rename)
+    add_instrumentation_arguments(parser_rename)
+    add_target_arguments(parser_rename)
+    add_cache_arguments(parser_rename)
+    add_lock_timeout_argument(parser_rename)
     add_enumerate_argument(parser_rename)
 
+
+def add_test_parser(subparsers):
     parser_test = subparsers.add_parser('test', help=HELP_TEXT['commands']['test'])
-    parser_test.set_defaults(command=nixnetconfig.utilities.self_test_xnet_device)
-    parser_test.add_argument('serial_number', type=str.upper)
+    parser_test.set_defaults(command=lazy_command('fleet', 'self_test_xnet_devices'))
+    parser_test.add_argument('serial_numbers', metavar='serial_number', nargs='*', type=str.upper)
+    add_all_devices_argument(parser_test)
+    parser_test.add_argument('-c', '--chassis', help=HELP_TEXT['options']['chassis'])
+    add_jobs_argument(parser_test)
+    add_journal_arguments(parser_test)
+    add_timeout_argument(parser_test, HELP_TEXT['options']['test_timeout'])
+    parser_test.add_argument(
+        '--if-older-than', metavar='AGE', type=parse_age, default=argparse.SUPPRESS, help=HELP_TEXT['options']['if_older_than'])
     add_verbose_argument(parser_test)
+    add_backend_argument(parser_test)
+    add_instrumentation_arguments(parser_test)
+    add_target_arguments(parser_test)
+    add_cache_arguments(parser_test)
+    add_lock_timeout_argument(parser_test)
+
 
+def add_blink_parser(subparsers):
     parser_blink = subparsers.add_parser('blink', help=HELP_TEXT['commands']['blink'])
-    parser_blink.set_defaults(command=nixnetconfig.utilities.blink_xnet_port)
+    parser_blink.set_defaults(command=lazy_command('transaction', 'blink_xnet_ports'))
     parser_blink.add_argument('mode', choices=['on', 'off'])
-    parser_blink.add_argument('port_name', metavar='interface_name', type=str.upper)
+    parser_blink.add_argument('port_names', metavar='interface_name', nargs='*', type=str.upper)
+    parser_blink.add_argument('-c', '--chassis', help=HELP_TEXT['options']['blink_chassis'])
     add_verbose_argument(parser_blink)
+    add_backend_argument(parser_blink)
+    add_instrumentation_arguments(parser_blink)
+    add_target_arguments(parser_blink)
+    add_cache_arguments(parser_blink)
+    add_lock_timeout_argument(parser_blink)
 
+
+def add_version_parser(subparsers):
     parser_version = subparsers.add_parser('version', help=HELP_TEXT['commands']['version'])
-    parser_version.set_defaults(command=nixnetconfig.utilities.get_xnet_expert_version)
+    parser_version.set_defaults(command=lazy_command('utilities', 'get_xnet_expert_version'))
     add_verbose_argument(parser_version)
+    add_backend_argument(parser_version)
+    add_instrumentation_arguments(parser_version)
+    add_target_arguments(parser_version)
+    add_lock_timeout_argument(parser_version)
+
 
+def add_update_parser(subparsers):
     parser_update = subparsers.add_parser('update', help=HELP_TEXT['commands']['update'])
-    parser_update.set_defaults(command=nixnetconfig.utilities.upgrade_xnet_firmware)
-    parser_update.add_argument('serial_number', type=str.upper)
+    parser_update.set_defaults(command=lazy_command('fleet', 'update_xnet_firmware'))
+    parser_update.add_argument('serial_numbers', metavar='serial_number', nargs='*', type=str.upper)
+    add_all_devices_argument(parser_update)
+    add_jobs_argument(parser_update)
+    add_journal_arguments(parser_update)
+    add_timeout_argument(parser_update, HELP_TEXT['options']['update_timeout'])
+    parser_update.add_argument('--per-chassis', type=int, default=1, help=HELP_TEXT['options']['per_chassis'])
+    parser_update.add_argument('--if-outdated', action='store_true', default=argparse.SUPPRESS, help=HELP_TEXT['options']['if_outdated'])
     add_verbose_argument(parser_update)
+    add_backend_argument(parser_update)
+    add_instrumentation_arguments(parser_update)
+    add_target_arguments(parser_update)
+    add_cache_arguments(parser_update)
+    add_lock_timeout_argument(parser_update)
     add_enumerate_argument(parser_update)
 
+
+def add_assign_parser(subparsers):
     parser_assign = subparsers.add_parser('assign', help=HELP_TEXT['commands']['assign'])
-    parser_assign.set_defaults(command=nixnetconfig.utilities.assign_xnet_port_name)
+    parser_assign.set_defaults(command=lazy_command('utilities', 'assign_xnet_port_name'))
     parser_assign.add_argument('serial_number', type=str.upper)
     parser_assign.add_argument('port_number', metavar='port', type=int)
     parser_assign.add_argument('port_name', metavar='name', type=str.upper)
     add_verbose_argument(parser_assign)
+    add_backend_argument(parser_assign)
+    add_instrumentation_arguments(parser_assign)
+    add_target_arguments(parser_assign)
+    add_cache_arguments(parser_assign)
+    add_lock_timeout_argument(parser_assign)
     add_enumerate_argument(parser_assign)
 
+
+def add_batch_parser(subparsers):
+    parser_batch = subparsers.add_parser('batch', help=HELP_TEXT['commands']['batch'])
+    parser_batch.set_defaults(command=lazy_command('batch', 'run_batch'))
+    parser_batch.add_argument('batch_file', metavar='file')
+    parser_batch.add_argument('-k', '--keep-going', action='store_true', help=HELP_TEXT['options']['keep_going'])
+    add_verbose_argument(parser_batch)
+    add_backend_argument(parser_batch)
+    add_instrumentation_arguments(parser_batch)
+    add_cache_arguments(parser_batch)
+    add_lock_timeout_argument(parser_batch)
+
+
+def add_serve_parser(subparsers):
+    parser_serve = subparsers.add_parser('serve', help=HELP_TEXT['commands']['serve'])
+    parser_serve.set_defaults(command=lazy_command('server', 'serve'))
+    parser_serve.add_argument('--socket', dest='socket_path', help=HELP_TEXT['options']['socket'])
+    parser_serve.add_argument('--rescan-interval', type=float, default=60.0, help=HELP_TEXT['options']['rescan_interval'])
+    add_verbose_argument(parser_serve)
+    add_backend_argument(parser_serve)
+    add_instrumentation_arguments(parser_serve)
+
+
+def add_apply_parser(subparsers):
+    parser_apply = subparsers.add_parser('apply', help=HELP_TEXT['commands']['apply'])
+    parser_apply.set_defaults(command=lazy_command('plan', 'apply_plan'))
+    parser_apply.add_argument('plan_file', metavar='plan')
+    parser_apply.add_argument('-n', '--dry-run', action='store_true', help=HELP_TEXT['options']['dry_run'])
+    add_verbose_argument(parser_apply)
+    add_backend_argument(parser_apply)
+    add_instrumentation_arguments(parser_apply)
+    add_target_arguments(parser_apply)
+    add_cache_arguments(parser_apply)
+    add_enumerate_argument(parser_apply)
+
+
+def add_firmware_status_parser(subparsers):
+    parser_firmware_status = subparsers.add_parser('firmware-status', help=HELP_TEXT['commands']['firmware-status'])
+    parser_firmware_status.set_defaults(command=lazy_command('firmware', 'report_firmware_status'))
+    parser_firmware_status.add_argument('--expected', dest='expected_revision', help=HELP_TEXT['options']['expected_revision'])
+    parser_firmware_status.add_argument(
+        '-f', '--format', dest='output_format', choices=['text', 'json'], default='text', help=HELP_TEXT['options']['status_format'])
+    add_verbose_argument(parser_firmware_status)
+    add_backend_argument(parser_firmware_status)
+    add_instrumentation_arguments(parser_firmware_status)
+    add_target_arguments(parser_firmware_status)
+    add_cache_arguments(parser_firmware_status)
+    add_lock_timeout_argument(parser_firmware_status)
+
+
+def add_find_parser(subparsers):
+    parser_find = subparsers.add_parser('find', help=HELP_TEXT['commands']['find'])
+    parser_find.set_defaults(command=lazy_command('query', 'find_xnet_devices'))
+    parser_find.add_argument('query', metavar='expression', nargs='+', help=HELP_TEXT['options']['query'])
+    parser_find.add_argument(
+        '-f', '--format', dest='output_format', choices=['text', 'json', 'ndjson', 'csv'], default='text', help=HELP_TEXT['options']['format'])
+    add_verbose_argument(parser_find)
+    add_backend_argument(parser_find)
+    add_instrumentation_arguments(parser_find)
+    add_target_arguments(parser_find)
+    add_cache_arguments(parser_find)
+
+
+def add_history_parser(subparsers):
+    parser_history = subparsers.add_parser('history', help=HELP_TEXT['commands']['history'])
+    parser_history.set_defaults(command=lazy_command('history', 'report_history'))
+    parser_history.add_argument('serial_numbers', metavar='serial_number', nargs='*', type=str.upper)
+    parser_history.add_argument(
+        '-f', '--format', dest='output_format', choices=['text', 'json'], default='text', help=HELP_TEXT['options']['status_format'])
+    add_verbose_argument(parser_history)
+
+
+def add_completion_parser(subparsers):
+    parser_completion = subparsers.add_parser('completion', help=HELP_TEXT['commands']['completion'])
+    parser_completion.set_defaults(command=lazy_command('completion', 'print_completion'))
+    parser_completion.add_argument('shell', nargs='?', choices=['bash', 'zsh'], default='bash', help=HELP_TEXT['options']['shell'])
+    parser_completion.add_argument('--update-snapshot', dest='snapshot_file', metavar='FILE', help=HELP_TEXT['options']['snapshot_file'])
+    add_verbose_argument(parser_completion)
+    add_backend_argument(parser_completion)
+    add_cache_arguments(parser_completion)
+
+
+_COMMAND_PARSERS = OrderedDict([
+    ('enumerate', add_enumerate_parser),
+    ('rename', add_rename_parser),
+    ('test', add_test_parser),
+    ('blink', add_blink_parser),
+    ('version', add_version_parser),
+    ('update', add_update_parser),
+    ('assign', add_assign_parser),
+    ('batch', add_batch_parser),
+    ('serve', add_serve_parser),
+    ('apply', add_apply_parser),
+    ('firmware-status', add_firmware_status_parser),
+    ('find', add_find_parser),
+    ('history', add_history_parser),
+    ('completion', add_completion_parser),
+])
+
+
+class CustomFormatter(argparse.RawTextHelpFormatter, argparse.RawDescriptionHelpFormatter):
+    def __init__(self, prog, **kwargs):
+        # Only query the console when help or usage is actually formatted
+        kwargs.setdefault('width', shutil.get_terminal_size((80, 20))[0] - 2)
+        super().__init__(prog, **kwargs)
+
+    def _fill_text(self, text, width, indent):
+        return '\n\n'.join(
+            textwrap.fill(paragraph, width, initial_indent=indent, subsequent_indent=indent, break_on_hyphens=False)
+            for paragraph in text.split('\n\n'))
+
+    def _split_lines(self, text, width):
+        text = self._whitespace_matcher.sub(' ', text).strip()
+        return textwrap.wrap(text, width, break_on_hyphens=False)
+
+
+def add_global_arguments(parser):
+    add_help_argument(parser)
+    add_verbose_argument(parser)
+    add_backend_argument(parser)
+    add_instrumentation_arguments(parser)
+    add_target_arguments(parser)
+    add_cache_arguments(parser)
+    add_lock_timeout_argument(parser)
+
+
+@functools.lru_cache(maxsize=None)
+def _global_value_options():
+    # Options given before the command whose next argument is their value, not the command
+    parser = argparse.ArgumentParser(add_help=False)
+    add_global_arguments(parser)
+    return tuple(option for action in parser._actions if action.nargs != 0 for option in action.option_strings)
+
+
+def _takes_value(argument):
+    # argparse accepts any unambiguous prefix of a long option, and "--option=value" carries its own value
+    if '=' in argument:
+        return False
+    if argument in _global_value_options():
+        return True
+    matches = [option for option in _global_value_options() if argument.startswith('--') and option.startswith(argument)]
+    return len(matches) == 1
+
+
+def get_command_name(argv):
+    skip_value = False
+    for argument in argv:
+        if skip_value:
+            skip_value = False
+        elif argument.startswith('-'):
+            skip_value = _takes_value(argument)
+        else:
+            return argument
+    return None
+
+
+def get_parser(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=CustomFormatter,
+        description='{}\n\n{}'.format(HELP_TEXT['summary'], HELP_TEXT['description']),
+        add_help=False)
+
+    add_global_arguments(parser)
+    # Only invoke enumerate_xnet_devices once
+    parser.set_defaults(
+        command=lazy_command('utilities', 'enumerate_xnet_devices'), enumerate=False, cache=False, refresh=False, backend=None,
+        timings=False, trace=None, target=None, targets_file=None, target_jobs=8, lock_timeout=None)
+    subparsers = parser.add_subparsers(title="commands", metavar="<command>")
+
+    # When the command is known, skip building the subparsers of every other command
+    command_name = get_command_name(argv) if argv is not None else None
+    if command_name in _COMMAND_PARSERS:
+        _COMMAND_PARSERS[command_name](subparsers)
+    else:
+        for add_command_parser in _COMMAND_PARSERS.values():
+            add_command_parser(subparsers)
+
     return parser
@@ -0,0 +1,164 @@
+from collections import namedtuple
+import json
+import logging
+from nixnetconfig import cache
+from nixnetconfig import locking
+from nixnetconfig import system
+from nixnetconfig import utilities
+
+
+logger = logging.getLogger('nixnetconfig')
+
+PortChange = namedtuple('PortChange', ['serial_number', 'port_number', 'current_name', 'new_name', 'resource'])
+
+
+class PlanApplyError(utilities.XnetConfigError):
+    # unrestored lists the (name, previous name) of ports that kept a name the plan gave them
+    def __init__(self, name, new_name, error, restored_count, unrestored):
+        self.unrestored = unrestored
+        message = 'Could not rename "{}" to "{}": {}'.format(name, new_name, _error_message(error))
+        if restored_count:
+            message += '. Undid {} renames'.format(restored_count)
+        if unrestored:
+            message += '. Could not rename back: {}'.format(', '.join('"{}" (was "{}")'.format(*names) for names in unrestored))
+        super().__init__(message=message)
+
+
+def load_plan(plan_file):
+    # A plan maps each serial number to a mapping of port number to interface name:
+    #   "01ABCDEF":  (quote serial numbers, or YAML may read them as numbers)
+    #     1: CAN1
+    #     2: CAN2
+    with open(plan_file, 'r') as file:
+        content = file.read()
+    try:
+        document = json.loads(content)
+    except ValueError:
+        try:
+            import yaml
+        except ImportError:
+            raise utilities.XnetConfigError('Reading YAML plans requires PyYAML, or write the plan as JSON')
+        try:
+            document = yaml.safe_load(content)
+        except yaml.YAMLError as err:
+            raise utilities.XnetConfigError('Could not parse plan "{}": {}'.format(plan_file, err))
+
+    plan = {}
+    try:
+        for serial_number, ports in (document or {}).items():
+            for port_number, port_name in ports.items():
+                plan[(str(serial_number).upper(), int(port_number))] = str(port_name).upper()
+    except (AttributeError, TypeError, ValueError):
+        raise utilities.XnetConfigError('Plan "{}" must map serial numbers to port numbers and interface names'.format(plan_file))
+    return plan
+
+
+def read_ports(session):
+    # One query returns every xnet device and interface; ports are keyed on (serial number, port number)
+    device_resources, interface_resources = system.find_expert_resources(utilities._XNET_EXPERT_NAME, session)
+    ports = {}
+    for device_resource, device_interfaces in system.iter_device_interfaces(device_resources, interface_resources):
+        serial_number = device_resource.serial_number
+        for interface_resource in device_interfaces:
+            ports[(serial_number, interface_resource.xnet.port_number)] = interface_resource
+    return ports
+
+
+def diff_plan(plan, ports):
+    planned = {}
+    for (serial_number, port_number), new_name in sorted(plan.items()):
+        if new_name in planned:
+            raise utilities.XnetConfigError('Interface name "{}" is planned for port {} of device with serial number "{}" and port {} of device with serial number "{}"'.format(
+                new_name, planned[new_name][1], planned[new_name][0], port_number, serial_number))
+        planned[new_name] = (serial_number, port_number)
+
+    serial_numbers = set(serial_number for serial_number, _ in ports)
+    changes = []
+    for (serial_number, port_number), new_name in sorted(plan.items()):
+        if serial_number not in serial_numbers:
+            raise utilities.DeviceWithSerialNumberNotFoundError(serial_number)
+        if (serial_number, port_number) not in ports:
+            raise utilities.PortNotFoundError(
+                port_number, 'Device with serial number "{}" does not have port number {}'.format(serial_number, port_number))
+        resource = ports[(serial_number, port_number)]
+        current_name = resource.expert_user_alias[0]
+        if current_name.upper() != new_name:
+            changes.append(PortChange(serial_number, port_number, current_name, new_name, resource))
+
+    # A new name may only be taken from a port that the plan renames as well
+    names = dict((resource.expert_user_alias[0].upper(), key) for key, resource in ports.items())
+    for change in changes:
+        owner = names.get(change.new_name)
+        if owner is not None and owner not in plan:
+            raise utilities.XnetConfigError('Interface name "{}" is already used by port {} of device with serial number "{}"'.format(
+                change.new_name, owner[1], owner[0]))
+    return changes
+
+
+def _order_renames(changes):
+    # Rename a port only once no other pending port still holds its new name; break cycles, such as two
+    # ports swapping names, with a temporary name.
+    pending = list(changes)
+    holders = dict((change.current_name.upper(), change) for change in changes)
+    while pending:
+        ready = next((change for change in pending if holders.get(change.new_name) is None), None)
+        if ready is None:
+            blocked = pending[0]
+            temporary_name = 'NIXNETCONFIG_{}_{}'.format(blocked.serial_number, blocked.port_number)
+            yield blocked.resource, temporary_name
+            del holders[blocked.current_name.upper()]
+            pending[0] = blocked._replace(current_name=temporary_name)
+            holders[temporary_name] = pending[0]
+            continue
+        yield ready.resource, ready.new_name
+        pending.remove(ready)
+        del holders[ready.current_name.upper()]
+
+
+def _error_message(error):
+    return error.message if isinstance(error, utilities.XnetConfigError) else str(error) or type(error).__name__
+
+
+def _rename(resource, new_name):
+    with locking.changing_device(resource.connects_to_link_name, 'the device of interface "{}"'.format(resource.expert_user_alias[0])):
+        resource.rename(new_name)
+
+
+def _rename_ports(changes):
+    # When a rename fails, the ports renamed so far get their names back in reverse order, which also
+    # frees the temporary names of swaps
+    renamed = []
+    for resource, new_name in _order_renames(changes):
+        name = resource.expert_user_alias[0]
+        try:
+            _rename(resource, new_name)
+        except Exception as err:
+            logger.debug('Rename failed', exc_info=True)
+            unrestored = []
+            for renamed_resource, previous_name in reversed(renamed):
+                try:
+                    _rename(renamed_resource, previous_name)
+                except Exception:
+                    logger.debug('Rename back failed', exc_info=True)
+                    unrestored.append((renamed_resource.expert_user_alias[0], previous_name))
+            raise PlanApplyError(name, new_name, err, len(renamed) - len(unrestored), unrestored)
+        renamed.append((resource, name))
+
+
+def apply_plan(plan_file, dry_run=False):
+    plan = load_plan(plan_file)
+    with utilities.open_session() as session:
+        changes = diff_plan(plan, read_ports(session))
+        for change in changes:
+            print('{} port {}: {} -> {}'.format(change.serial_number, change.port_number, change.current_name, change.new_name))
+        if not changes:
+            print('No changes')
+            return
+        if dry_run:
+            return
+        try:
+            with locking.changing_devices():
+                _rename_ports(changes)
+        finally:
+            cache.invalidate()
+    logger.info('Renamed {} interfaces'.format(len(changes)))
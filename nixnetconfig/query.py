@@ -0,0 +1,273 @@
+from collections import defaultdict
+import fnmatch
+import re
+from nixnetconfig import report
+from nixnetconfig.system import ChassisBranch
+from nixnetconfig.system import DeviceBranch
+from nixnetconfig import utilities
+import sys
+
+
+# A query compares fields with values, for example:
+#   product ~ "*8513" and firmware < 19072316
+#   chassis = Chassis1 and (slot = 4 or port != 1)
+# "=" and "!=" compare without regard to case, "~" matches a glob pattern, and ports, slots and firmware
+# revisions compare as numbers.
+FIELDS = {
+    'product': 'product_name',
+    'serial': 'serial_number',
+    'firmware': 'firmware_revision',
+    'alias': 'interface',
+    'port': 'port_number',
+    'chassis': 'chassis',
+    'slot': 'slot',
+}
+_INTERFACE_FIELDS = ('interface', 'port_number')
+_NUMERIC_FIELDS = ('firmware_revision', 'port_number', 'slot')
+_OPERATORS = ('=', '!=', '<', '<=', '>', '>=', '~')
+_TOKEN_PATTERN = re.compile(r'\s*(?:(!=|<=|>=|=|<|>|~|\(|\))|"((?:[^"\\]|\\.)*)"|\'([^\']*)\'|([^\s()=!<>~"\']+))')
+_SLOT_PATTERN = re.compile(r'Slot(\d+)$', re.IGNORECASE)
+
+
+class QueryError(utilities.XnetConfigError):
+    def __init__(self, query, problem):
+        super().__init__(message='Invalid query "{}": {}'.format(query, problem))
+
+
+def _tokenize(query):
+    tokens = []
+    position = 0
+    while query[position:].strip():
+        match = _TOKEN_PATTERN.match(query, position)
+        if match is None:
+            raise QueryError(query, 'unexpected "{}"'.format(query[position:].strip()))
+        symbol, double_quoted, single_quoted, word = match.groups()
+        if symbol is not None:
+            tokens.append(('symbol', symbol))
+        elif word is not None:
+            tokens.append(('word', word))
+        else:
+            value = re.sub(r'\\(.)', r'\1', double_quoted) if double_quoted is not None else single_quoted
+            tokens.append(('string', value))
+        position = match.end()
+    return tokens
+
+
+class _Parser(object):
+    # expression := term ("or" term)*;  term := factor ("and" factor)*
+    # factor := "not" factor | "(" expression ")" | field operator value
+    def __init__(self, query):
+        self.query = query
+        self.tokens = _tokenize(query)
+        self.position = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError(self.query, 'the query is empty')
+        node = self._expression()
+        if self.position < len(self.tokens):
+            raise QueryError(self.query, 'unexpected "{}"'.format(self.tokens[self.position][1]))
+        return node
+
+    def _peek_keyword(self, keyword):
+        if self.position < len(self.tokens) and self.tokens[self.position] == ('word', keyword):
+            self.position += 1
+            return True
+        return False
+
+    def _next(self, expected):
+        if self.position == len(self.tokens):
+            raise QueryError(self.query, 'expected {} at the end'.format(expected))
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def _expression(self):
+        nodes = [self._term()]
+        while self._peek_keyword('or'):
+            nodes.append(self._term())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def _term(self):
+        nodes = [self._factor()]
+        while self._peek_keyword('and'):
+            nodes.append(self._factor())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def _factor(self):
+        if self._peek_keyword('not'):
+            return ('not', self._factor())
+        kind, text = self._next('a field')
+        if (kind, text) == ('symbol', '('):
+            node = self._expression()
+            if self._next('")"') != ('symbol', ')'):
+                raise QueryError(self.query, 'expected ")"')
+            return node
+        if kind != 'word' or text.lower() not in FIELDS:
+            raise QueryError(self.query, 'unknown field "{}", use one of {}'.format(text, ', '.join(FIELDS)))
+        kind, operator = self._next('an operator')
+        if kind != 'symbol' or operator not in _OPERATORS:
+            raise QueryError(self.query, 'expected an operator after "{}", not "{}"'.format(text, operator))
+        kind, value = self._next('a value')
+        if kind == 'symbol':
+            raise QueryError(self.query, 'expected a value after "{}", not "{}"'.format(operator, value))
+        return ('compare', FIELDS[text.lower()], operator, value)
+
+
+def parse_query(query):
+    return _Parser(query).parse()
+
+
+def _fields(node):
+    if node[0] == 'compare':
+        return {node[1]}
+    if node[0] == 'not':
+        return _fields(node[1])
+    return set().union(*(_fields(child) for child in node[1]))
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _compare(field, actual, operator, expected):
+    if actual is None:
+        return operator == '!='
+    if operator == '~':
+        return fnmatch.fnmatchcase(str(actual).lower(), expected.lower())
+    actual_number, expected_number = _number(actual), _number(expected)
+    if field in _NUMERIC_FIELDS and actual_number is not None and expected_number is not None:
+        actual, expected = actual_number, expected_number
+    else:
+        actual, expected = str(actual).lower(), expected.lower()
+    return {
+        '=': actual == expected, '!=': actual != expected, '<': actual < expected,
+        '<=': actual <= expected, '>': actual > expected, '>=': actual >= expected,
+    }[operator]
+
+
+def evaluate(node, row):
+    if node[0] == 'compare':
+        _, field, operator, value = node
+        return _compare(field, row.get(field), operator, value)
+    if node[0] == 'not':
+        return not evaluate(node[1], row)
+    if node[0] == 'and':
+        return all(evaluate(child, row) for child in node[1])
+    return any(evaluate(child, row) for child in node[1])
+
+
+def _rows(record):
+    # One row per interface, or a single row for a device without interfaces
+    slot = _SLOT_PATTERN.search(record['link_name'] or '')
+    device_row = dict(record, slot=int(slot.group(1)) if slot else None)
+    for interface in record['interfaces'] or [{'name': None, 'port_number': None}]:
+        yield interface, dict(device_row, interface=interface['name'], port_number=interface['port_number'])
+
+
+def filter_records(node, records):
+    # Devices match when any of their interfaces match. When the query names interface fields, only the
+    # matching interfaces are kept.
+    by_interface = bool(_fields(node) & set(_INTERFACE_FIELDS))
+    for record in records:
+        matches = [interface for interface, row in _rows(record) if evaluate(node, row)]
+        if matches:
+            yield dict(record, interfaces=[interface for interface in matches if interface['name'] is not None]) if by_interface else record
+
+
+def _pushdown(node):
+    # Equality predicates that every match must satisfy, on fields the driver filters on
+    comparisons = node[1] if node[0] == 'and' else [node]
+    pushed = {}
+    for comparison in comparisons:
+        if comparison[0] == 'compare' and comparison[2] == '=' and comparison[1] in ('serial_number', 'interface', 'chassis'):
+            pushed.setdefault(comparison[1], comparison[3])
+    return pushed
+
+
+def _find(session, expert_names, **properties):
+    filter = session.create_filter()
+    for name, value in properties.items():
+        setattr(filter, name, value)
+    return list(session.find_hardware(filter=filter, expert_names=expert_names))
+
+
+def query_records(session, node):
+    # Only the devices, interfaces and chassis that the pushed-down predicates allow are read from the
+    # driver; they are linked through in-memory indexes on their link names.
+    pushed = _pushdown(node)
+    xnet = [utilities._XNET_EXPERT_NAME]
+    chassis_properties = {'is_chassis': True}
+    if 'chassis' in pushed:
+        chassis_properties['user_alias'] = pushed['chassis']
+    chassis_resources = None
+    device_properties = {'is_device': True}
+    if 'serial_number' in pushed:
+        device_properties['serial_number'] = pushed['serial_number']
+    if 'chassis' in pushed:
+        chassis_resources = _find(session, [], **chassis_properties)
+        if not chassis_resources:
+            return []
+        if len(chassis_resources) == 1:
+            device_properties['connects_to_link_name'] = chassis_resources[0].provides_link_name
+    interface_properties = {'is_device': False}
+    if 'interface' in pushed:
+        interface_properties['user_alias'] = pushed['interface']
+
+    device_resources = _find(session, xnet, **device_properties)
+    if not device_resources:
+        return []
+    if len(device_resources) == 1:
+        interface_properties['connects_to_link_name'] = device_resources[0].provides_link_name
+    interfaces_by_link_name = defaultdict(list)
+    for interface_resource in _find(session, xnet, **interface_properties):
+        interfaces_by_link_name[interface_resource.connects_to_link_name].append(interface_resource)
+    if 'interface' in pushed and not interfaces_by_link_name:
+        return []
+
+    chassis_by_link_name = {}
+    if any(device_resource.connects_to_link_name for device_resource in device_resources):
+        if chassis_resources is None:
+            chassis_resources = _find(session, [], **chassis_properties)
+        chassis_by_link_name = dict(
+            (chassis_resource.provides_link_name, ChassisBranch.from_resource(chassis_resource, [])) for chassis_resource in chassis_resources)
+    records = []
+    for device_resource in device_resources:
+        chassis = chassis_by_link_name.get(device_resource.connects_to_link_name)
+        if device_resource.connects_to_link_name and chassis is None:
+            continue
+        records.append(DeviceBranch.from_resource(device_resource, interfaces_by_link_name[device_resource.provides_link_name]).to_record(chassis))
+    # List devices outside a chassis first, like the system tree
+    return sorted(records, key=lambda record: record['chassis'] is not None)
+
+
+def find_records(query):
+    node = parse_query(query)
+    tree = utilities._get_cached_system_tree()
+    if tree is not None:
+        return list(filter_records(node, tree.iter_records()))
+    with utilities.open_session() as session:
+        return list(filter_records(node, query_records(session, node)))
+
+
+def find_xnet_devices(query, output_format='text', stream=None):
+    stream = stream or sys.stdout
+    records = find_records(' '.join(query) if isinstance(query, (list, tuple)) else query)
+    if output_format != 'text':
+        report.write_records(records, output_format, stream)
+        return
+    if not records:
+        stream.write('No matching devices\n')
+        return
+    header = ('Serial', 'Product', 'Chassis', 'Slot', 'Firmware', 'Interface', 'Port')
+    rows = [header]
+    for record in records:
+        for interface, row in _rows(record):
+            rows.append(tuple('' if value is None else str(value) for value in (
+                record['serial_number'], record['product_name'], record['chassis'], row['slot'], record['firmware_revision'],
+                interface['name'], interface['port_number'])))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    for row in rows:
+        stream.write('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() + '\n')
@@ -0,0 +1,102 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import io
+import logging
+from nixnetconfig import report
+from nixnetconfig import utilities
+import sys
+import time
+
+
+logger = logging.getLogger('nixnetconfig')
+_DEFAULT_TARGET_JOBS = 8
+
+TargetResult = namedtuple('TargetResult', ['target', 'value', 'output', 'error', 'duration'])
+
+
+class RemoteTargetError(utilities.XnetConfigError):
+    def __init__(self, failed_count, total_count):
+        super().__init__(message='{} of {} targets failed'.format(failed_count, total_count))
+
+
+def parse_targets(targets=None, targets_file=None):
+    # --target takes comma-separated host names and may be repeated; a targets file lists one host per line
+    names = []
+    for value in targets or []:
+        names.extend(value.split(','))
+    if targets_file:
+        try:
+            with open(targets_file, 'r') as file:
+                names.extend(line.split('#', 1)[0] for line in file)
+        except OSError as err:
+            raise utilities.XnetConfigError('Could not read targets file "{}": {}'.format(targets_file, err.strerror))
+    unique_names = []
+    for name in (name.strip() for name in names):
+        if name and name not in unique_names:
+            unique_names.append(name)
+    if not unique_names:
+        raise utilities.XnetConfigError('No targets were specified')
+    return unique_names
+
+
+def run_on_targets(function, targets, jobs=_DEFAULT_TARGET_JOBS):
+    # Runs function once per target, each in a thread bound to that target, and returns the results in the
+    # order of the targets. What each run prints is captured rather than interleaved.
+    stdout = utilities.ThreadLocalStream(sys.stdout)
+
+    def run(target):
+        output = io.StringIO()
+        stdout.redirect(output)
+        start_time = time.perf_counter()
+        value, error = None, None
+        try:
+            with utilities.using_target(target):
+                value = function()
+        except utilities.XnetConfigError as err:
+            error = err.message
+        except Exception as err:
+            logger.debug('Operation failed on {}'.format(target), exc_info=True)
+            error = str(err) or 'Operation failed'
+        finally:
+            stdout.redirect(None)
+        return TargetResult(target, value, output.getvalue(), error, time.perf_counter() - start_time)
+
+    original_stdout, sys.stdout = sys.stdout, stdout
+    try:
+        with ThreadPoolExecutor(max_workers=max(jobs, 1), thread_name_prefix='nixnetconfig-target') as executor:
+            return list(executor.map(run, targets))
+    finally:
+        sys.stdout = original_stdout
+
+
+def report_target_results(results):
+    for result in results:
+        for line in result.output.splitlines():
+            print('[{}] {}'.format(result.target, line))
+        if result.error is not None:
+            print('[{}] ERROR: {}'.format(result.target, result.error), file=sys.stderr)
+    failed_count = sum(1 for result in results if result.error is not None)
+    if failed_count:
+        raise RemoteTargetError(failed_count, len(results))
+
+
+def enumerate_targets(targets, output_format, jobs=_DEFAULT_TARGET_JOBS):
+    # Machine-readable formats merge the devices of every target into one document, with a target field
+    results = run_on_targets(lambda: list(utilities.get_system_tree().iter_records()), targets, jobs)
+    records = [dict([('target', result.target)] + list(record.items())) for result in results for record in result.value or []]
+    report.write_records(records, output_format, leading_fields=('target',))
+    report_target_results([result._replace(output='') for result in results])
+
+
+def run_command(command_name, command, arguments, targets, jobs=_DEFAULT_TARGET_JOBS, enumerate_after=False):
+    if arguments.get('watch'):
+        raise utilities.XnetConfigError('Watching is not supported with remote targets')
+    if command_name == 'enumerate' and arguments.get('output_format', 'text') != 'text':
+        enumerate_targets(targets, arguments['output_format'], jobs)
+        return
+
+    def run():
+        command(**arguments)
+        if enumerate_after:
+            utilities.enumerate_xnet_devices()
+    report_target_results(run_on_targets(run, targets, jobs))
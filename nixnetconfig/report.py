@@ -0,0 +1,30 @@
+import csv
+import json
+import sys
+
+
+CSV_FIELDS = (
+    'chassis', 'chassis_serial_number', 'product_name', 'serial_number', 'firmware_revision', 'link_name',
+    'connects_to_link_name', 'interface', 'port_number',
+)
+
+
+def write_records(records, output_format, stream=None, leading_fields=()):
+    # leading_fields name extra keys of each record, such as the target it was read from, for the CSV columns
+    stream = stream or sys.stdout
+    if output_format == 'json':
+        json.dump({'devices': list(records)}, stream, indent=2)
+        stream.write('\n')
+    elif output_format == 'ndjson':
+        for record in records:
+            stream.write(json.dumps(record) + '\n')
+            stream.flush()
+    else:
+        writer = csv.writer(stream, lineterminator='\n')
+        writer.writerow(tuple(leading_fields) + CSV_FIELDS)
+        for record in records:
+            # One row per interface, or a single row for a device without interfaces
+            device_row = [record[field] for field in tuple(leading_fields) + CSV_FIELDS[:-2]]
+            for interface in record['interfaces'] or [{'name': None, 'port_number': None}]:
+                writer.writerow(device_row + [interface['name'], interface['port_number']])
+            stream.flush()
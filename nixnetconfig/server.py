@@ -0,0 +1,249 @@
+import contextlib
+import io
+import json
+import logging
+from nixnetconfig import cache
+from nixnetconfig import client
+from nixnetconfig import parser
+from nixnetconfig import utilities
+import os
+import socketserver
+import sys
+import threading
+
+
+logger = logging.getLogger('nixnetconfig')
+_DEFAULT_RESCAN_INTERVAL = 60.0
+_READ_COMMANDS = ('enumerate', 'version', 'firmware-status', 'find', 'history', 'completion')
+# Log levels of the -v counts of a request; more than one -v logs everything
+_REQUEST_LOG_LEVELS = {None: logging.WARNING, 1: logging.INFO}
+# Destinations of the arguments and options that name files
+_PATH_ARGUMENTS = ('plan_file', 'journal_file', 'resume_file', 'snapshot_file')
+
+
+class ReadWriteLock(object):
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writer:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._writer = True
+
+    def release_write(self):
+        with self._condition:
+            self._writer = False
+            self._condition.notify_all()
+
+
+class SessionPool(object):
+    # A driver session serves one thread at a time. Each command borrows an idle session, or opens another
+    # when every session is busy, and returns it when it finishes; close() closes the sessions it opened.
+    def __init__(self, session):
+        self._lock = threading.Lock()
+        self._idle = [session]
+        self._exit_stack = contextlib.ExitStack()
+
+    @contextlib.contextmanager
+    def borrow(self):
+        with self._lock:
+            session = self._idle.pop() if self._idle else self._exit_stack.enter_context(utilities.open_session())
+        try:
+            yield session
+        finally:
+            with self._lock:
+                self._idle.append(session)
+
+    def close(self):
+        with self._lock:
+            self._exit_stack.close()
+
+
+def _resolve_paths(args, cwd):
+    # Relative file arguments name files in the client's directory, not the daemon's
+    for name in _PATH_ARGUMENTS:
+        value = getattr(args, name, None)
+        if value:
+            setattr(args, name, os.path.join(cwd, value))
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode('utf-8'))
+        response = self.server.daemon.run_request(request['argv'], request.get('cwd'))
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class _UnixStreamServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon(object):
+    def __init__(self, session, socket_path, rescan_interval=_DEFAULT_RESCAN_INTERVAL):
+        self.sessions = SessionPool(session)
+        self.socket_path = socket_path
+        self.rescan_interval = rescan_interval
+        self.lock = ReadWriteLock()
+        self._log_levels = threading.local()
+        self.stdout = utilities.ThreadLocalStream(sys.stdout)
+        self.stderr = utilities.ThreadLocalStream(sys.stderr)
+        self._stopped = threading.Event()
+        self._server = None
+
+    def run_request(self, argv, cwd=None):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        self.stdout.redirect(stdout)
+        self.stderr.redirect(stderr)
+        try:
+            exit_code = self._run_command(argv, cwd)
+        finally:
+            self.stdout.redirect(None)
+            self.stderr.redirect(None)
+        return {'exit_code': exit_code, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+    def _run_command(self, argv, cwd):
+        command_name = parser.get_command_name(argv) or 'enumerate'
+        if client.is_local(argv):
+            print('ERROR: The "{}" command cannot be run by the daemon'.format(command_name), file=sys.stderr)
+            return 1
+        try:
+            args = parser.get_parser(argv).parse_args(argv)
+        except SystemExit as exit:
+            return exit.code or 0
+        if cwd:
+            _resolve_paths(args, cwd)
+        self._log_levels.level = _REQUEST_LOG_LEVELS.get(args.verbose, logging.DEBUG)
+        try:
+            return self._run_locked(command_name, args)
+        finally:
+            del self._log_levels.level
+
+    def _run_locked(self, command_name, args):
+        is_write = command_name not in _READ_COMMANDS
+        if is_write:
+            self.lock.acquire_write()
+        else:
+            self.lock.acquire_read()
+        try:
+            with self.sessions.borrow() as session, utilities.using_session(session):
+                if args.refresh:
+                    cache.invalidate()
+                try:
+                    args.command(**parser.get_command_arguments(args))
+                    if args.enumerate:
+                        utilities.enumerate_xnet_devices()
+                except utilities.XnetConfigError as err:
+                    print('ERROR: ' + err.message, file=sys.stderr)
+                    return 1
+                except Exception:
+                    logger.debug('Daemon request failed', exc_info=True)
+                    print('ERROR: Operation failed', file=sys.stderr)
+                    return 1
+                finally:
+                    if is_write:
+                        self._rescan_with_current_session()
+            return 0
+        finally:
+            if is_write:
+                self.lock.release_write()
+            else:
+                self.lock.release_read()
+
+    def rescan(self):
+        with self.sessions.borrow() as session, utilities.using_session(session):
+            self._rescan_with_current_session()
+
+    def _rescan_with_current_session(self):
+        cache.invalidate()
+        try:
+            utilities.get_system_tree()
+        except Exception:
+            logger.debug('Hardware rescan failed', exc_info=True)
+
+    def _rescan_periodically(self):
+        while not self._stopped.wait(self.rescan_interval):
+            self.lock.acquire_read()
+            try:
+                self.rescan()
+            finally:
+                self.lock.release_read()
+
+    def _filter_log_record(self, record):
+        # Requests log at the level of their own -v options, and the daemon at the level it started with
+        return record.levelno >= getattr(self._log_levels, 'level', self._daemon_log_level)
+
+    @contextlib.contextmanager
+    def _logging_to_requests(self):
+        # Log messages of a request thread go to the output of the request, like its prints
+        self._daemon_log_level = logger.getEffectiveLevel()
+        streams = {sys.stdout: self.stdout, sys.stderr: self.stderr}
+        handlers = [(handler, handler.stream) for handler in logger.handlers if getattr(handler, 'stream', None) in streams]
+        for handler, stream in handlers:
+            handler.stream = streams[stream]
+        previous_level = logger.level
+        logger.setLevel(logging.DEBUG)
+        logger.addFilter(self._filter_log_record)
+        try:
+            yield
+        finally:
+            logger.removeFilter(self._filter_log_record)
+            logger.setLevel(previous_level)
+            for handler, stream in handlers:
+                handler.stream = stream
+
+    def serve_forever(self):
+        # Only the user who runs the daemon may connect to it, since it runs their commands
+        os.makedirs(os.path.dirname(self.socket_path) or '.', mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        previous_umask = os.umask(0o177)
+        try:
+            self._server = _UnixStreamServer(self.socket_path, _RequestHandler)
+        finally:
+            os.umask(previous_umask)
+        self._server.daemon = self
+        original_streams = sys.stdout, sys.stderr
+        rescan_thread = threading.Thread(target=self._rescan_periodically, daemon=True)
+        with self._logging_to_requests():
+            sys.stdout, sys.stderr = self.stdout, self.stderr
+            rescan_thread.start()
+            try:
+                self._server.serve_forever()
+            finally:
+                self._stopped.set()
+                sys.stdout, sys.stderr = original_streams
+                self._server.server_close()
+                os.remove(self.socket_path)
+                self.sessions.close()
+
+    def shutdown(self):
+        self._server.shutdown()
+
+
+def serve(socket_path=None, rescan_interval=_DEFAULT_RESCAN_INTERVAL):
+    if not client.is_supported():
+        raise utilities.XnetConfigError('The daemon requires Unix domain socket support')
+    socket_path = socket_path or client.get_socket_path()
+    cache.configure(in_memory=True, ttl=rescan_interval)
+    with utilities.open_session() as session:
+        daemon = Daemon(session, socket_path, rescan_interval)
+        daemon.rescan()
+        logger.info('Serving on {}'.format(socket_path))
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
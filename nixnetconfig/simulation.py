@@ -0,0 +1,240 @@
+from collections import Counter
+from collections import namedtuple
+import threading
+import time
+
+
+# Values of nisyscfg.enums.FilterMode, repeated so that the simulation runs without the driver installed
+MATCH_VALUES_ALL = 1
+MATCH_VALUES_ANY = 2
+MATCH_VALUES_NONE = 3
+ALL_PROPERTIES_EXIST = 4
+
+_XNET_EXPERT_NAME = 'xnet'
+_SIMULATED_CALLS = ('find_hardware', 'rename', 'save_changes', 'self_test', 'upgrade_firmware')
+# Reading any of these properties is a driver call of its own, delayed by the "get" latency of the spec
+_SIMULATED_PROPERTIES = frozenset((
+    'is_device', 'is_chassis', 'expert_user_alias', 'connects_to_link_name', 'provides_link_name', 'product_name', 'serial_number',
+    'firmware_revision', 'available_firmware_version', 'xnet'))
+# Value of nisyscfg.errors.Status.NAME_COLLISION
+_NAME_COLLISION = -2147220613
+_DEFAULT_FIRMWARE_REVISION = '19072316'
+_DEFAULT_XNET_VERSION = '20.0.0'
+
+SimulatedComponent = namedtuple('SimulatedComponent', ['id', 'version', 'title', 'type', 'details'])
+
+
+class SimulationSpecError(ValueError):
+    pass
+
+
+class SimulatedDriverError(Exception):
+    # Raised like nisyscfg.errors.LibraryError, with the status code of the driver
+    def __init__(self, code, description):
+        self.code = code
+        self.description = description
+        super().__init__('{}: {}'.format(code, description))
+
+
+class _PropertyBag(object):
+    def __init__(self, **properties):
+        self.__dict__.update(properties)
+
+
+class SimulatedFilter(object):
+    def __init__(self):
+        self.__dict__['properties'] = {}
+        self.__dict__['xnet'] = _FilterExpert(self.properties)
+
+    def __setattr__(self, name, value):
+        self.properties[name] = value
+
+
+class _FilterExpert(object):
+    def __init__(self, properties):
+        self.__dict__['properties'] = properties
+
+    def __setattr__(self, name, value):
+        self.properties['xnet.' + name] = value
+
+
+class SimulatedResource(object):
+    def __init__(self, system, expert_names, **properties):
+        self._system = system
+        self.expert_names = expert_names
+        self.is_device = properties.pop('is_device', False)
+        self.is_chassis = properties.pop('is_chassis', False)
+        self.expert_user_alias = [properties.pop('user_alias', '')]
+        self.connects_to_link_name = properties.pop('connects_to_link_name', '')
+        self.provides_link_name = properties.pop('provides_link_name', '')
+        self.product_name = properties.pop('product_name', '')
+        self.serial_number = properties.pop('serial_number', '')
+        self.firmware_revision = properties.pop('firmware_revision', '')
+        self.available_firmware_version = properties.pop('available_firmware_version', [])
+        self.xnet = _PropertyBag(**properties)
+
+    def __getattribute__(self, name):
+        if name in _SIMULATED_PROPERTIES:
+            object.__getattribute__(self, '_system').simulate_property_read()
+        return object.__getattribute__(self, name)
+
+    def get_property(self, name):
+        # Filters are matched inside the driver, without property reads
+        properties = self.__dict__
+        if name == 'user_alias':
+            return properties['expert_user_alias'][0]
+        if name.startswith('xnet.'):
+            return getattr(properties['xnet'], name[len('xnet.'):], None)
+        return properties.get(name)
+
+    def rename(self, new_name, overwrite_conflict=False, update_dependencies=False):
+        # Like the driver, returns the resource that lost its name to this one
+        self._system.simulate_call('rename')
+        conflict = next((
+            resource for resource in self._system.resources
+            if resource is not self and resource.expert_names & self.expert_names and _property_equals(resource.get_property('user_alias'), new_name)),
+            None)
+        if conflict is not None:
+            if not overwrite_conflict:
+                raise SimulatedDriverError(_NAME_COLLISION, 'The name "{}" is already in use'.format(new_name))
+            conflict.__dict__['expert_user_alias'][0] = ''
+        self.expert_user_alias[0] = new_name
+        return conflict
+
+    def save_changes(self):
+        self._system.simulate_call('save_changes')
+
+    def self_test(self, mode=0):
+        self._system.simulate_call('self_test')
+
+    def upgrade_firmware(self, version='0', **kwargs):
+        self._system.simulate_call('upgrade_firmware')
+        self.firmware_revision = self._system.firmware_revision
+
+
+class SimulatedSession(object):
+    def __init__(self, system):
+        self._system = system
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def create_filter(self):
+        return SimulatedFilter()
+
+    def find_hardware(self, filter=None, mode=MATCH_VALUES_ALL, expert_names=''):
+        self._system.simulate_call('find_hardware')
+        if isinstance(expert_names, str):
+            expert_names = expert_names.split(',')
+        expert_names = set(name.strip().lower() for name in expert_names if name.strip())
+        properties = filter.properties if filter is not None else {}
+        return iter([
+            resource for resource in self._system.resources
+            if (not expert_names or expert_names & resource.expert_names) and _matches(resource, properties, mode)])
+
+    def get_installed_software_components(self, *args, **kwargs):
+        return [SimulatedComponent('ni-xnet', self._system.xnet_version, 'NI-XNET', '', '')]
+
+
+def _matches(resource, properties, mode):
+    if not properties:
+        return True
+    if mode == ALL_PROPERTIES_EXIST:
+        return all(resource.get_property(name) is not None for name in properties)
+    matches = [_property_equals(resource.get_property(name), value) for name, value in properties.items()]
+    if mode == MATCH_VALUES_ANY:
+        return any(matches)
+    if mode == MATCH_VALUES_NONE:
+        return not any(matches)
+    return all(matches)
+
+
+def _property_equals(actual, expected):
+    # System Configuration compares strings, such as aliases and serial numbers, without regard to case
+    if isinstance(actual, str) and isinstance(expected, str):
+        return actual.lower() == expected.lower()
+    return actual == expected
+
+
+class SimulatedSystem(object):
+    def __init__(self, chassis=1, devices=1, ports=2, standalone=0, latency=None, property_latency=0.0,
+                 firmware_revision=_DEFAULT_FIRMWARE_REVISION, xnet_version=_DEFAULT_XNET_VERSION):
+        self._arguments = dict(
+            chassis=chassis, devices=devices, ports=ports, standalone=standalone, latency=latency, property_latency=property_latency,
+            firmware_revision=firmware_revision, xnet_version=xnet_version)
+        # Remote targets each get a system of their own, with the same hardware
+        self.targets = {}
+        self.latency = dict((call, 0.0) for call in _SIMULATED_CALLS)
+        self.latency.update(latency or {})
+        self.property_latency = property_latency
+        self.firmware_revision = firmware_revision
+        self.xnet_version = xnet_version
+        self.call_counts = Counter()
+        self._lock = threading.Lock()
+        self._interface_count = 0
+        self.resources = []
+
+        for chassis_index in range(1, chassis + 1):
+            link_name = 'PXI{}'.format(chassis_index)
+            self.resources.append(SimulatedResource(
+                self, set(), is_chassis=True, user_alias='Chassis{}'.format(chassis_index), provides_link_name=link_name,
+                product_name='NI PXIe-1085', serial_number='C{:07X}'.format(chassis_index)))
+            for device_index in range(1, devices + 1):
+                self._add_device(link_name, chassis_index, device_index, ports)
+        for device_index in range(1, standalone + 1):
+            self._add_device('', 0, device_index, ports)
+
+    def _add_device(self, chassis_link_name, chassis_index, device_index, ports):
+        link_name = '{}Slot{}'.format(chassis_link_name or 'PCI', device_index + 1)
+        serial_number = '{:04X}{:04X}'.format(chassis_index, device_index)
+        self.resources.append(SimulatedResource(
+            self, {_XNET_EXPERT_NAME}, is_device=True, connects_to_link_name=chassis_link_name, provides_link_name=link_name,
+            product_name='NI PXI-8513', serial_number=serial_number, firmware_revision=self.firmware_revision,
+            available_firmware_version=[self.firmware_revision], user_alias=serial_number))
+        for port_number in range(1, ports + 1):
+            self._interface_count += 1
+            self.resources.append(SimulatedResource(
+                self, {_XNET_EXPERT_NAME}, connects_to_link_name=link_name, user_alias='CAN{}'.format(self._interface_count),
+                port_number=port_number, blink=0))
+
+    @classmethod
+    def from_spec(cls, spec):
+        # <chassis>x<devices>x<ports>[,standalone=<count>][,latency=<seconds>][,<call>=<seconds>][,get=<seconds>]...
+        fields = [field.strip() for field in spec.split(',') if field.strip()]
+        try:
+            sizes = [int(size) for size in fields[0].lower().split('x')] if fields else []
+            if len(sizes) != 3 or min(sizes) < 0:
+                raise ValueError
+            options = dict(field.split('=', 1) for field in fields[1:])
+            standalone = int(options.pop('standalone', 0))
+            default_latency = float(options.pop('latency', 0.0))
+            property_latency = float(options.pop('get', 0.0))
+            latency = dict((call, default_latency) for call in _SIMULATED_CALLS)
+            for call, seconds in options.items():
+                if call not in latency:
+                    raise ValueError
+                latency[call] = float(seconds)
+        except ValueError:
+            raise SimulationSpecError('Invalid simulation spec "{}"'.format(spec))
+        return cls(*sizes, standalone=standalone, latency=latency, property_latency=property_latency)
+
+    def simulate_call(self, call):
+        with self._lock:
+            self.call_counts[call] += 1
+        if self.latency[call]:
+            time.sleep(self.latency[call])
+
+    def simulate_property_read(self):
+        if self.property_latency:
+            time.sleep(self.property_latency)
+
+    def create_session(self, target=None):
+        if target is None or target == 'localhost':
+            return SimulatedSession(self)
+        with self._lock:
+            if target not in self.targets:
+                self.targets[target] = SimulatedSystem(**self._arguments)
+        return self.targets[target].create_session()
@@ -1,32 +1,75 @@
-from nisyscfg import Session
+from collections import defaultdict
+import logging
+import typing
 
+if typing.TYPE_CHECKING:  # pragma: no cover
+    from nisyscfg import Session
 
+
+logger = logging.getLogger('nixnetconfig')
 _LINE_INDENT = "    "
 
 
 class InterfaceBranch(object):
-    def __init__(self, resource, indent):
-        self.name = resource.expert_user_alias[0]
+    def __init__(self, name, port_number, indent):
+        self.name = name
+        self.port_number = port_number
         self.indent = _LINE_INDENT * indent
 
+    @classmethod
+    def from_resource(cls, resource, indent):
+        return cls(resource.expert_user_alias[0], resource.xnet.port_number, indent)
+
+    @classmethod
+    def from_dict(cls, data, indent):
+        return cls(data['name'], data['port_number'], indent)
+
+    def to_dict(self):
+        return {'name': self.name, 'port_number': self.port_number}
+
     def report(self):
         print(self.indent + "Interface:", self.name)
 
 
 class DeviceBranch(object):
-    def __init__(self, expert_name, session: Session, resource, indent=1):
-        self.name = resource.product_name
-        self.serial_num = resource.serial_number
-        self.firmware_revision = resource.firmware_revision
-        self.device_link_name = resource.provides_link_name
-        self.interfaces = []
+    def __init__(self, name, serial_num, firmware_revision, device_link_name, interfaces, indent=1):
+        self.name = name
+        self.serial_num = serial_num
+        self.firmware_revision = firmware_revision
+        self.device_link_name = device_link_name
+        self.interfaces = interfaces
         self.indent = _LINE_INDENT * indent
 
-        filter = session.create_filter()
-        filter.is_device = False
-        filter.connects_to_link_name = self.device_link_name
-        for interface_resource in session.find_hardware(filter=filter, expert_names=[expert_name]):
-            self.interfaces.append(InterfaceBranch(interface_resource, indent + 1))
+    @classmethod
+    def from_resource(cls, resource, interface_resources, indent=1):
+        interfaces = [InterfaceBranch.from_resource(interface_resource, indent + 1) for interface_resource in interface_resources]
+        return cls(resource.product_name, resource.serial_number, resource.firmware_revision, resource.provides_link_name, interfaces, indent)
+
+    @classmethod
+    def from_dict(cls, data, indent=1):
+        interfaces = [InterfaceBranch.from_dict(interface, indent + 1) for interface in data['interfaces']]
+        return cls(data['name'], data['serial_number'], data['firmware_revision'], data['link_name'], interfaces, indent)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'serial_number': self.serial_num,
+            'firmware_revision': self.firmware_revision,
+            'link_name': self.device_link_name,
+            'interfaces': [interface.to_dict() for interface in self.interfaces],
+        }
+
+    def to_record(self, chassis=None):
+        return {
+            'chassis': chassis.name if chassis else None,
+            'chassis_serial_number': chassis.serial_num if chassis else None,
+            'product_name': self.name,
+            'serial_number': self.serial_num,
+            'firmware_revision': self.firmware_revision,
+            'link_name': self.device_link_name,
+            'connects_to_link_name': chassis.chassis_link_name if chassis else '',
+            'interfaces': [interface.to_dict() for interface in self.interfaces],
+        }
 
     def report(self):
         if self.firmware_revision:
@@ -38,17 +81,28 @@ class DeviceBranch(object):
 
 
 class ChassisBranch(object):
-    def __init__(self, expert_name, session: Session, resource):
-        self.name = resource.expert_user_alias[0]
-        self.serial_num = resource.serial_number
-        self.chassis_link_name = resource.provides_link_name
-        self.devices = []
+    def __init__(self, name, serial_num, chassis_link_name, devices):
+        self.name = name
+        self.serial_num = serial_num
+        self.chassis_link_name = chassis_link_name
+        self.devices = devices
+
+    @classmethod
+    def from_resource(cls, resource, devices):
+        return cls(resource.expert_user_alias[0], resource.serial_number, resource.provides_link_name, devices)
 
-        filter = session.create_filter()
-        filter.is_device = True
-        filter.connects_to_link_name = self.chassis_link_name
-        for device_resource in session.find_hardware(filter=filter, expert_names=[expert_name]):
-            self.devices.append(DeviceBranch(expert_name, session, device_resource, 2))
+    @classmethod
+    def from_dict(cls, data):
+        devices = [DeviceBranch.from_dict(device, 2) for device in data['devices']]
+        return cls(data['name'], data['serial_number'], data['link_name'], devices)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'serial_number': self.serial_num,
+            'link_name': self.chassis_link_name,
+            'devices': [device.to_dict() for device in self.devices],
+        }
 
     def report(self):
         if self.devices:
@@ -58,20 +112,109 @@ class ChassisBranch(object):
 
 
 class SystemTree(object):
-    def __init__(self, expert_name, session: Session):
+    def __init__(self, expert_name, session: 'Session'):
         self.chassis = []
         self.devices = []
+        self.query_count = 0
+
+        # Query every device and interface of the expert at once and link them in memory,
+        # rather than issuing one find_hardware call per chassis and per device.
+        self.query_count += 1
+        device_resources, interface_resources = find_expert_resources(expert_name, session)
+
+        devices_by_link_name = defaultdict(list)
+        for device_resource in device_resources:
+            devices_by_link_name[device_resource.connects_to_link_name].append(device_resource)
+
+        for device_resource in devices_by_link_name.pop("", []):
+            self.devices.append(DeviceBranch.from_resource(device_resource, interface_resources[device_resource.provides_link_name]))
+
+        # Chassis are not owned by the expert, so they need a query of their own. Skip it
+        # when no device is plugged into anything.
+        if devices_by_link_name:
+            chassis_filter = session.create_filter()
+            chassis_filter.is_chassis = True
+            for chassis_resource in self._find_hardware(session, chassis_filter, []):
+                devices = [
+                    DeviceBranch.from_resource(device_resource, interface_resources[device_resource.provides_link_name], 2)
+                    for device_resource in devices_by_link_name[chassis_resource.provides_link_name]
+                ]
+                self.chassis.append(ChassisBranch.from_resource(chassis_resource, devices))
 
+        logger.debug('Enumerated system with {} driver queries'.format(self.query_count))
+
+    @classmethod
+    def from_subtrees(cls, expert_name, session: 'Session', open_worker_session, jobs):
+        # Discovers the devices outside a chassis and each chassis with its devices on up to jobs worker
+        # threads. Driver sessions are not shared between threads, so every worker opens its own with
+        # open_worker_session(). This makes more queries than __init__, but spreads the property reads,
+        # one driver call each, of a large system over the workers. Subtrees merge back in the order
+        # __init__ reports them.
+        tree = cls.__new__(cls)
+        tree.query_count = 0
         chassis_filter = session.create_filter()
         chassis_filter.is_chassis = True
-        for chassis_resource in session.find_hardware(filter=chassis_filter, expert_names=[]):
-            self.chassis.append(ChassisBranch(expert_name, session, chassis_resource))
+        chassis_list = [ChassisBranch.from_resource(resource, []) for resource in tree._find_hardware(session, chassis_filter, [])]
+
+        def discover(link_name):
+            with open_worker_session() as worker_session:
+                return _find_subtree(expert_name, worker_session, link_name)
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            subtrees = list(executor.map(discover, [''] + [a_chassis.chassis_link_name for a_chassis in chassis_list]))
+        for a_chassis, (devices, query_count) in zip([None] + chassis_list, subtrees):
+            tree.query_count += query_count
+            if a_chassis is None:
+                tree.devices = devices
+            else:
+                a_chassis.devices = devices
+        # Like __init__, list the chassis only when a device is plugged into one
+        tree.chassis = chassis_list if any(a_chassis.devices for a_chassis in chassis_list) else []
+        logger.debug('Enumerated system with {} driver queries on {} workers'.format(tree.query_count, jobs))
+        return tree
+
+    @classmethod
+    def from_dict(cls, data):
+        tree = cls.__new__(cls)
+        tree.devices = [DeviceBranch.from_dict(device) for device in data['devices']]
+        tree.chassis = [ChassisBranch.from_dict(chassis) for chassis in data['chassis']]
+        tree.query_count = 0
+        return tree
 
-        device_filter = session.create_filter()
-        device_filter.is_device = True
-        device_filter.connects_to_link_name = ""
-        for device_resource in session.find_hardware(filter=device_filter, expert_names=[expert_name]):
-            self.devices.append(DeviceBranch(expert_name, session, device_resource))
+    def to_dict(self):
+        return {
+            'devices': [device.to_dict() for device in self.devices],
+            'chassis': [chassis.to_dict() for chassis in self.chassis],
+        }
+
+    def _find_hardware(self, session, filter, expert_names):
+        self.query_count += 1
+        return session.find_hardware(filter=filter, expert_names=expert_names)
+
+    def iter_records(self):
+        for device in self.devices:
+            yield device.to_record()
+        for a_chassis in self.chassis:
+            for device in a_chassis.devices:
+                yield device.to_record(a_chassis)
+
+    def iter_devices(self):
+        for device in self.devices:
+            yield device
+        for a_chassis in self.chassis:
+            for device in a_chassis.devices:
+                yield device
+
+    def find_device(self, serial_number):
+        return next((device for device in self.iter_devices() if device.serial_num == serial_number), None)
+
+    def find_interface(self, name):
+        for device in self.iter_devices():
+            for interface in device.interfaces:
+                if interface.name.upper() == name.upper():
+                    return interface
+        return None
 
     def report(self):
         print("My System:")
@@ -82,3 +225,69 @@ class SystemTree(object):
             a_chassis.report()
 
 
+def find_expert_resources(expert_name, session: 'Session'):
+    # One query returns every device and interface of the expert. Returns the device resources, and the
+    # interface resources keyed on the link name of the device they connect to, so that callers link
+    # them in memory with iter_device_interfaces.
+    device_resources = []
+    interface_resources = defaultdict(list)
+    for resource in session.find_hardware(filter=session.create_filter(), expert_names=[expert_name]):
+        if resource.is_device:
+            device_resources.append(resource)
+        else:
+            interface_resources[resource.connects_to_link_name].append(resource)
+    return device_resources, interface_resources
+
+
+def iter_device_interfaces(device_resources, interface_resources):
+    # Yields each device found by find_expert_resources with the list of its interface resources
+    for device_resource in device_resources:
+        yield device_resource, interface_resources.get(device_resource.provides_link_name, [])
+
+
+def _find_subtree(expert_name, session: 'Session', link_name):
+    # The devices connected to link_name, with their interfaces, and the number of queries made. An empty
+    # link name stands for the devices outside a chassis, which no filter selects on its own.
+    device_filter = session.create_filter()
+    device_filter.is_device = True
+    if link_name:
+        device_filter.connects_to_link_name = link_name
+    device_resources = [
+        resource for resource in session.find_hardware(filter=device_filter, expert_names=[expert_name])
+        if link_name or not resource.connects_to_link_name]
+    devices = []
+    for device_resource in device_resources:
+        interface_filter = session.create_filter()
+        interface_filter.is_device = False
+        interface_filter.connects_to_link_name = device_resource.provides_link_name
+        interface_resources = session.find_hardware(filter=interface_filter, expert_names=[expert_name])
+        devices.append(DeviceBranch.from_resource(device_resource, interface_resources, 2 if link_name else 1))
+    return devices, 1 + len(device_resources)
+
+
+def iter_device_records(expert_name, session: 'Session'):
+    # Yields each device as the driver returns it. Only the interfaces, and the chassis when a device
+    # sits in one, are held in memory, so large systems produce output without building a SystemTree.
+    interface_filter = session.create_filter()
+    interface_filter.is_device = False
+    interfaces = defaultdict(list)
+    for interface_resource in session.find_hardware(filter=interface_filter, expert_names=[expert_name]):
+        interfaces[interface_resource.connects_to_link_name].append(interface_resource)
+
+    chassis_by_link_name = None
+    device_filter = session.create_filter()
+    device_filter.is_device = True
+    for device_resource in session.find_hardware(filter=device_filter, expert_names=[expert_name]):
+        chassis = None
+        if device_resource.connects_to_link_name:
+            if chassis_by_link_name is None:
+                chassis_filter = session.create_filter()
+                chassis_filter.is_chassis = True
+                chassis_by_link_name = dict(
+                    (chassis_resource.provides_link_name, ChassisBranch.from_resource(chassis_resource, []))
+                    for chassis_resource in session.find_hardware(filter=chassis_filter, expert_names=[]))
+            chassis = chassis_by_link_name.get(device_resource.connects_to_link_name)
+            if chassis is None:
+                continue
+        device = DeviceBranch.from_resource(device_resource, interfaces.pop(device_resource.provides_link_name, []))
+        yield device.to_record(chassis)
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+import logging
+from nixnetconfig import locking
+from nixnetconfig import system
+from nixnetconfig import utilities
+
+
+logger = logging.getLogger('nixnetconfig')
+
+
+class TransactionError(utilities.XnetConfigError):
+    def __init__(self, failures, total_count):
+        self.failures = failures
+        super().__init__(message='Could not save changes to {} of {} resources: {}'.format(
+            len(failures), total_count, ', '.join(name for name, _ in failures)))
+
+
+class Transaction(object):
+    # Stages property changes on any number of resources and saves each changed resource once on commit.
+    # Property names are attribute paths, such as "xnet.blink".
+    def __init__(self):
+        self._staged = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.commit()
+        else:
+            self.discard()
+
+    def __len__(self):
+        return len(self._staged)
+
+    def set_property(self, name, resource, property_name, value):
+        # The last value staged for a property wins, and every property of a resource is saved together
+        _, _, properties = self._staged.setdefault(id(resource), (name, resource, OrderedDict()))
+        properties[property_name] = value
+
+    def discard(self):
+        self._staged.clear()
+
+    def commit(self):
+        staged, self._staged = list(self._staged.values()), OrderedDict()
+        failures = []
+        with locking.changing_devices():
+            for name, resource, properties in staged:
+                try:
+                    with locking.changing_device(_device_link_name(resource), 'the device of "{}"'.format(name)):
+                        for property_name, value in properties.items():
+                            path, _, attribute = property_name.rpartition('.')
+                            target = resource
+                            for part in filter(None, path.split('.')):
+                                target = getattr(target, part)
+                            setattr(target, attribute, value)
+                        resource.save_changes()
+                except Exception as err:
+                    message = err.message if isinstance(err, utilities.XnetConfigError) else str(err)
+                    logger.error('Could not save changes to {}: {}'.format(name, message))
+                    failures.append((name, message))
+        if failures:
+            raise TransactionError(failures, len(staged))
+        return len(staged)
+
+
+def _device_link_name(resource):
+    # An interface changes along with the device it belongs to
+    return resource.provides_link_name if resource.is_device else resource.connects_to_link_name
+
+
+def find_interfaces(session, port_names=(), chassis=None):
+    # One xnet query covers every interface; only selecting a chassis needs a second query for its link name
+    device_resources, interface_resources = system.find_expert_resources(utilities._XNET_EXPERT_NAME, session)
+    interfaces = OrderedDict()
+
+    if chassis is not None:
+        chassis_filter = session.create_filter()
+        chassis_filter.is_chassis = True
+        chassis_link_names = set(
+            chassis_resource.provides_link_name for chassis_resource in session.find_hardware(filter=chassis_filter, expert_names=[])
+            if chassis_resource.expert_user_alias[0].upper() == chassis.upper())
+        chassis_devices = [resource for resource in device_resources if resource.connects_to_link_name in chassis_link_names]
+        for _, device_interfaces in system.iter_device_interfaces(chassis_devices, interface_resources):
+            for resource in device_interfaces:
+                interfaces[resource.expert_user_alias[0].upper()] = resource
+        if not interfaces:
+            raise utilities.XnetConfigError('Could not find a chassis "{}" with NI-XNET devices'.format(chassis))
+
+    by_name = dict(
+        (resource.expert_user_alias[0].upper(), resource)
+        for link_resources in interface_resources.values() for resource in link_resources)
+    for port_name in port_names:
+        if port_name.upper() not in by_name:
+            raise utilities.PortNotFoundError(port_name)
+        interfaces.setdefault(port_name.upper(), by_name[port_name.upper()])
+    return interfaces
+
+
+def blink_xnet_ports(mode, port_names=(), chassis=None):
+    if len(port_names) == 1 and chassis is None:
+        utilities.blink_xnet_port(port_names[0], mode)
+        return
+    if not port_names and chassis is None:
+        raise utilities.XnetConfigError('Specify at least one interface name or a chassis')
+    with utilities.open_session() as session:
+        interfaces = find_interfaces(session, port_names, chassis)
+        with Transaction() as transaction:
+            for port_name, resource in interfaces.items():
+                transaction.set_property(port_name, resource, 'xnet.blink', {'on': 1, 'off': 0}[mode])
+    logger.info('{}: blink-LED is {}'.format(', '.join(interfaces), mode))
@@ -1,12 +1,37 @@
 import configparser
+import contextlib
+import functools
 import logging
-import nisyscfg
+from nixnetconfig import cache
+from nixnetconfig import instrumentation
+from nixnetconfig import report
+from nixnetconfig.system import iter_device_records
 from nixnetconfig.system import SystemTree
 import platform
+import threading
 
 
 logger = logging.getLogger('nixnetconfig')
 _XNET_EXPERT_NAME = 'xnet'
+_XNET_INI_PATH = '/usr/share/ni-xnet/nixntcfg.ini'
+_thread_state = threading.local()
+_backend = {'spec': None, 'system': None}
+# Seconds that a device operation may take before it is abandoned, unless a timeout is configured.
+# Firmware updates have no deadline, because a device whose update is cut short may not start again.
+_DEFAULT_TIMEOUTS = {'self_test_xnet_device': 300.0, 'upgrade_xnet_firmware': None}
+
+
+class ThreadLocalStream(object):
+    # Sends what each thread writes to the stream it redirected to, or to the default stream
+    def __init__(self, default_stream):
+        self._default_stream = default_stream
+        self._local = threading.local()
+
+    def redirect(self, stream):
+        self._local.stream = stream
+
+    def __getattr__(self, name):
+        return getattr(getattr(self._local, 'stream', None) or self._default_stream, name)
 
 
 class XnetConfigError(Exception):
@@ -28,25 +53,215 @@ class DeviceWithSerialNumberNotFoundError(XnetConfigError):
         super().__init__(message=custom_message if custom_message else 'Could not find a device with serial number "{}"'.format(serial_number))
 
 
-def enumerate_xnet_devices():
-    with nisyscfg.Session() as session:
-        SystemTree(_XNET_EXPERT_NAME, session).report()
+class OperationTimeoutError(XnetConfigError):
+    def __init__(self, serial_number, timeout):
+        self.serial_number = serial_number
+        self.timeout = timeout
+        super().__init__(message='Device with serial number "{}" did not finish within {:g} s'.format(serial_number, timeout))
+
+
+def set_backend(spec=None):
+    # "sim:<spec>" replaces the driver with a generated system, see SimulatedSystem.from_spec
+    if not spec or spec == 'nisyscfg':
+        _backend['spec'], _backend['system'] = None, None
+    elif spec.startswith('sim:'):
+        from nixnetconfig import simulation
+        try:
+            _backend['system'] = simulation.SimulatedSystem.from_spec(spec[len('sim:'):])
+        except simulation.SimulationSpecError as err:
+            raise XnetConfigError(str(err))
+        _backend['spec'] = spec
+    else:
+        raise XnetConfigError('Unknown backend "{}"'.format(spec))
+
+
+def get_backend():
+    # The spec of the selected backend, or None for the installed driver
+    return _backend['spec']
+
+
+def get_simulated_system():
+    # The SimulatedSystem that replaces the driver, or None for the installed driver
+    return _backend['system']
+
+
+def _create_session():
+    # Sessions connect to the target bound to this thread, or to the local system
+    target = current_target()
+    arguments = {'target': target} if target is not None else {}
+    if _backend['system'] is not None:
+        return _backend['system'].create_session(**arguments)
+    # nisyscfg loads the native driver library, so only import it once a command needs a session
+    import nisyscfg
+    return nisyscfg.Session(**arguments)
+
+
+@contextlib.contextmanager
+def open_session():
+    session = getattr(_thread_state, 'session', None)
+    if session is not None:
+        yield session
+    elif instrumentation.is_enabled():
+        with instrumentation.instrumented_session(_create_session) as session:
+            yield session
+    else:
+        with _create_session() as session:
+            yield session
+
+
+@contextlib.contextmanager
+def using_session(session):
+    # Commands run by this thread in this context use the given session instead of opening their own
+    previous_session = getattr(_thread_state, 'session', None)
+    _thread_state.session = session
+    try:
+        yield session
+    finally:
+        _thread_state.session = previous_session
+
+
+def current_target():
+    return getattr(_thread_state, 'target', None)
+
+
+@contextlib.contextmanager
+def using_target(target):
+    # Commands run by this thread in this context open their sessions on a remote system
+    previous_target, previous_session = current_target(), getattr(_thread_state, 'session', None)
+    _thread_state.target, _thread_state.session = target, None
+    try:
+        yield target
+    finally:
+        _thread_state.target, _thread_state.session = previous_target, previous_session
+
+
+def current_timeout():
+    return getattr(_thread_state, 'timeout', None)
+
+
+@contextlib.contextmanager
+def using_timeout(timeout):
+    # Device operations run by this thread in this context give up after timeout seconds; 0 waits forever
+    # and None keeps the default of each operation
+    previous_timeout = current_timeout()
+    _thread_state.timeout = timeout
+    try:
+        yield timeout
+    finally:
+        _thread_state.timeout = previous_timeout
+
+
+def get_timeout(operation, timeout=None):
+    if timeout is None:
+        timeout = current_timeout()
+    if timeout is None:
+        timeout = _DEFAULT_TIMEOUTS[operation]
+    return timeout or None
+
+
+def call_with_deadline(function, timeout, serial_number, interruptible=True):
+    # A driver call cannot be interrupted, so it runs in a thread that is abandoned when the deadline
+    # passes. The function takes its locks and opens its session on that thread, even when the caller
+    # shares one, so that an abandoned call keeps them to itself until the driver returns. The thread of an
+    # interruptible call dies with the process; otherwise the process waits for it before exiting.
+    if timeout is None:
+        return function()
+    outcome = {}
+    target = current_target()
+
+    def run():
+        try:
+            with using_target(target), using_session(None):
+                outcome['value'] = function()
+        except BaseException as err:
+            outcome['error'] = err
+
+    thread = threading.Thread(target=run, name='nixnetconfig {}'.format(serial_number), daemon=interruptible)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise OperationTimeoutError(serial_number, timeout)
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('value')
+
+
+@contextlib.contextmanager
+def shared_session():
+    with open_session() as session:
+        with using_session(session):
+            yield session
+
+
+@contextlib.contextmanager
+def _open_worker_session(target):
+    # Worker threads start without a target or session of their own
+    with using_target(target), open_session() as session:
+        yield session
+
+
+def get_system_tree(jobs=1):
+    from nixnetconfig import locking
+    tree = _get_cached_system_tree()
+    if tree is not None:
+        return tree
+    with locking.reading(), open_session() as session:
+        if jobs > 1:
+            tree = SystemTree.from_subtrees(_XNET_EXPERT_NAME, session, functools.partial(_open_worker_session, current_target()), jobs)
+        else:
+            tree = SystemTree(_XNET_EXPERT_NAME, session)
+    if current_target() is None:
+        cache.store(tree.to_dict(), get_backend())
+    return tree
+
+
+def _get_cached_system_tree():
+    # The inventory cache only describes the local system
+    system = cache.load(get_backend()) if current_target() is None else None
+    return SystemTree.from_dict(system) if system is not None else None
+
+
+def enumerate_xnet_devices(output_format='text', watch=False, interval=2.0, jobs=1):
+    from nixnetconfig import locking
+    if watch:
+        from nixnetconfig.watch import watch_xnet_devices
+        watch_xnet_devices(interval, output_format)
+        return
+    if output_format == 'text':
+        get_system_tree(jobs).report()
+        return
+    # Parallel discovery needs the whole tree before it can write records in order
+    tree = get_system_tree(jobs) if jobs > 1 else _get_cached_system_tree()
+    if tree is not None:
+        report.write_records(tree.iter_records(), output_format)
+        return
+    with locking.reading(), open_session() as session:
+        report.write_records(iter_device_records(_XNET_EXPERT_NAME, session), output_format)
+
+
+def _describe_device(serial_number):
+    return 'the device with serial number "{}"'.format(serial_number)
 
 
 def rename_xnet_port_name(current_port_name, new_port_name):
-    with nisyscfg.Session() as session:
+    from nixnetconfig import locking
+    with open_session() as session:
         try:
             filter = session.create_filter()
             filter.is_device = False
             filter.user_alias = current_port_name
             resource = next(session.find_hardware(filter=filter, expert_names=_XNET_EXPERT_NAME))
-            resource.rename(new_port_name)
+            with locking.changing_device(resource.connects_to_link_name, 'the device of interface "{}"'.format(current_port_name)):
+                resource.rename(new_port_name)
         except StopIteration:
             raise PortNotFoundError(current_port_name)
+        finally:
+            cache.invalidate()
 
 
 def assign_xnet_port_name(serial_number, port_number, port_name):
-    with nisyscfg.Session() as session:
+    from nixnetconfig import locking
+    with open_session() as session:
         try:
             device_filter = session.create_filter()
             device_filter.is_device = True
@@ -55,68 +270,88 @@ def assign_xnet_port_name(serial_number, port_number, port_name):
 
             interface_filter = session.create_filter()
             interface_filter.is_device = False
-            interface_filter.connects_to_link_name = resource.provides_link_name
+            link_name = resource.provides_link_name
+            interface_filter.connects_to_link_name = link_name
             for interface_resource in session.find_hardware(filter=interface_filter, expert_names=_XNET_EXPERT_NAME):
                 if interface_resource.xnet.port_number == port_number:
-                    interface_resource.rename(port_name)
+                    with locking.changing_device(link_name, _describe_device(serial_number)):
+                        interface_resource.rename(port_name)
                     return
             raise PortNotFoundError(port_number, 'Device with serial number "{}" does not have port number {}'.format(serial_number, port_number))
         except StopIteration:
             raise PortNotFoundError(port_number, 'Could not find a device with serial number "{}"'.format(serial_number))
+        finally:
+            cache.invalidate()
 
 
 def blink_xnet_port(port_name, mode):
-    with nisyscfg.Session() as session:
+    from nixnetconfig import locking
+    with open_session() as session:
         try:
             filter = session.create_filter()
             filter.is_device = False
             filter.user_alias = port_name
             resource = next(session.find_hardware(filter=filter, expert_names=_XNET_EXPERT_NAME))
-            resource.xnet.blink = {'on': 1, 'off': 0}[mode]
-            resource.save_changes()
+            with locking.changing_device(resource.connects_to_link_name, 'the device of interface "{}"'.format(port_name)):
+                resource.xnet.blink = {'on': 1, 'off': 0}[mode]
+                resource.save_changes()
             logger.info(port_name + ': blink-LED is ' + mode)
         except StopIteration:
             raise PortNotFoundError(port_name)
 
 
-def upgrade_xnet_firmware(serial_number):
-    with nisyscfg.Session() as session:
+def _operate_device(serial_number, operation):
+    # Finds the device in a session of its own and operates it under its lock, see call_with_deadline
+    from nixnetconfig import locking
+    with open_session() as session:
         try:
             filter = session.create_filter()
             filter.is_device = True
             filter.serial_number = serial_number
             resource = next(session.find_hardware(filter=filter, expert_names=_XNET_EXPERT_NAME))
-            logger.info('Starting firmware upgrade')
-            resource.upgrade_firmware(version="0")
-            logger.info('Completed firmware upgrade')
         except StopIteration:
             raise DeviceWithSerialNumberNotFoundError(serial_number)
+        with locking.operating_device(resource.provides_link_name, _describe_device(serial_number)):
+            return operation(resource)
+
+
+def upgrade_xnet_firmware(serial_number):
+    logger.info('Starting firmware upgrade')
+    try:
+        call_with_deadline(
+            functools.partial(_operate_device, serial_number, lambda resource: resource.upgrade_firmware(version="0")),
+            get_timeout('upgrade_xnet_firmware'), serial_number, interruptible=False)
+    finally:
+        cache.invalidate()
+    logger.info('Completed firmware upgrade')
 
 
 def self_test_xnet_device(serial_number):
-    with nisyscfg.Session() as session:
-        try:
-            filter = session.create_filter()
-            filter.is_device = True
-            filter.serial_number = serial_number
-            resource = next(session.find_hardware(filter=filter, expert_names=_XNET_EXPERT_NAME))
-            logger.info('Starting self test')
-            # TODO  xnet sysapi expert will report its error code when a function failed, include self_test,
-            #       but we may need to catch LibraryError for error code that is not defined in class Status(CtypesEnum)
-            resource.self_test()
-            logger.info('Completed self test')
-        except StopIteration:
-            raise DeviceWithSerialNumberNotFoundError(serial_number)
+    from nixnetconfig import history
+    logger.info('Starting self test')
+    try:
+        with history.recording(serial_number):
+            call_with_deadline(
+                functools.partial(_operate_device, serial_number, lambda resource: resource.self_test()),
+                get_timeout('self_test_xnet_device'), serial_number)
+    except Exception as err:
+        # The xnet sysapi expert reports the error code of a failed self test, which may not be a
+        # status that nisyscfg knows by name
+        if isinstance(err, XnetConfigError) or getattr(err, 'code', None) is None:
+            raise
+        raise XnetConfigError('Self test of device with serial number "{}" failed with error code {}'.format(serial_number, err.code))
+    logger.info('Completed self test')
 
 
 def get_xnet_expert_version():
-    if platform.system() == 'Linux':
+    from nixnetconfig import locking
+    if platform.system() == 'Linux' and current_target() is None:
         # nisyscfg does not support NISysCfgGetInstalledSoftwareComponents on Linux desktop systems, directly get ni-xnet version from nixntcfg.ini
         parser = configparser.ConfigParser()
-        parser.read('/usr/share/ni-xnet/nixntcfg.ini')
+        parser.read(_XNET_INI_PATH)
         print("ni-xnet", parser.get('Version', 'VersionString'))
     else:
-        with nisyscfg.Session() as session:
+        with locking.reading(), open_session() as session:
             sw = session.get_installed_software_components()
             for component in sw:
                 if component.id == 'ni-xnet':
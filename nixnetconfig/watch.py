@@ -0,0 +1,104 @@
+from collections import namedtuple
+import json
+import logging
+from nixnetconfig import cache
+from nixnetconfig import system
+from nixnetconfig import utilities
+import sys
+import time
+
+
+logger = logging.getLogger('nixnetconfig')
+
+# The poll interval doubles after every poll without changes, up to this multiple of the requested interval
+_MAX_BACKOFF = 8
+_DEVICE_FIELDS = ('product_name', 'firmware_revision', 'link_name', 'connects_to_link_name')
+
+WatchEvent = namedtuple('WatchEvent', ['event', 'serial_number', 'port_number', 'field', 'old', 'new'])
+
+
+def take_snapshot(session):
+    # A single xnet query returns every device and interface; the chassis are identified by the link name
+    # that a device connects to, so they need no query of their own
+    device_resources, interface_resources = system.find_expert_resources(utilities._XNET_EXPERT_NAME, session)
+    devices = {}
+    for resource, device_interfaces in system.iter_device_interfaces(device_resources, interface_resources):
+        serial_number = resource.serial_number
+        devices[serial_number] = {
+            'serial_number': serial_number,
+            'product_name': resource.product_name,
+            'firmware_revision': resource.firmware_revision,
+            'link_name': resource.provides_link_name,
+            'connects_to_link_name': resource.connects_to_link_name,
+            'interfaces': dict(
+                (interface_resource.xnet.port_number, interface_resource.expert_user_alias[0]) for interface_resource in device_interfaces),
+        }
+    return devices
+
+
+def diff_snapshots(previous, current):
+    events = []
+    for serial_number in sorted(set(previous) | set(current)):
+        old_device, new_device = previous.get(serial_number), current.get(serial_number)
+        if old_device is None:
+            events.append(WatchEvent('added', serial_number, None, 'device', None, new_device['product_name']))
+        elif new_device is None:
+            events.append(WatchEvent('removed', serial_number, None, 'device', old_device['product_name'], None))
+        else:
+            events.extend(
+                WatchEvent('changed', serial_number, None, field, old_device[field], new_device[field])
+                for field in _DEVICE_FIELDS if old_device[field] != new_device[field])
+
+        old_interfaces = old_device['interfaces'] if old_device else {}
+        new_interfaces = new_device['interfaces'] if new_device else {}
+        for port_number in sorted(set(old_interfaces) | set(new_interfaces)):
+            old_name, new_name = old_interfaces.get(port_number), new_interfaces.get(port_number)
+            if old_name == new_name:
+                continue
+            event = 'added' if old_name is None else 'removed' if new_name is None else 'changed'
+            events.append(WatchEvent(event, serial_number, port_number, 'name', old_name, new_name))
+    return events
+
+
+def format_event(event):
+    subject = event.serial_number if event.port_number is None else '{} port {}'.format(event.serial_number, event.port_number)
+    if event.event == 'added':
+        return '+ {}: {}'.format(subject, event.new)
+    if event.event == 'removed':
+        return '- {}: {}'.format(subject, event.old)
+    return '~ {} {}: {} -> {}'.format(subject, event.field, event.old, event.new)
+
+
+def write_events(events, output_format, stream=None):
+    stream = stream or sys.stdout
+    for event in events:
+        if output_format == 'ndjson':
+            stream.write(json.dumps(event._asdict()) + '\n')
+        else:
+            stream.write(format_event(event) + '\n')
+    stream.flush()
+
+
+def watch_xnet_devices(interval=2.0, output_format='text'):
+    if output_format not in ('text', 'ndjson'):
+        raise utilities.XnetConfigError('Watching supports the text and ndjson formats only')
+    if interval <= 0:
+        raise utilities.XnetConfigError('The watch interval must be greater than zero')
+
+    # The first poll reports every device as added; later polls report only what changed
+    previous = {}
+    delay = interval
+    try:
+        with utilities.open_session() as session:
+            while True:
+                current = take_snapshot(session)
+                events = diff_snapshots(previous, current)
+                write_events(events, output_format)
+                if events and previous:
+                    cache.invalidate()
+                delay = interval if events else min(delay * 2, interval * _MAX_BACKOFF)
+                logger.debug('Found {} changes, next poll in {:.1f} s'.format(len(events), delay))
+                previous = current
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
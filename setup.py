@@ -30,6 +30,9 @@ setup(
     install_requires=[
         'nisyscfg',
     ],
+    extras_require={
+        'yaml': ['PyYAML'],
+    },
     packages=find_packages(),
     tests_require=['pytest'],
     classifiers=[
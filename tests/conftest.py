@@ -0,0 +1,34 @@
+from nixnetconfig import utilities
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def history_path(tmp_path, monkeypatch):
+    # Self-tests record their results; keep them out of the history in the home directory
+    path = tmp_path / 'history.db'
+    monkeypatch.setenv('NIXNETCONFIG_HISTORY', str(path))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def lock_directory(tmp_path, monkeypatch):
+    # Commands lock the hardware they use; keep their lock files apart from other test runs
+    path = tmp_path / 'locks'
+    monkeypatch.setenv('NIXNETCONFIG_LOCK_DIR', str(path))
+    return path
+
+
+@pytest.fixture
+def simulated_backend():
+    # Replaces the driver with the simulated system of a "sim:" spec and returns the system
+    def set_backend(spec):
+        utilities.set_backend(spec)
+        return utilities.get_simulated_system()
+    yield set_backend
+    utilities.set_backend()
+
+
+@pytest.fixture
+def simulated_system(request, simulated_backend):
+    # The hardware is given by the SIMULATED_BACKEND spec of the test module
+    return simulated_backend(request.module.SIMULATED_BACKEND)
@@ -0,0 +1,126 @@
+import asyncio
+import io
+from nixnetconfig import aio
+from nixnetconfig import utilities
+import pytest
+import threading
+import time
+from unittest import mock
+
+
+SIMULATED_BACKEND = 'sim:1x4x2'
+
+
+@pytest.fixture
+def simulated_system(simulated_system):
+    yield simulated_system
+    aio.configure()
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _track_concurrency(system):
+    # Record the most driver calls that were in progress at the same time
+    state = {'running': 0, 'peak': 0}
+    lock = threading.Lock()
+    simulate_call = system.simulate_call
+
+    def tracked(call):
+        with lock:
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+        try:
+            time.sleep(0.05)
+            simulate_call(call)
+        finally:
+            with lock:
+                state['running'] -= 1
+    system.simulate_call = tracked
+    return state
+
+
+def test_async_operations_run_against_the_driver(simulated_system):
+    async def provision():
+        await aio.rename_xnet_port_name('CAN1', 'ENGINE')
+        await aio.assign_xnet_port_name('00010002', 1, 'BODY')
+        await aio.blink_xnet_port('ENGINE', 'on')
+        await aio.upgrade_xnet_firmware('00010003')
+        await aio.self_test_xnet_device('00010004')
+        return await aio.get_system_tree()
+
+    tree = _run(provision())
+    assert [interface.name for interface in tree.find_device('00010001').interfaces] == ['ENGINE', 'CAN2']
+    assert [interface.name for interface in tree.find_device('00010002').interfaces] == ['BODY', 'CAN4']
+    assert simulated_system.call_counts['self_test'] == simulated_system.call_counts['upgrade_firmware'] == 1
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_async_enumerate_prints_devices(stdout_mock, simulated_system):
+    _run(aio.enumerate_xnet_devices('ndjson'))
+    assert len(stdout_mock.getvalue().splitlines()) == 4
+
+
+def test_async_operations_interleave_up_to_worker_limit(simulated_system):
+    aio.configure(max_workers=3)
+    state = _track_concurrency(simulated_system)
+
+    async def test_all():
+        await asyncio.gather(*[aio.self_test_xnet_device('0001000{}'.format(index)) for index in range(1, 5)])
+
+    _run(test_all())
+    assert state['peak'] == 3
+    assert simulated_system.call_counts['self_test'] == 4
+
+
+def test_async_operation_raises_timeout_and_keeps_executor_usable(simulated_system):
+    simulated_system.latency['upgrade_firmware'] = 0.5
+    with pytest.raises(asyncio.TimeoutError):
+        _run(aio.upgrade_xnet_firmware('00010001', timeout=0.05))
+    _run(aio.self_test_xnet_device('00010001', timeout=5))
+    assert simulated_system.call_counts['self_test'] == 1
+
+
+def test_timed_out_operation_keeps_its_worker_until_driver_returns(simulated_system):
+    aio.configure(max_workers=1)
+    simulated_system.latency['upgrade_firmware'] = 0.5
+    with pytest.raises(asyncio.TimeoutError):
+        _run(aio.upgrade_xnet_firmware('00010001', timeout=0.05))
+    with pytest.raises(asyncio.TimeoutError):
+        _run(aio.self_test_xnet_device('00010001', timeout=0.1))
+    aio.shutdown()
+    assert simulated_system.call_counts['upgrade_firmware'] == 1
+    assert simulated_system.call_counts['self_test'] == 0
+
+
+def test_cancelled_operation_is_not_started(simulated_system):
+    aio.configure(max_workers=1)
+    simulated_system.latency['upgrade_firmware'] = 0.2
+
+    async def cancel_queued():
+        running = asyncio.ensure_future(aio.upgrade_xnet_firmware('00010001'))
+        queued = asyncio.ensure_future(aio.upgrade_xnet_firmware('00010002'))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        await running
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+
+    _run(cancel_queued())
+    aio.shutdown()
+    assert simulated_system.call_counts['upgrade_firmware'] == 1
+
+
+def test_async_operation_raises_driver_errors(simulated_system):
+    with pytest.raises(utilities.PortNotFoundError):
+        _run(aio.blink_xnet_port('CAN99', 'on'))
+
+
+def test_configure_raises_error_for_invalid_worker_count():
+    with pytest.raises(utilities.XnetConfigError):
+        aio.configure(max_workers=0)
@@ -0,0 +1,120 @@
+import nixnetconfig
+from nixnetconfig import cache
+from nixnetconfig import utilities
+from nixnetconfig.api import Port
+from nixnetconfig.api import XnetSystem
+import pytest
+from unittest import mock
+
+
+SIMULATED_BACKEND = 'sim:1x2x2,standalone=1'
+
+
+def _device(system, serial_number):
+    return next(resource for resource in system.resources if resource.is_device and resource.serial_number == serial_number)
+
+
+def test_xnet_system_reuses_one_session_and_lookup(simulated_system):
+    with mock.patch('nixnetconfig.utilities._create_session', wraps=utilities._create_session) as create_session_mock:
+        with XnetSystem() as system:
+            assert system.find_port('can4') == Port('CAN4', '00010002', 2)
+            system.rename('CAN1', 'ENGINE')
+            system.assign('00010002', 1, 'BODY')
+            system.blink('ENGINE', 'on')
+            system.self_test('00000001', timeout=0)
+            assert system.update('00010001') == simulated_system.firmware_revision
+            assert system.find_port('engine') == Port('ENGINE', '00010001', 1)
+    create_session_mock.assert_called_once_with()
+    # Self-tests and updates look up their device in the driver, like the commands do
+    assert simulated_system.call_counts == {'find_hardware': 3, 'rename': 2, 'save_changes': 1, 'self_test': 1, 'upgrade_firmware': 1}
+
+
+def test_xnet_system_enumerate_returns_tree_until_hardware_changes(simulated_system):
+    with XnetSystem() as system:
+        tree = system.enumerate()
+        assert [device.serial_num for device in tree.iter_devices()] == ['00000001', '00010001', '00010002']
+        assert system.enumerate() is tree
+        system.rename('CAN2', 'CAN20')
+        assert system.enumerate().find_interface('CAN20') is not None
+        system.refresh()
+        system.enumerate()
+    assert simulated_system.call_counts['find_hardware'] == 7
+
+
+def test_xnet_system_invalidates_inventory_cache_when_hardware_changes(simulated_system):
+    with mock.patch.object(cache, 'invalidate') as invalidate_mock:
+        with XnetSystem() as system:
+            system.rename('CAN1', 'CAN10')
+            system.assign('00010001', 2, 'CAN20')
+            system.update('00010001')
+    assert invalidate_mock.call_count == 3
+
+
+def test_xnet_system_indexes_aliases_until_a_rename(simulated_system):
+    with XnetSystem() as system:
+        system.find_port('CAN1')
+        with mock.patch.object(simulated_system, 'simulate_property_read') as property_read_mock:
+            assert system.find_port('can4') == Port('CAN4', '00010002', 2)
+        # Only the name of the port found is read again
+        assert property_read_mock.call_count == 1
+        system.rename('CAN1', 'ENGINE')
+        assert system.find_port('engine') == Port('ENGINE', '00010001', 1)
+        with pytest.raises(utilities.PortNotFoundError):
+            system.find_port('CAN1')
+
+
+@pytest.mark.parametrize('method, arguments, message', [
+    ('find_port', ['CAN9'], 'Could not find port "CAN9"'),
+    ('rename', ['CAN9', 'CAN10'], 'Could not find port "CAN9"'),
+    ('assign', ['0001000F', 1, 'CAN10'], 'Could not find a device with serial number "0001000F"'),
+    ('assign', ['00010001', 3, 'CAN10'], 'Device with serial number "00010001" does not have port number 3'),
+    ('blink', ['CAN1', 'fast'], 'Blink mode must be "on" or "off", not "fast"'),
+    ('self_test', ['0001000F'], 'Could not find a device with serial number "0001000F"'),
+])
+def test_xnet_system_raises_error_for_unknown_hardware(simulated_system, method, arguments, message):
+    with XnetSystem() as system:
+        with pytest.raises(utilities.XnetConfigError) as error:
+            getattr(system, method)(*arguments)
+    assert error.value.message == message
+
+
+def test_xnet_system_must_be_open(simulated_system):
+    system = XnetSystem()
+    with pytest.raises(utilities.XnetConfigError):
+        system.enumerate()
+    system.open()
+    session = system.session
+    system.open()
+    assert system.session is session
+    system.close()
+    system.close()
+    with pytest.raises(utilities.XnetConfigError):
+        system.find_port('CAN1')
+
+
+def test_xnet_system_opens_its_own_session_on_target(simulated_system):
+    with utilities.shared_session() as shared_session:
+        with XnetSystem(target='rack1') as system:
+            assert system.session is not shared_session
+            system.rename('CAN1', 'CAN10')
+    assert simulated_system.targets['rack1'].call_counts['rename'] == 1
+    assert simulated_system.call_counts['rename'] == 0
+
+
+def test_package_exports_library_api():
+    assert nixnetconfig.XnetSystem is XnetSystem
+    assert nixnetconfig.Port is Port
+    assert nixnetconfig.XnetConfigError is utilities.XnetConfigError
+    assert set(nixnetconfig.__all__) <= set(dir(nixnetconfig))
+    with pytest.raises(AttributeError):
+        nixnetconfig.Session
+
+
+def test_xnet_system_gives_up_on_device_after_timeout(simulated_backend):
+    simulated_backend('sim:1x1x1,self_test=0.5,upgrade_firmware=0.5')
+    with XnetSystem() as system:
+        with pytest.raises(utilities.OperationTimeoutError):
+            system.self_test('00010001', timeout=0.05)
+        with pytest.raises(utilities.OperationTimeoutError):
+            system.update('00010001', timeout=0.05)
+        system.self_test('00010001', timeout=0)
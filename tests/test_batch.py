@@ -0,0 +1,116 @@
+import copy
+import io
+from nixnetconfig import __main__  # noqa: F401
+from nixnetconfig import batch
+import pytest
+from tests.test_utilities import _sysapi_data
+from tests.test_utilities import SessionMock
+from unittest import mock
+
+
+@pytest.fixture
+def session_mock():
+    sysapi_data = copy.deepcopy(_sysapi_data)
+    sysapi_data['device1_port1_mock']['expert_user_alias'] = ['CAN1']
+    session_mock = SessionMock(sysapi_data)
+    with mock.patch('nisyscfg.Session', mock.Mock(return_value=session_mock)) as session_class_mock:
+        session_mock.class_mock = session_class_mock
+        yield session_mock
+
+
+@pytest.fixture
+def batch_file(tmp_path):
+    def write(*lines):
+        path = tmp_path / 'commands.txt'
+        path.write_text('\n'.join(lines) + '\n')
+        return str(path)
+    return write
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_batch_runs_all_commands_in_one_session(stdout_mock, session_mock, batch_file):
+    batch.run_batch(batch_file(
+        '# provision rack',
+        'rename CAN1 CAN2',
+        '',
+        'blink on CAN1',
+        'assign A2345678 1 CAN3 -e',
+        'test A2345678',
+        '-v',
+    ))
+    # The self-test opens a session of its own on the thread of its deadline
+    assert session_mock.class_mock.mock_calls == [mock.call(), mock.call()]
+    session_mock.device1_port1_mock.rename.assert_has_calls([mock.call('CAN2'), mock.call('CAN3')])
+    session_mock.device1_port1_mock.save_changes.assert_called_once_with()
+    session_mock.device1_mock.self_test.assert_called_once_with()
+    output = stdout_mock.getvalue()
+    assert 'line 2: OK' in output
+    assert 'line 7: OK' in output
+    assert 'My System:' in output
+    for command_name in ('rename', 'blink', 'assign', 'test', 'enumerate'):
+        assert '\n{} '.format(command_name) in output
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_batch_stops_at_first_failure(stdout_mock, session_mock, batch_file):
+    with pytest.raises(batch.BatchCommandError) as error:
+        batch.run_batch(batch_file('rename missing CAN2', 'test A2345678'))
+    assert error.value.message == '1 of 1 batch commands failed'
+    assert 'line 1: FAILED: rename missing CAN2: Could not find port "MISSING"' in stdout_mock.getvalue()
+    session_mock.device1_mock.self_test.assert_not_called()
+    assert 'Command' not in stdout_mock.getvalue()
+
+
+@mock.patch('sys.stderr', new_callable=io.StringIO)
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_batch_continues_after_failures_when_keep_going_is_set(stdout_mock, stderr_mock, session_mock, batch_file):
+    with pytest.raises(batch.BatchCommandError) as error:
+        batch.run_batch(batch_file('bogus', 'batch other.txt', 'blink on CAN9', 'test A2345678'), keep_going=True)
+    assert error.value.message == '3 of 4 batch commands failed'
+    output = stdout_mock.getvalue()
+    assert 'line 1: FAILED: bogus: Invalid command' in output
+    assert 'line 2: FAILED: batch other.txt: Batch files cannot run other batch files' in output
+    assert 'line 4: OK' in output
+    session_mock.device1_mock.self_test.assert_called_once_with()
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_batch_reports_unexpected_errors(stdout_mock, session_mock, batch_file):
+    session_mock.device1_mock.self_test.side_effect = RuntimeError('driver failure')
+    with pytest.raises(batch.BatchCommandError):
+        batch.run_batch(batch_file('test A2345678'))
+    assert 'line 1: FAILED: test A2345678: Operation failed' in stdout_mock.getvalue()
+
+
+@mock.patch('sys.stdin', new_callable=io.StringIO)
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_batch_reads_commands_from_standard_input(stdout_mock, stdin_mock, session_mock):
+    stdin_mock.write('test A2345678\n')
+    stdin_mock.seek(0)
+    batch.run_batch('-')
+    session_mock.device1_mock.self_test.assert_called_once_with()
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_batch_runs_lines_on_their_targets(stdout_mock, session_mock, batch_file):
+    batch.run_batch(batch_file('--target pxi-01,pxi-02 test A2345678', 'test A2345678'))
+    assert sorted(session_mock.class_mock.mock_calls, key=str) == [mock.call(), mock.call(), mock.call(target='pxi-01'), mock.call(target='pxi-02')]
+    assert session_mock.device1_mock.self_test.call_count == 3
+    output = stdout_mock.getvalue()
+    assert 'line 1: OK' in output
+    assert '\ntest ' in output
+
+
+@pytest.mark.parametrize('line, option', [
+    ('--backend sim:1x1x1 enumerate', '--backend'),
+    ('enumerate --cache', '--cache'),
+    ('--refresh', '--refresh'),
+    ('rename CAN1 CAN2 --lock-timeout 5', '--lock-timeout'),
+    ('test A2345678 --trace trace.json', '--trace'),
+])
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_batch_rejects_options_of_the_whole_run_on_a_line(stdout_mock, session_mock, batch_file, line, option):
+    with pytest.raises(batch.BatchCommandError):
+        batch.run_batch(batch_file(line))
+    assert 'line 1: FAILED: {}: {} applies to the whole batch, so give it before the batch command'.format(line, option) in stdout_mock.getvalue()
+    session_mock.device1_mock.self_test.assert_not_called()
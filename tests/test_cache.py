@@ -0,0 +1,134 @@
+import json
+from nixnetconfig import cache
+import os
+import pytest
+import time
+from unittest import mock
+
+
+_system = {'devices': [], 'chassis': []}
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    monkeypatch.delenv('NIXNETCONFIG_CACHE', raising=False)
+    monkeypatch.delenv('NIXNETCONFIG_CACHE_TTL', raising=False)
+    path = str(tmp_path / 'cache' / 'inventory.json')
+    cache.configure(enabled=True, path=path)
+    yield path
+    cache.configure()
+
+
+def test_configure_enables_cache_when_environment_variable_is_set(tmp_path, monkeypatch):
+    path = str(tmp_path / 'inventory.json')
+    monkeypatch.setenv('NIXNETCONFIG_CACHE', path)
+    monkeypatch.setenv('NIXNETCONFIG_CACHE_TTL', '5')
+    cache.configure()
+    assert cache.is_enabled()
+    cache.store(_system)
+    assert os.path.exists(path)
+    monkeypatch.delenv('NIXNETCONFIG_CACHE')
+    cache.configure()
+    assert not cache.is_enabled()
+
+
+def test_load_returns_stored_system(cache_path):
+    cache.store(_system)
+    assert cache.load() == _system
+
+
+def test_load_returns_none_when_cache_is_disabled(cache_path):
+    cache.store(_system)
+    cache.configure(enabled=False, path=cache_path)
+    assert cache.load() is None
+
+
+def test_store_does_nothing_when_cache_is_disabled(cache_path):
+    cache.configure(enabled=False, path=cache_path)
+    cache.store(_system)
+    assert not os.path.exists(cache_path)
+
+
+def test_load_returns_none_when_refresh_is_requested_until_cache_is_rebuilt(cache_path):
+    cache.store(_system)
+    cache.configure(enabled=True, refresh=True, path=cache_path)
+    assert cache.load() is None
+    cache.store(_system)
+    assert cache.load() == _system
+
+
+def test_load_returns_none_when_cache_is_expired(cache_path):
+    cache.configure(enabled=True, path=cache_path, ttl=10)
+    with mock.patch('time.time', return_value=time.time() - 60):
+        cache.store(_system)
+    assert cache.load() is None
+
+
+@pytest.mark.parametrize('content', ['not json', '[]', '{"version": 0}'])
+def test_load_returns_none_when_cache_file_is_invalid(cache_path, content):
+    cache.store(_system)
+    with open(cache_path, 'w') as cache_file:
+        cache_file.write(content)
+    assert cache.load() is None
+
+
+def test_load_returns_none_when_cache_file_is_missing(cache_path):
+    assert cache.load() is None
+
+
+def test_store_replaces_cache_file_atomically(cache_path):
+    cache.store(_system)
+    with mock.patch('json.dump', side_effect=OSError('disk full')):
+        cache.store({'devices': ['new'], 'chassis': []})
+    assert cache.load() == _system
+    assert os.listdir(os.path.dirname(cache_path)) == ['inventory.json']
+
+
+def test_store_leaves_no_temporary_file_when_serialization_fails(cache_path):
+    with pytest.raises(TypeError):
+        cache.store({'devices': [object()], 'chassis': []})
+    assert os.listdir(os.path.dirname(cache_path)) == []
+
+
+def test_invalidate_removes_cache_file(cache_path):
+    cache.store(_system)
+    cache.invalidate()
+    assert not os.path.exists(cache_path)
+    cache.invalidate()
+
+
+def test_store_writes_versioned_file(cache_path):
+    cache.store(_system)
+    with open(cache_path) as cache_file:
+        content = json.load(cache_file)
+    assert content['version'] == 1
+    assert content['system'] == _system
+
+
+@pytest.mark.parametrize('in_memory', [False, True])
+def test_load_returns_none_when_cache_describes_another_backend(cache_path, in_memory):
+    cache.configure(enabled=True, path=cache_path, in_memory=in_memory)
+    cache.store(_system, 'sim:2x1x1')
+    assert cache.load() is None
+    assert cache.load('sim:1x1x1') is None
+    assert cache.load('sim:2x1x1') == _system
+    cache.store(_system)
+    assert cache.load('sim:2x1x1') is None
+    assert cache.load() == _system
+
+
+def test_in_memory_cache_does_not_touch_cache_file(cache_path):
+    cache.configure(in_memory=True, path=cache_path)
+    cache.store(_system)
+    assert cache.load() == _system
+    assert not os.path.exists(cache_path)
+    cache.invalidate()
+    assert cache.load() is None
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='requires POSIX permissions')
+def test_store_keeps_cache_private_to_the_user(cache_path):
+    cache.store(_system)
+    assert os.stat(os.path.dirname(cache_path)).st_mode & 0o777 == 0o700
+    assert os.stat(cache_path).st_mode & 0o777 == 0o600
+    assert cache._DEFAULT_CACHE_PATH.startswith(os.path.expanduser('~'))
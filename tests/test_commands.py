@@ -1,4 +1,5 @@
 import io
+import logging
 from nixnetconfig import __main__
 from nixnetconfig import parser
 from nixnetconfig import utilities
@@ -23,6 +24,33 @@ def test_enumerate_xnet_devices_runs_when_enumerate_is_specified(enumerate_xnet_
     enumerate_xnet_devices_mock.assert_called_once_with()
 
 
+@pytest.mark.parametrize('output_format', ['text', 'json', 'ndjson', 'csv'])
+@mock.patch('nixnetconfig.utilities.enumerate_xnet_devices', spec=True)
+def test_enumerate_xnet_devices_runs_with_format_when_format_is_specified(enumerate_xnet_devices_mock, output_format):
+    run_nixnetconfig('enumerate', '--format', output_format)
+    enumerate_xnet_devices_mock.assert_called_once_with(output_format=output_format)
+
+
+@mock.patch('nixnetconfig.utilities.enumerate_xnet_devices', spec=True)
+def test_enumerate_xnet_devices_runs_with_jobs_when_jobs_is_specified(enumerate_xnet_devices_mock):
+    run_nixnetconfig('enumerate', '--jobs', '4')
+    enumerate_xnet_devices_mock.assert_called_once_with(jobs=4)
+
+
+@pytest.mark.parametrize(
+    'arguments, enabled, refresh',
+    [([], False, False),
+     (['--cache', 'enumerate'], True, False),
+     (['enumerate', '--cache', '--refresh'], True, True),
+     (['--refresh', 'rename', 'can1', 'can2'], False, True)])
+@mock.patch('nixnetconfig.utilities.rename_xnet_port_name', spec=True)
+@mock.patch('nixnetconfig.utilities.enumerate_xnet_devices', spec=True)
+@mock.patch('nixnetconfig.cache.configure', spec=True)
+def test_cache_options_configure_inventory_cache(configure_mock, enumerate_xnet_devices_mock, rename_xnet_port_name_mock, arguments, enabled, refresh):
+    run_nixnetconfig(*arguments)
+    configure_mock.assert_called_once_with(enabled=enabled, refresh=refresh)
+
+
 @pytest.mark.parametrize(
     "old_name, new_name",
     [('can1', 'can2'),
@@ -61,6 +89,18 @@ def test_self_test_xnet_device_runs_when_test_port_are_specified(self_test_xnet_
     self_test_xnet_device_mock.assert_called_once_with(port_name.upper())
 
 
+@pytest.mark.parametrize(
+    'arguments, serial_numbers, all_devices, chassis, jobs',
+    [(['a1', 'b2'], ['A1', 'B2'], False, None, 4),
+     (['--all', '-j', '16'], [], True, None, 16),
+     (['--chassis', 'myChassis', 'a1'], ['A1'], False, 'myChassis', 4)])
+@mock.patch('nixnetconfig.fleet.self_test_xnet_devices', spec=True)
+def test_self_test_xnet_devices_runs_when_several_devices_are_specified(self_test_xnet_devices_mock, arguments, serial_numbers, all_devices, chassis, jobs):
+    run_nixnetconfig('test', *arguments)
+    self_test_xnet_devices_mock.assert_called_once_with(
+        serial_numbers=serial_numbers, all_devices=all_devices, chassis=chassis, jobs=jobs)
+
+
 @pytest.mark.parametrize(
     "mode",
     ['on', 'off'])
@@ -89,14 +129,43 @@ def test_upgrade_xnet_firmware_runs_when_e_optiont_is_specified(upgrade_xnet_fir
     run_nixnetconfig('update', serial_number_string, '-e')
     run_nixnetconfig('update', '-e', serial_number_string)
     expected_calls = [
-        mock.call.upgrade_xnet_firmware_mock(serial_number=serial_number_string.upper()),
+        mock.call.upgrade_xnet_firmware_mock(serial_number_string.upper()),
         mock.call.enumerate_xnet_devices_mock(),
-        mock.call.upgrade_xnet_firmware_mock(serial_number=serial_number_string.upper()),
+        mock.call.upgrade_xnet_firmware_mock(serial_number_string.upper()),
         mock.call.enumerate_xnet_devices_mock()
     ]
     assert sequence_manager.mock_calls == expected_calls
 
 
+@pytest.mark.parametrize(
+    'arguments, serial_numbers, all_devices, jobs, per_chassis',
+    [(['a1', 'b2'], ['A1', 'B2'], False, 4, 1),
+     (['--all', '-j', '8'], [], True, 8, 1),
+     (['-a', '--jobs', '2', '--per-chassis', '3'], [], True, 2, 3)])
+@mock.patch('nixnetconfig.fleet.update_xnet_firmware', spec=True)
+def test_update_xnet_firmware_runs_when_several_devices_are_specified(update_xnet_firmware_mock, arguments, serial_numbers, all_devices, jobs, per_chassis):
+    run_nixnetconfig('update', *arguments)
+    update_xnet_firmware_mock.assert_called_once_with(
+        serial_numbers=serial_numbers, all_devices=all_devices, jobs=jobs, per_chassis=per_chassis)
+
+
+@pytest.mark.parametrize('command, function_name', [('update', 'update_xnet_firmware'), ('test', 'self_test_xnet_devices')])
+@pytest.mark.parametrize('arguments, journal_arguments', [
+    (['--journal', 'run.journal'], {'journal_file': 'run.journal'}),
+    (['--resume', 'run.journal'], {'resume_file': 'run.journal'})])
+def test_fleet_operation_runs_with_journal_when_journal_or_resume_is_specified(command, function_name, arguments, journal_arguments):
+    with mock.patch('nixnetconfig.fleet.{}'.format(function_name), spec=True) as function_mock:
+        run_nixnetconfig(command, 'a1', 'b2', *arguments)
+    assert function_mock.call_args[1]['serial_numbers'] == ['A1', 'B2']
+    assert dict((name, function_mock.call_args[1].get(name)) for name in journal_arguments) == journal_arguments
+
+
+@mock.patch('nixnetconfig.fleet.update_xnet_firmware', spec=True)
+def test_update_xnet_firmware_runs_when_if_outdated_is_specified(update_xnet_firmware_mock):
+    run_nixnetconfig('update', '--all', '--if-outdated')
+    update_xnet_firmware_mock.assert_called_once_with(serial_numbers=[], all_devices=True, jobs=4, per_chassis=1, if_outdated=True)
+
+
 @mock.patch('nixnetconfig.utilities.get_xnet_expert_version', spec=True)
 def test_get_xnet_expert_version_runs_when_version_is_speficied(get_xnet_expert_version_mock):
     run_nixnetconfig('version')
@@ -133,6 +202,17 @@ def test_assign_xnet_port_name_runs_when_e_option_is_specified(assign_xnet_port_
     assert sequence_manager.mock_calls == expected_calls
 
 
+@pytest.mark.parametrize(
+    'arguments, keep_going',
+    [(['commands.txt'], False),
+     (['-k', 'commands.txt'], True),
+     (['commands.txt', '--keep-going'], True)])
+@mock.patch('nixnetconfig.batch.run_batch', spec=True)
+def test_run_batch_runs_when_batch_file_is_specified(run_batch_mock, arguments, keep_going):
+    run_nixnetconfig('batch', *arguments)
+    run_batch_mock.assert_called_once_with(batch_file='commands.txt', keep_going=keep_going)
+
+
 @pytest.mark.parametrize(
     'exception', [utilities.XnetConfigError, Exception])
 @pytest.mark.parametrize(
@@ -174,3 +254,21 @@ def test_main_prints_help_word_wrapped_to_console_width(stout_mock, get_terminal
             summary_found = True
         if summary_found:
             assert len(line) <= width
+
+
+@mock.patch('nixnetconfig.utilities.get_xnet_expert_version', spec=True)
+def test_main_does_not_add_log_handlers_when_run_repeatedly(get_xnet_expert_version_mock):
+    logger = logging.getLogger('nixnetconfig')
+    run_nixnetconfig('version')
+    handler_count = len(logger.handlers)
+    for _ in range(3):
+        run_nixnetconfig('-v', 'version')
+    assert len(logger.handlers) == handler_count
+    assert get_xnet_expert_version_mock.call_count == 4
+
+
+@pytest.mark.parametrize('command, function_name', [('test', 'self_test_xnet_devices'), ('update', 'update_xnet_firmware')])
+def test_fleet_operation_runs_with_timeout_when_timeout_is_specified(command, function_name):
+    with mock.patch('nixnetconfig.fleet.{}'.format(function_name), spec=True) as function_mock:
+        run_nixnetconfig(command, '--timeout', '90', 'a1')
+    assert function_mock.call_args[1]['timeout'] == 90.0
@@ -0,0 +1,123 @@
+import io
+from nixnetconfig import __main__
+from nixnetconfig import completion
+import os
+import pytest
+import shutil
+import subprocess
+import time
+from unittest import mock
+
+
+pytestmark = pytest.mark.skipif(shutil.which('bash') is None, reason='requires bash')
+
+
+@pytest.fixture
+def snapshot_path(tmp_path, monkeypatch):
+    path = tmp_path / 'completion.txt'
+    monkeypatch.setenv('NIXNETCONFIG_COMPLETION_SNAPSHOT', str(path))
+    path.write_text('interfaces CAN1 CAN2 LIN1\nserial_numbers 00010001 01ABCDEF\n')
+    return path
+
+
+@pytest.fixture
+def script_path(tmp_path, snapshot_path):
+    path = tmp_path / 'nixnetconfig.bash'
+    path.write_text(completion.generate_script('bash'))
+    return path
+
+
+def _complete(script_path, line, environment=None):
+    # Complete the last word of the command line, the way bash does on a tab press
+    words = line.split(' ')
+    program = 'source "$0"; COMP_WORDS=({}); COMP_CWORD={}; _nixnetconfig; echo "${{COMPREPLY[*]}}"'.format(
+        ' '.join("'{}'".format(word) for word in words), len(words) - 1)
+    env = dict(os.environ, **(environment or {}))
+    output = subprocess.check_output(['bash', '-c', program, str(script_path)], env=env, universal_newlines=True)
+    return output.split()
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('nixnetconfig ', ['enumerate', 'rename', 'test', 'blink', 'version', 'update', 'assign', 'batch', 'serve', 'apply',
+                       'firmware-status', 'find', 'history', 'completion']),
+    ('nixnetconfig -v re', ['rename']),
+    ('nixnetconfig --backend sim:1x1x1 ver', ['version']),
+    ('nixnetconfig rename CA', ['CAN1', 'CAN2']),
+    ('nixnetconfig rename CAN1 ', []),
+    ('nixnetconfig blink ', ['on', 'off']),
+    ('nixnetconfig blink on -c Chassis1 C', ['CAN1', 'CAN2']),
+    ('nixnetconfig blink on CAN1 L', ['LIN1']),
+    ('nixnetconfig test -j 4 0', ['00010001', '01ABCDEF']),
+    ('nixnetconfig assign 01', ['01ABCDEF']),
+    ('nixnetconfig assign 01ABCDEF 1 ', []),
+    ('nixnetconfig enumerate --format n', ['ndjson']),
+    ('nixnetconfig firmware-status --format ', ['text', 'json']),
+    ('nixnetconfig update --if', ['--if-outdated']),
+    ('nixnetconfig completion ', ['bash', 'zsh']),
+])
+def test_completion_script_completes_commands_options_and_snapshot_values(script_path, line, expected):
+    assert _complete(script_path, line) == expected
+
+
+def test_completion_script_completes_file_names(script_path, tmp_path):
+    (tmp_path / 'plan.yaml').write_text('')
+    prefix = str(tmp_path / 'pl')
+    assert _complete(script_path, 'nixnetconfig apply ' + prefix) == [str(tmp_path / 'plan.yaml')]
+    assert _complete(script_path, 'nixnetconfig update --journal ' + prefix) == [str(tmp_path / 'plan.yaml')]
+
+
+def test_completion_script_does_not_start_python(script_path):
+    # Completion only reads the snapshot, so even a slow machine completes well within 50 ms
+    program = 'source "$0"; COMP_WORDS=(nixnetconfig rename C); COMP_CWORD=2; start=$(date +%s%N);' \
+        ' for i in 1 2 3 4 5 6 7 8 9 10; do _nixnetconfig; done; echo $(( ($(date +%s%N) - start) / 10000 ))'
+    microseconds = int(subprocess.check_output(['bash', '-c', program, str(script_path)], universal_newlines=True))
+    assert microseconds < 50000
+
+
+def test_completion_script_refreshes_stale_snapshot_in_background(script_path, snapshot_path, tmp_path):
+    # Stand in for nixnetconfig on the PATH, recording how the script runs it
+    marker = tmp_path / 'refresh.txt'
+    program = tmp_path / 'bin' / 'nixnetconfig'
+    program.parent.mkdir()
+    program.write_text('#!/bin/sh\necho "$@" > "{}"\n'.format(marker))
+    program.chmod(0o755)
+    environment = {'PATH': '{}:{}'.format(program.parent, os.environ['PATH'])}
+
+    assert _complete(script_path, 'nixnetconfig rename C', environment) == ['CAN1', 'CAN2']
+    assert not marker.exists()
+    stale = time.time() - 120
+    os.utime(str(snapshot_path), (stale, stale))
+    assert _complete(script_path, 'nixnetconfig rename C', environment) == ['CAN1', 'CAN2']
+    deadline = time.monotonic() + 5
+    while not marker.exists() or not marker.read_text():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert marker.read_text() == 'completion --update-snapshot {}\n'.format(snapshot_path)
+    assert os.stat(str(snapshot_path)).st_mtime > stale
+
+
+def test_generate_script_loads_bashcompinit_for_zsh(snapshot_path):
+    assert 'bashcompinit' in completion.generate_script('zsh')
+    assert 'bashcompinit' not in completion.generate_script('bash')
+
+
+def test_get_snapshot_path_defaults_to_home_directory(monkeypatch):
+    monkeypatch.delenv('NIXNETCONFIG_COMPLETION_SNAPSHOT', raising=False)
+    assert completion.get_snapshot_path() == os.path.join(os.path.expanduser('~'), '.nixnetconfig', 'completion.txt')
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_completion_command_prints_script(stdout_mock, snapshot_path):
+    __main__.main(['completion', 'zsh'])
+    assert stdout_mock.getvalue() == completion.generate_script('zsh')
+
+
+def test_completion_command_writes_snapshot(tmp_path, simulated_backend):
+    path = tmp_path / 'snapshots' / 'completion.txt'
+    simulated_backend('sim:1x2x1,standalone=1')
+    with mock.patch('nixnetconfig.utilities.set_backend', spec=True):
+        __main__.main(['completion', '--update-snapshot', str(path)])
+    assert path.read_text() == 'interfaces CAN3 CAN1 CAN2\nserial_numbers 00000001 00010001 00010002\n'
+    assert os.listdir(str(path.parent)) == ['completion.txt']
+    assert os.stat(str(path.parent)).st_mode & 0o777 == 0o700
+    assert os.stat(str(path)).st_mode & 0o077 == 0
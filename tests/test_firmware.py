@@ -0,0 +1,119 @@
+import io
+import json
+from nixnetconfig import __main__
+from nixnetconfig import firmware
+from nixnetconfig import utilities
+import pytest
+from unittest import mock
+
+
+SIMULATED_BACKEND = 'sim:1x2x1,standalone=1'
+
+
+def _device(system, serial_number):
+    return next(resource for resource in system.resources if resource.is_device and resource.serial_number == serial_number)
+
+
+def test_get_firmware_status_compares_with_available_firmware(simulated_system):
+    _device(simulated_system, '00010002').firmware_revision = '18000000'
+    _device(simulated_system, '00000001').firmware_revision = ''
+    assert firmware.get_firmware_status() == [
+        firmware.FirmwareStatus('00000001', 'NI PXI-8513', '', '', '19072316', firmware.UNKNOWN),
+        firmware.FirmwareStatus('00010001', 'NI PXI-8513', 'Chassis1', '19072316', '19072316', firmware.CURRENT),
+        firmware.FirmwareStatus('00010002', 'NI PXI-8513', 'Chassis1', '18000000', '19072316', firmware.OUTDATED),
+    ]
+    assert sum(simulated_system.call_counts[call] for call in ('rename', 'save_changes', 'upgrade_firmware')) == 0
+
+
+@pytest.mark.parametrize('firmware_revision, available_revisions, expected_status', [
+    ('19072316', ['18000000', '19072316'], firmware.CURRENT),
+    ('20000000', ['19072316'], firmware.CURRENT),
+    ('9.2.0', ['10.0.0', '9.2.0'], firmware.OUTDATED),
+    ('10.1.0', ['9.2.0', '10.0.0'], firmware.CURRENT),
+])
+def test_get_firmware_status_orders_revisions(simulated_system, firmware_revision, available_revisions, expected_status):
+    device = _device(simulated_system, '00010001')
+    device.firmware_revision = firmware_revision
+    device.available_firmware_version = available_revisions
+    status, = firmware.get_firmware_status(serial_numbers=['00010001'])
+    assert (status.installed_revision, status.status) == (max(available_revisions, key=firmware.revision_key), expected_status)
+
+
+class _RevisionReads(list):
+    # Records the serial number of the device each time its revisions are read
+    def __init__(self, revisions, serial_number, reads):
+        super().__init__(revisions)
+        self.serial_number = serial_number
+        self.reads = reads
+
+    def __iter__(self):
+        self.reads.append(self.serial_number)
+        return super().__iter__()
+
+
+def test_available_revisions_are_read_only_for_compared_devices(simulated_system):
+    reads = []
+    for resource in simulated_system.resources:
+        if resource.is_device:
+            resource.available_firmware_version = _RevisionReads(resource.available_firmware_version, resource.serial_number, reads)
+    utilities.get_system_tree()
+    assert reads == []
+    firmware.get_firmware_status(serial_numbers=['00010002'])
+    assert reads == ['00010002']
+    firmware.get_firmware_status(expected_revision='19072316')
+    assert reads == ['00010002']
+
+
+def test_get_firmware_status_selects_devices_and_expected_revision(simulated_system):
+    statuses = firmware.get_firmware_status(serial_numbers=['00010002'], expected_revision='20000000')
+    assert [(status.serial_number, status.installed_revision, status.status) for status in statuses] == [
+        ('00010002', '20000000', firmware.OUTDATED)]
+
+
+def test_get_firmware_status_is_unknown_without_available_firmware(simulated_system):
+    for resource in simulated_system.resources:
+        resource.available_firmware_version = []
+    assert set(status.status for status in firmware.get_firmware_status()) == {firmware.UNKNOWN}
+
+
+def test_get_firmware_status_uses_firmware_available_on_target(simulated_system):
+    with utilities.using_target('pxi-01'):
+        firmware.get_firmware_status()
+        _device(simulated_system.targets['pxi-01'], '00010001').available_firmware_version = ['20000000']
+        statuses = firmware.get_firmware_status(serial_numbers=['00010001'])
+    assert [(status.installed_revision, status.status) for status in statuses] == [('20000000', firmware.OUTDATED)]
+    assert firmware.get_firmware_status(serial_numbers=['00010001'])[0].status == firmware.CURRENT
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_report_firmware_status_prints_table_and_summary(stdout_mock, simulated_system):
+    _device(simulated_system, '00010002').firmware_revision = '18000000'
+    firmware.report_firmware_status(expected_revision='19072316')
+    assert stdout_mock.getvalue().splitlines() == [
+        'Serial    Product      Chassis   Firmware  Installed  Status',
+        '00000001  NI PXI-8513            19072316  19072316   current',
+        '00010001  NI PXI-8513  Chassis1  19072316  19072316   current',
+        '00010002  NI PXI-8513  Chassis1  18000000  19072316   outdated',
+        '2 current, 1 outdated, 0 unknown',
+    ]
+
+
+def test_report_firmware_status_writes_json(simulated_system):
+    for resource in simulated_system.resources:
+        resource.available_firmware_version = []
+    stream = io.StringIO()
+    firmware.report_firmware_status(output_format='json', stream=stream)
+    devices = json.loads(stream.getvalue())['devices']
+    assert devices[0] == {
+        'serial_number': '00000001', 'product_name': 'NI PXI-8513', 'chassis': '', 'firmware_revision': '19072316',
+        'installed_revision': '', 'status': 'unknown'}
+
+
+@pytest.mark.parametrize('arguments, expected_revision, output_format', [
+    ([], None, 'text'),
+    (['--expected', '19072316', '-f', 'json'], '19072316', 'json'),
+])
+@mock.patch('nixnetconfig.firmware.report_firmware_status', spec=True)
+def test_report_firmware_status_runs_when_firmware_status_is_specified(report_firmware_status_mock, arguments, expected_revision, output_format):
+    __main__.main(['firmware-status'] + arguments)
+    report_firmware_status_mock.assert_called_once_with(expected_revision=expected_revision, output_format=output_format)
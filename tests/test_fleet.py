@@ -0,0 +1,414 @@
+import copy
+import io
+import multiprocessing
+from nixnetconfig import fleet
+from nixnetconfig.journal import Journal
+from nixnetconfig import locking
+from nixnetconfig import utilities
+import os
+import pytest
+import time
+from tests.test_utilities import _sysapi_data
+from tests.test_utilities import SessionMock
+from unittest import mock
+
+
+def _make_rack_data():
+    sysapi_data = copy.deepcopy(_sysapi_data)
+    del sysapi_data['device1_port1_mock']
+    sysapi_data['chassis2_mock'] = dict(sysapi_data['chassis1_mock'], expert_user_alias=['otherChassis'], provides_link_name='chassis2')
+    for index, chassis in enumerate(['chassis1', 'chassis1', 'chassis2', 'chassis2', '']):
+        sysapi_data['device{}_mock'.format(index + 1)] = dict(
+            sysapi_data['device1_mock'],
+            serial_number='SN{}'.format(index + 1),
+            provides_link_name='Device{} Link'.format(index + 1),
+            connects_to_link_name=chassis)
+    return sysapi_data
+
+
+@pytest.fixture
+def forked_workers(monkeypatch):
+    # Tests that replace the driver or the operations in this process need workers that inherit it
+    monkeypatch.setattr(fleet, '_WORKER_START_METHOD', 'fork')
+
+
+@pytest.fixture
+def rack_session(forked_workers):
+    with mock.patch('nisyscfg.Session', new_callable=SessionMock(_make_rack_data())) as session_mock:
+        yield session_mock
+
+
+def _record_operation(log_path, duration=0.2):
+    def operation(serial_number):
+        with open(log_path, 'a') as log:
+            log.write('{} start {}\n'.format(serial_number, time.time()))
+        time.sleep(duration)
+        with open(log_path, 'a') as log:
+            log.write('{} end {}\n'.format(serial_number, time.time()))
+    return operation
+
+
+def _max_concurrency(log_path, serial_numbers):
+    events = []
+    with open(log_path) as log:
+        for line in log:
+            serial_number, event, timestamp = line.split()
+            if serial_number in serial_numbers:
+                events.append((float(timestamp), 1 if event == 'start' else -1))
+    active = peak = 0
+    for _, change in sorted(events, key=lambda event: (event[0], event[1])):
+        active += change
+        peak = max(peak, active)
+    return peak
+
+
+def test_select_targets_returns_all_devices_with_their_chassis(rack_session):
+    targets = fleet.select_targets([], all_devices=True)
+    assert targets == [
+        fleet.FleetTarget('SN5', ''),
+        fleet.FleetTarget('SN1', 'myChassis'),
+        fleet.FleetTarget('SN2', 'myChassis'),
+        fleet.FleetTarget('SN3', 'otherChassis'),
+        fleet.FleetTarget('SN4', 'otherChassis'),
+    ]
+
+
+def test_select_targets_returns_chassis_devices_and_serial_numbers_once(rack_session):
+    targets = fleet.select_targets(['SN4', 'SN1', 'SN5'], chassis='MYCHASSIS')
+    assert [target.serial_number for target in targets] == ['SN1', 'SN2', 'SN4', 'SN5']
+
+
+@pytest.mark.parametrize(
+    'serial_numbers, chassis, message',
+    [([], None, 'Specify at least one serial number, a chassis, or --all'),
+     (['SN9'], None, 'Could not find a device with serial number "SN9"'),
+     ([], 'noChassis', 'Could not find a chassis "noChassis" with NI-XNET devices')])
+def test_select_targets_raises_error_for_invalid_selection(rack_session, serial_numbers, chassis, message):
+    with pytest.raises(utilities.XnetConfigError) as error:
+        fleet.select_targets(serial_numbers, chassis=chassis)
+    assert error.value.message == message
+
+
+def test_spread_across_chassis_interleaves_chassis():
+    targets = [fleet.FleetTarget('SN1', 'A'), fleet.FleetTarget('SN2', 'A'), fleet.FleetTarget('SN3', 'A'), fleet.FleetTarget('SN4', 'B')]
+    assert [target.serial_number for target in fleet.spread_across_chassis(targets)] == ['SN1', 'SN4', 'SN2', 'SN3']
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_operation_limits_concurrent_devices_per_chassis(stdout_mock, rack_session, tmp_path):
+    log_path = str(tmp_path / 'operations.log')
+    targets = fleet.select_targets([], all_devices=True)
+    with mock.patch('nixnetconfig.utilities.upgrade_xnet_firmware', new=_record_operation(log_path)):
+        results = fleet.run_operation('upgrade_xnet_firmware', targets, jobs=4, per_chassis=1)
+    assert [result.serial_number for result in results] == [target.serial_number for target in targets]
+    assert all(result.passed for result in results)
+    assert _max_concurrency(log_path, ['SN1', 'SN2']) == 1
+    assert _max_concurrency(log_path, ['SN3', 'SN4']) == 1
+    assert _max_concurrency(log_path, ['SN1', 'SN2', 'SN3', 'SN4', 'SN5']) == 3
+    assert 'SN1: started' in stdout_mock.getvalue()
+    assert 'SN1: passed' in stdout_mock.getvalue()
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_operation_does_not_limit_devices_outside_a_chassis(stdout_mock, forked_workers, tmp_path):
+    log_path = str(tmp_path / 'operations.log')
+    targets = [fleet.FleetTarget('SN1', 'A'), fleet.FleetTarget('SN2', 'A'), fleet.FleetTarget('SN5', ''), fleet.FleetTarget('SN6', '')]
+    with mock.patch('nixnetconfig.utilities.upgrade_xnet_firmware', new=_record_operation(log_path)):
+        results = fleet.run_operation('upgrade_xnet_firmware', targets, jobs=4, per_chassis=1)
+    assert all(result.passed for result in results)
+    assert _max_concurrency(log_path, ['SN1', 'SN2']) == 1
+    assert _max_concurrency(log_path, ['SN5', 'SN6']) == 2
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_operation_limits_concurrent_devices_to_jobs(stdout_mock, rack_session, tmp_path):
+    log_path = str(tmp_path / 'operations.log')
+    targets = fleet.select_targets([], all_devices=True)
+    with mock.patch('nixnetconfig.utilities.self_test_xnet_device', new=_record_operation(log_path)):
+        fleet.run_operation('self_test_xnet_device', targets, jobs=2)
+    assert _max_concurrency(log_path, ['SN1', 'SN2', 'SN3', 'SN4', 'SN5']) == 2
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_operation_reports_a_crashed_worker_without_stopping_other_devices(stdout_mock, rack_session):
+    def operation(serial_number):
+        if serial_number == 'SN1':
+            os._exit(3)
+        if serial_number == 'SN2':
+            raise utilities.DeviceWithSerialNumberNotFoundError(serial_number)
+
+    targets = [fleet.FleetTarget('SN1', 'A'), fleet.FleetTarget('SN2', 'A'), fleet.FleetTarget('SN3', 'B')]
+    with mock.patch('nixnetconfig.utilities.upgrade_xnet_firmware', new=operation):
+        results = fleet.run_operation('upgrade_xnet_firmware', targets, jobs=1)
+    assert [(result.passed, result.message) for result in results] == [
+        (False, 'Worker exited with code 3'),
+        (False, 'Could not find a device with serial number "SN2"'),
+        (True, ''),
+    ]
+    assert 'SN1: failed' in stdout_mock.getvalue()
+
+
+@pytest.mark.parametrize(
+    'side_effect, expected',
+    [(None, (True, '', [])),
+     (utilities.XnetConfigError('my error message'), (False, 'my error message', [])),
+     (RuntimeError('driver failure'), (False, 'driver failure', [])),
+     (RuntimeError(), (False, 'RuntimeError', []))])
+def test_run_worker_sends_result_to_parent(side_effect, expected):
+    connection = mock.Mock()
+    with mock.patch('nixnetconfig.utilities.self_test_xnet_device', side_effect=side_effect) as self_test_mock:
+        fleet.run_worker('self_test_xnet_device', 'SN1', connection)
+    self_test_mock.assert_called_once_with('SN1')
+    connection.send.assert_called_once_with(expected)
+    connection.close.assert_called_once_with()
+
+
+@mock.patch('nixnetconfig.utilities.upgrade_xnet_firmware', spec=True)
+def test_update_xnet_firmware_updates_a_single_device_in_process(upgrade_xnet_firmware_mock):
+    fleet.update_xnet_firmware(['SN1'])
+    upgrade_xnet_firmware_mock.assert_called_once_with('SN1')
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('nixnetconfig.fleet.run_operation', spec=True)
+def test_update_xnet_firmware_prints_result_table_and_fails_when_a_device_fails(run_operation_mock, stdout_mock, rack_session):
+    run_operation_mock.return_value = [
+        fleet.FleetResult('SN1', 'myChassis', True, 12.0, ''),
+        fleet.FleetResult('SN5', '', False, 1.5, 'my error message'),
+    ]
+    with pytest.raises(fleet.FleetOperationError) as error:
+        fleet.update_xnet_firmware(['SN1', 'SN5'], jobs=3, per_chassis=2)
+    assert error.value.message == '1 of 2 devices failed'
+    run_operation_mock.assert_called_once_with(
+        'upgrade_xnet_firmware', [fleet.FleetTarget('SN1', 'myChassis'), fleet.FleetTarget('SN5', '')], 3, 2, None)
+    lines = stdout_mock.getvalue().splitlines()
+    assert lines[1].split() == ['SN1', 'myChassis', 'PASS', '12.0']
+    assert lines[2].split() == ['SN5', '-', 'FAIL', '1.5', 'my', 'error', 'message']
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('nixnetconfig.fleet.run_operation', spec=True)
+def test_update_xnet_firmware_succeeds_when_all_devices_pass(run_operation_mock, stdout_mock, rack_session):
+    run_operation_mock.return_value = [fleet.FleetResult('SN1', 'myChassis', True, 12.0, '')]
+    fleet.update_xnet_firmware([], all_devices=True)
+    assert 'PASS' in stdout_mock.getvalue()
+
+
+@mock.patch('nixnetconfig.utilities.self_test_xnet_device', spec=True)
+def test_self_test_xnet_devices_tests_a_single_device_in_process(self_test_xnet_device_mock):
+    fleet.self_test_xnet_devices(['SN1'])
+    self_test_xnet_device_mock.assert_called_once_with('SN1')
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_self_test_xnet_devices_tests_a_chassis_concurrently(stdout_mock, rack_session, tmp_path):
+    log_path = str(tmp_path / 'operations.log')
+    with mock.patch('nixnetconfig.utilities.self_test_xnet_device', new=_record_operation(log_path, duration=0.5)):
+        start_time = time.perf_counter()
+        fleet.self_test_xnet_devices([], chassis='myChassis')
+        elapsed_time = time.perf_counter() - start_time
+    assert _max_concurrency(log_path, ['SN1', 'SN2']) == 2
+    assert elapsed_time < 1.0
+    lines = stdout_mock.getvalue().splitlines()
+    assert [line.split()[:3] for line in lines[-2:]] == [['SN1', 'myChassis', 'PASS'], ['SN2', 'myChassis', 'PASS']]
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_self_test_xnet_devices_fails_when_any_device_fails(stdout_mock, rack_session):
+    def self_test(serial_number):
+        if serial_number == 'SN3':
+            raise RuntimeError('self test failed')
+
+    with mock.patch('nixnetconfig.utilities.self_test_xnet_device', new=self_test):
+        with pytest.raises(fleet.FleetOperationError) as error:
+            fleet.self_test_xnet_devices([], all_devices=True, jobs=5)
+    assert error.value.message == '1 of 5 devices failed'
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('nixnetconfig.fleet.run_operation', spec=True)
+def test_update_xnet_firmware_skips_current_devices_when_if_outdated(run_operation_mock, stdout_mock, rack_session):
+    rack_session.update_device_firmware_version('18000000', 'device2_mock')
+    rack_session.update_device_firmware_version('', 'device4_mock')
+    run_operation_mock.return_value = [
+        fleet.FleetResult('SN2', 'myChassis', True, 10.0, ''),
+        fleet.FleetResult('SN4', 'otherChassis', True, 20.0, ''),
+    ]
+    fleet.update_xnet_firmware([], all_devices=True, if_outdated=True)
+    run_operation_mock.assert_called_once_with(
+        'upgrade_xnet_firmware', [fleet.FleetTarget('SN2', 'myChassis'), fleet.FleetTarget('SN4', 'otherChassis')], 4, 1, None)
+    assert stdout_mock.getvalue().startswith('Skipped 3 of 5 devices with current firmware, saving about 45 s\n')
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('nixnetconfig.fleet.run_operation', spec=True)
+def test_update_xnet_firmware_does_nothing_when_all_devices_are_current(run_operation_mock, stdout_mock, rack_session):
+    fleet.update_xnet_firmware(['SN1', 'SN3'], if_outdated=True)
+    run_operation_mock.assert_not_called()
+    assert stdout_mock.getvalue().splitlines()[0] == 'Skipped 2 of 2 devices with current firmware'
+
+
+@pytest.mark.parametrize('firmware_revision, expected_calls', [('19072316', []), ('18000000', [mock.call('SN1')])])
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('nixnetconfig.utilities.upgrade_xnet_firmware', spec=True)
+def test_update_xnet_firmware_checks_a_single_device_when_if_outdated(
+        upgrade_xnet_firmware_mock, stdout_mock, rack_session, firmware_revision, expected_calls):
+    rack_session.update_device_firmware_version(firmware_revision)
+    fleet.update_xnet_firmware(['SN1'], if_outdated=True)
+    assert upgrade_xnet_firmware_mock.mock_calls == expected_calls
+    assert ('Skipped 1 of 1' in stdout_mock.getvalue()) == (not expected_calls)
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_fleet_operation_resumes_from_journal(stdout_mock, rack_session, tmp_path):
+    journal_path = str(tmp_path / 'update.journal')
+    log_path = str(tmp_path / 'operations.log')
+    record_operation = _record_operation(log_path, duration=0)
+
+    def fail_on_sn2(serial_number):
+        record_operation(serial_number)
+        if serial_number == 'SN2':
+            raise RuntimeError('driver failure')
+
+    with mock.patch('nixnetconfig.utilities.upgrade_xnet_firmware', new=fail_on_sn2):
+        with pytest.raises(fleet.FleetOperationError):
+            fleet.update_xnet_firmware(['SN1', 'SN2', 'SN3'], journal_file=journal_path)
+    with mock.patch('nixnetconfig.utilities.upgrade_xnet_firmware', new=record_operation):
+        fleet.update_xnet_firmware(['SN1', 'SN2', 'SN3', 'SN4'], resume_file=journal_path)
+    with open(log_path) as log:
+        started = [line.split()[0] for line in log if ' start ' in line]
+    assert sorted(started[:3]) == ['SN1', 'SN2', 'SN3']
+    assert sorted(started[3:]) == ['SN2', 'SN4']
+    assert 'Skipped 2 of 4 devices that finished in journal' in stdout_mock.getvalue()
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_fleet_operation_resumes_twice_after_journal_write_was_cut_short(stdout_mock, rack_session, tmp_path):
+    journal_path = str(tmp_path / 'update.journal')
+    log_path = str(tmp_path / 'operations.log')
+    record_operation = _record_operation(log_path, duration=0)
+
+    def fail_on_sn2(serial_number):
+        if serial_number == 'SN2':
+            raise RuntimeError('driver failure')
+        record_operation(serial_number)
+
+    with mock.patch('nixnetconfig.utilities.upgrade_xnet_firmware', new=fail_on_sn2):
+        with pytest.raises(fleet.FleetOperationError):
+            fleet.update_xnet_firmware(['SN1', 'SN2', 'SN3'], journal_file=journal_path)
+        with open(journal_path, 'a') as file:
+            file.write('{"operation": "upgrade_xnet_fir')
+        with pytest.raises(fleet.FleetOperationError):
+            fleet.update_xnet_firmware([], resume_file=journal_path)
+    with mock.patch('nixnetconfig.utilities.upgrade_xnet_firmware', new=record_operation):
+        fleet.update_xnet_firmware([], resume_file=journal_path)
+    with open(log_path) as log:
+        assert sorted(line.split()[0] for line in log if ' start ' in line) == ['SN1', 'SN2', 'SN3']
+    assert Journal(journal_path, 'upgrade_xnet_firmware').completed() == {'SN1', 'SN2', 'SN3'}
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('nixnetconfig.fleet.run_operation', spec=True)
+def test_fleet_operation_resumes_selection_of_journal(run_operation_mock, stdout_mock, rack_session, tmp_path):
+    journal_path = str(tmp_path / 'test.journal')
+    run_operation_mock.return_value = []
+    fleet.self_test_xnet_devices([], chassis='myChassis', journal_file=journal_path)
+    selected = run_operation_mock.call_args[0][1]
+    Journal(journal_path, 'self_test_xnet_device').record(Journal.FINISHED, selected[0].serial_number)
+    run_operation_mock.reset_mock()
+    fleet.self_test_xnet_devices([], resume_file=journal_path)
+    assert run_operation_mock.call_args[0][1] == selected[1:]
+
+
+def test_fleet_operation_cannot_resume_journal_without_selection(rack_session, tmp_path):
+    journal_path = str(tmp_path / 'update.journal')
+    Journal(journal_path, 'upgrade_xnet_firmware').record(Journal.FINISHED, 'SN1')
+    with pytest.raises(utilities.XnetConfigError) as error:
+        fleet.update_xnet_firmware([], resume_file=journal_path)
+    assert error.value.message == 'Journal "{}" does not record which devices it selected, so specify them again'.format(journal_path)
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('nixnetconfig.fleet.run_operation', spec=True)
+def test_self_test_xnet_devices_journals_a_single_device(run_operation_mock, stdout_mock, rack_session, tmp_path):
+    journal_path = str(tmp_path / 'test.journal')
+    run_operation_mock.return_value = [fleet.FleetResult('SN1', 'myChassis', True, 1.0, '')]
+    fleet.self_test_xnet_devices(['SN1'], journal_file=journal_path)
+    run_operation_mock.assert_called_once_with('self_test_xnet_device', [fleet.FleetTarget('SN1', 'myChassis')], 4, journal=mock.ANY)
+    Journal(journal_path, 'self_test_xnet_device').record(Journal.FINISHED, 'SN1')
+    run_operation_mock.reset_mock()
+    fleet.self_test_xnet_devices(['SN1'], resume_file=journal_path)
+    run_operation_mock.assert_not_called()
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_operation_kills_worker_that_misses_its_deadline(stdout_mock, rack_session, monkeypatch):
+    def operation(serial_number):
+        if serial_number == 'SN1':
+            time.sleep(30)
+
+    monkeypatch.setattr(fleet, '_KILL_GRACE_PERIOD', 0.0)
+    targets = [fleet.FleetTarget('SN1', 'A'), fleet.FleetTarget('SN2', 'B')]
+    start_time = time.perf_counter()
+    with mock.patch('nixnetconfig.utilities.self_test_xnet_device', new=operation), utilities.using_timeout(0.5):
+        results = fleet.run_operation('self_test_xnet_device', targets, jobs=2)
+    assert time.perf_counter() - start_time < 10
+    assert [(result.passed, result.message) for result in results] == [
+        (False, 'Device with serial number "SN1" did not finish within 0.5 s'),
+        (True, ''),
+    ]
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_run_operation_never_kills_worker_that_updates_firmware(stdout_mock, rack_session, monkeypatch, tmp_path):
+    log_path = str(tmp_path / 'operations.log')
+    monkeypatch.setattr(fleet, '_KILL_GRACE_PERIOD', 0.0)
+    targets = [fleet.FleetTarget('SN1', 'A'), fleet.FleetTarget('SN2', 'B')]
+    with mock.patch('nixnetconfig.utilities.upgrade_xnet_firmware', new=_record_operation(log_path, 1.0)), utilities.using_timeout(0.5):
+        results = fleet.run_operation('upgrade_xnet_firmware', targets, jobs=1)
+    assert [(result.passed, result.message) for result in results] == [
+        (False, 'Device with serial number "SN1" did not finish within 0.5 s'),
+        (False, 'Device with serial number "SN2" did not finish within 0.5 s'),
+    ]
+    assert 'SN1: failed' in stdout_mock.getvalue()
+    # Both updates finished, one after another
+    with open(log_path) as log:
+        assert [line.split()[:2] for line in log] == [['SN1', 'start'], ['SN1', 'end'], ['SN2', 'start'], ['SN2', 'end']]
+
+
+def test_run_worker_applies_timeout_of_parent():
+    timeouts = []
+    with mock.patch('nixnetconfig.utilities.self_test_xnet_device', side_effect=lambda _: timeouts.append(utilities.current_timeout())):
+        fleet.run_worker('self_test_xnet_device', 'SN1', mock.Mock(), None, 12.5)
+    assert timeouts == [12.5]
+
+
+def test_run_worker_selects_backend_and_lock_timeout_of_parent():
+    settings = []
+    try:
+        with mock.patch('nixnetconfig.utilities.self_test_xnet_device', side_effect=lambda _: settings.append((utilities.get_backend(), locking.get_timeout()))):
+            fleet.run_worker('self_test_xnet_device', 'SN1', mock.Mock(), None, None, 'sim:1x1x1', 2.5)
+        assert settings == [('sim:1x1x1', 2.5)]
+    finally:
+        utilities.set_backend()
+        locking.configure()
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_spawned_workers_run_against_backend_of_parent(stdout_mock, simulated_backend):
+    simulated_backend('sim:1x2x1')
+    with mock.patch.object(fleet.multiprocessing, 'get_context', wraps=multiprocessing.get_context) as get_context_mock:
+        fleet.self_test_xnet_devices([], all_devices=True)
+    get_context_mock.assert_called_once_with('spawn')
+    assert stdout_mock.getvalue().count('PASS') == 2
+
+
+@mock.patch('nixnetconfig.utilities.self_test_xnet_device', spec=True)
+@mock.patch('nixnetconfig.utilities.upgrade_xnet_firmware', spec=True)
+def test_fleet_operations_run_with_timeout(upgrade_xnet_firmware_mock, self_test_xnet_device_mock):
+    timeouts = []
+    upgrade_xnet_firmware_mock.side_effect = self_test_xnet_device_mock.side_effect = lambda _: timeouts.append(utilities.current_timeout())
+    fleet.update_xnet_firmware(['SN1'], timeout=60)
+    fleet.self_test_xnet_devices(['SN1'], timeout=0)
+    fleet.self_test_xnet_devices(['SN1'])
+    assert timeouts == [60, 0, None]
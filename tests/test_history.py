@@ -0,0 +1,163 @@
+import io
+import json
+from nixnetconfig import __main__
+from nixnetconfig import fleet
+from nixnetconfig import history
+from nixnetconfig import parser
+from nixnetconfig import utilities
+from nixnetconfig.api import XnetSystem
+import pytest
+import time
+from unittest import mock
+
+
+SIMULATED_BACKEND = 'sim:1x2x1,standalone=1'
+
+
+def _record(serial_number, started, duration=1.0, passed=True, target=''):
+    history.record(history.TestRun(target, serial_number, started, duration, passed, '' if passed else 'failure'))
+
+
+def test_summarize_reports_runs_pass_rate_and_durations_per_device():
+    for index in range(7):
+        _record('00010001', 1000.0 + index, duration=10.0 + 10 * (index >= 2), passed=index != 3)
+    _record('00010002', 900.0, passed=False)
+    _record('00010001', 800.0, target='pxi-01')
+    assert history.summarize() == [
+        history.DeviceHistory('', '00010001', 7, 6, 1006.0, True, 120.0 / 7, 20.0),
+        history.DeviceHistory('', '00010002', 1, 0, 900.0, False, 1.0, 1.0),
+        history.DeviceHistory('pxi-01', '00010001', 1, 1, 800.0, True, 1.0, 1.0),
+    ]
+    assert [summary.serial_number for summary in history.summarize(['00010002'])] == ['00010002']
+
+
+def test_passed_since_returns_devices_with_recent_pass_on_current_target():
+    _record('00010001', 1000.0)
+    _record('00010002', 1000.0, passed=False)
+    _record('00010003', 500.0)
+    _record('00010004', 1000.0, target='pxi-01')
+    # Only the latest self-test of a device counts
+    _record('00010005', 950.0)
+    _record('00010005', 1000.0, passed=False)
+    _record('00010006', 950.0, passed=False)
+    _record('00010006', 1000.0)
+    assert history.passed_since(900.0) == {'00010001', '00010006'}
+    with utilities.using_target('pxi-01'):
+        assert history.passed_since(900.0) == {'00010004'}
+
+
+@pytest.mark.parametrize('side_effect, passed, message', [
+    (None, True, ''),
+    (utilities.OperationTimeoutError('00010001', 5), False, 'Device with serial number "00010001" did not finish within 5 s'),
+    (RuntimeError(), False, 'RuntimeError'),
+])
+def test_recording_records_outcome_of_self_test(side_effect, passed, message):
+    with mock.patch('time.time', return_value=1000.0):
+        with pytest.raises(type(side_effect)) if side_effect else mock.MagicMock():
+            with history.recording('00010001'):
+                if side_effect:
+                    raise side_effect
+    summary, = history.summarize()
+    assert (summary.serial_number, summary.last_started, summary.last_passed) == ('00010001', 1000.0, passed)
+    with history._connect() as connection:
+        assert list(connection.execute('SELECT message FROM self_tests')) == [(message,)]
+
+
+def test_recording_does_not_fail_self_test_when_history_cannot_be_written(tmp_path, monkeypatch):
+    (tmp_path / 'file').write_text('')
+    monkeypatch.setenv('NIXNETCONFIG_HISTORY', str(tmp_path / 'file' / 'history.db'))
+    with mock.patch.object(history.logger, 'warning') as warning_mock:
+        with history.recording('00010001'):
+            pass
+    assert warning_mock.call_args[0][0].startswith('Could not open self-test history')
+
+
+def test_history_reports_unusable_database(history_path):
+    history_path.write_text('not a database' * 100)
+    with pytest.raises(utilities.XnetConfigError) as error:
+        history.summarize()
+    assert error.value.message.startswith('Could not use self-test history "{}"'.format(history_path))
+
+
+@pytest.mark.parametrize('seconds, text', [(86400, '1d'), (172800, '2d'), (5400, '90m'), (3600, '1h'), (90, '90s'), (0.5, '0.5s')])
+def test_format_age(seconds, text):
+    assert history.format_age(seconds) == text
+
+
+def test_report_history_prints_table_with_trend(history_path):
+    for index in range(6):
+        _record('00010001', 1000.0 + index, duration=10.0 if index else 40.0, passed=index != 2)
+    _record('00010002', 2000.0, target='pxi-01', passed=False)
+    stream = io.StringIO()
+    history.report_history(stream=stream)
+    assert stream.getvalue().splitlines() == [
+        'Serial number             Runs  Pass rate  Last run          Result    Mean (s)   Last 5 (s)   Trend',
+        '00010001                     6        83%  {:<18}PASS          15.0         10.0    -33%'.format(
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(1005.0))),
+        'pxi-01/00010002              1         0%  {:<18}FAIL           1.0          1.0       -'.format(
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(2000.0))),
+    ]
+
+
+def test_report_history_writes_json_or_reports_empty_history(history_path):
+    stream = io.StringIO()
+    history.report_history(stream=stream)
+    assert stream.getvalue() == 'No self-test results in "{}"\n'.format(history_path)
+    _record('00010001', 1000.0)
+    stream = io.StringIO()
+    history.report_history(['00010001'], output_format='json', stream=stream)
+    assert json.loads(stream.getvalue())['devices'] == [{
+        'target': '', 'serial_number': '00010001', 'runs': 1, 'passes': 1, 'last_started': 1000.0, 'last_passed': True,
+        'mean_duration': 1.0, 'recent_duration': 1.0}]
+
+
+def test_self_tests_are_recorded(simulated_system):
+    utilities.self_test_xnet_device('00010001')
+    with XnetSystem(target='pxi-01') as system:
+        system.self_test('00010002')
+    assert [(summary.target, summary.serial_number) for summary in history.summarize()] == [('', '00010001'), ('pxi-01', '00010002')]
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('nixnetconfig.fleet.run_operation', spec=True)
+def test_self_test_xnet_devices_skips_devices_that_passed_recently(run_operation_mock, stdout_mock, simulated_system):
+    run_operation_mock.return_value = [fleet.FleetResult('00010002', 'Chassis1', True, 1.0, '')]
+    _record('00000001', time.time() - 60)
+    _record('00010001', time.time() - 7200)
+    _record('00010002', time.time() - 60, passed=False)
+    fleet.self_test_xnet_devices([], all_devices=True, if_older_than=3600)
+    run_operation_mock.assert_called_once_with(
+        'self_test_xnet_device', [fleet.FleetTarget('00010001', 'Chassis1'), fleet.FleetTarget('00010002', 'Chassis1')], 4, journal=None)
+    assert 'Skipped 1 of 3 devices that passed a self-test in the last 1h' in stdout_mock.getvalue()
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('nixnetconfig.utilities.self_test_xnet_device', spec=True)
+def test_self_test_xnet_devices_skips_a_single_device_that_passed_recently(self_test_xnet_device_mock, stdout_mock):
+    _record('00010001', time.time() - 60)
+    fleet.self_test_xnet_devices(['00010001'], if_older_than=86400)
+    self_test_xnet_device_mock.assert_not_called()
+    assert stdout_mock.getvalue() == 'Skipped 1 of 1 devices that passed a self-test in the last 1d\n'
+    fleet.self_test_xnet_devices(['00010001'], if_older_than=30)
+    self_test_xnet_device_mock.assert_called_once_with('00010001')
+
+
+@pytest.mark.parametrize('text, seconds', [('24h', 86400.0), ('30m', 1800.0), (' 7D ', 604800.0), ('1.5s', 1.5)])
+def test_parse_age(text, seconds):
+    assert parser.parse_age(text) == seconds
+
+
+@mock.patch('sys.stderr', new_callable=io.StringIO)
+@mock.patch('nixnetconfig.fleet.self_test_xnet_devices', spec=True)
+def test_test_command_parses_if_older_than(self_test_xnet_devices_mock, stderr_mock):
+    __main__.main(['test', '--if-older-than', '24h', 'a1'])
+    assert self_test_xnet_devices_mock.call_args[1]['if_older_than'] == 86400.0
+    with pytest.raises(SystemExit):
+        __main__.main(['test', '--if-older-than', '24', 'a1'])
+    assert 'invalid age "24"' in stderr_mock.getvalue()
+
+
+@mock.patch('nixnetconfig.history.report_history', spec=True)
+def test_report_history_runs_when_history_is_specified(report_history_mock):
+    __main__.main(['history', '-f', 'json', 'a1'])
+    report_history_mock.assert_called_once_with(serial_numbers=['A1'], output_format='json')
@@ -0,0 +1,136 @@
+import io
+import json
+import os
+from nixnetconfig import __main__
+from nixnetconfig import fleet
+from nixnetconfig import instrumentation
+from nixnetconfig import utilities
+import pytest
+from unittest import mock
+
+
+SIMULATED_BACKEND = 'sim:1x1x2'
+
+
+@pytest.fixture
+def timings():
+    timings = instrumentation.Timings()
+    instrumentation.add_hook(timings)
+    yield timings
+    instrumentation.remove_hook(timings)
+
+
+def test_open_session_returns_driver_session_when_disabled(simulated_system):
+    assert not instrumentation.is_enabled()
+    with utilities.open_session() as session:
+        assert type(session).__name__ == 'SimulatedSession'
+
+
+def test_instrumented_session_measures_every_driver_call(simulated_system, timings):
+    utilities.assign_xnet_port_name('00010001', 2, 'ENGINE')
+    utilities.blink_xnet_port('ENGINE', 'on')
+    utilities.self_test_xnet_device('00010001')
+    with pytest.raises(utilities.XnetConfigError):
+        utilities.upgrade_xnet_firmware('0001000F')
+    counts = timings.counts()
+    assert counts['Session.open'] == 4
+    assert counts['Session.create_filter'] == counts['Session.find_hardware'] == 5
+    assert counts['Session.find_hardware next'] == 6
+    # Commands lock the device they change by its link name
+    assert counts['Resource.get provides_link_name'] == 2
+    assert counts['Resource.get connects_to_link_name'] == 1
+    assert counts['Resource.get xnet.port_number'] == 2
+    assert counts['Resource.set xnet.blink'] == 1
+    assert counts['Resource.rename'] == counts['Resource.save_changes'] == counts['Resource.self_test'] == 1
+
+
+def test_instrumented_calls_report_errors(simulated_system):
+    events = []
+    instrumentation.add_hook(events.append)
+    try:
+        with utilities.open_session() as session:
+            resource = next(session.find_hardware(filter=None, expert_names=['xnet']))
+            resource.is_chassis = True
+            with mock.patch.object(simulated_system, 'simulate_call', side_effect=RuntimeError('driver failure')):
+                with pytest.raises(RuntimeError):
+                    resource.save_changes()
+            with pytest.raises(AttributeError):
+                resource.missing_property
+    finally:
+        instrumentation.remove_hook(events.append)
+    assert [(event.name, event.error) for event in events[-4:]] == [
+        ('Session.find_hardware next', None), ('Resource.set is_chassis', None),
+        ('Resource.save_changes', 'RuntimeError'), ('Resource.get missing_property', 'AttributeError')]
+    assert not instrumentation.is_enabled()
+
+
+def test_timings_summarize_latency():
+    timings = instrumentation.Timings()
+    for duration in (0.0, 0.0004, 0.003, 0.003, 0.010):
+        timings(instrumentation.CallEvent('Session.find_hardware', 0.0, duration, 1, None, 1))
+    timings(instrumentation.CallEvent('Resource.rename', 0.0, 0.5, 1, None, 1))
+    assert timings.summary() == [
+        ('Resource.rename', 1, 0.5, 0.5, 0.5, 0.5),
+        ('Session.find_hardware', 5, pytest.approx(0.0164), pytest.approx(0.00328), 0.010, 0.010)]
+    assert timings.histogram('Session.find_hardware') == {'<= 1 ms': 2, '<= 4 ms': 2, '<= 16 ms': 1}
+    assert timings.histogram('Resource.self_test') == {}
+    stream = io.StringIO()
+    timings.write_summary(stream)
+    assert stream.getvalue().splitlines()[1].split() == ['Resource.rename', '1', '0.500', 's', '500.00', 'ms', '500.00', 'ms', '500.00', 'ms']
+
+
+def test_trace_recorder_writes_chrome_trace_events(tmp_path):
+    recorder = instrumentation.TraceRecorder()
+    recorder(instrumentation.CallEvent('Session.open', recorder._origin + 0.5, 0.25, 7, None, 42))
+    recorder(instrumentation.CallEvent('Resource.rename', recorder._origin + 1.0, 0.001, 7, 'RuntimeError', 42))
+    trace_file = str(tmp_path / 'trace.json')
+    recorder.write(trace_file)
+    with open(trace_file) as file:
+        trace = json.load(file)
+    assert trace['traceEvents'][0] == {
+        'name': 'Session.open', 'cat': 'nisyscfg', 'ph': 'X', 'ts': 500000.0, 'dur': 250000.0, 'pid': 42, 'tid': 7}
+    assert trace['traceEvents'][1]['args'] == {'error': 'RuntimeError'}
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('sys.stderr', new_callable=io.StringIO)
+def test_timings_and_trace_options_report_driver_calls(stderr_mock, stdout_mock, tmp_path):
+    trace_file = str(tmp_path / 'trace.json')
+    __main__.main(['--backend', 'sim:1x1x2', 'rename', 'can1', 'engine', '--timings', '--trace', trace_file])
+    utilities.set_backend()
+    assert not instrumentation.is_enabled()
+    assert 'Resource.rename' in stderr_mock.getvalue()
+    with open(trace_file) as file:
+        names = [event['name'] for event in json.load(file)['traceEvents']]
+    assert names[0] == 'Session.open'
+    assert 'Resource.rename' in names
+
+
+@pytest.mark.parametrize('argv', [['--timings'], ['enumerate', '--trace=trace.json'], ['enumerate', '--trace', 'trace.json']])
+def test_instrumented_commands_are_not_forwarded_to_daemon(argv):
+    assert __main__.client.is_local(argv)
+
+
+@pytest.mark.parametrize('argv', [['--backend', 'sim:1x1x1', 'enumerate'], ['--lock-timeout=3', 'rename', 'CAN1', 'ENGINE']])
+def test_commands_with_settings_of_the_daemon_are_not_forwarded(argv):
+    assert __main__.client.is_local(argv)
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_fleet_workers_report_driver_calls_to_hooks_of_parent(stdout_mock, simulated_system, timings):
+    events = []
+    instrumentation.add_hook(events.append)
+    try:
+        results = fleet.run_operation('self_test_xnet_device', [fleet.FleetTarget('00010001', 'Chassis1')])
+    finally:
+        instrumentation.remove_hook(events.append)
+    assert results[0].passed
+    assert timings.counts()['Resource.self_test'] == 1
+    assert set(event.process_id for event in events) - {os.getpid()}
+
+
+def test_collecting_without_hooks_drops_inherited_hooks(timings):
+    with instrumentation.collecting(enabled=False) as events:
+        assert not instrumentation.is_enabled()
+    assert events == []
+    assert instrumentation.is_enabled()
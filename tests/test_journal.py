@@ -0,0 +1,78 @@
+import json
+from nixnetconfig.journal import Journal
+from nixnetconfig.journal import JournalError
+import pytest
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / 'update.journal')
+
+
+def test_journal_appends_one_json_line_per_event(journal_path):
+    journal = Journal(journal_path, 'upgrade_xnet_firmware')
+    journal.record(Journal.STARTED, 'SN1')
+    journal.record(Journal.FAILED, 'SN1', 'driver failure')
+    with open(journal_path) as file:
+        entries = [json.loads(line) for line in file]
+    assert [(entry['serial_number'], entry['event'], entry.get('message')) for entry in entries] == [
+        ('SN1', 'started', None), ('SN1', 'failed', 'driver failure')]
+    assert entries == journal.read()
+
+
+def test_journal_completed_returns_devices_whose_latest_event_finished(journal_path):
+    journal = Journal(journal_path, 'upgrade_xnet_firmware')
+    for event, serial_number in [
+            (Journal.STARTED, 'SN1'), (Journal.FINISHED, 'SN1'),
+            (Journal.STARTED, 'SN2'), (Journal.FAILED, 'SN2'),
+            (Journal.STARTED, 'SN3'),
+            (Journal.FAILED, 'SN4'), (Journal.FINISHED, 'SN4')]:
+        journal.record(event, serial_number)
+    Journal(journal_path, 'self_test_xnet_device').record(Journal.FINISHED, 'SN5')
+    assert journal.completed() == {'SN1', 'SN4'}
+    assert Journal(journal_path, 'self_test_xnet_device').completed() == {'SN5'}
+
+
+def test_journal_ignores_last_line_cut_short(journal_path):
+    journal = Journal(journal_path, 'upgrade_xnet_firmware')
+    journal.record(Journal.FINISHED, 'SN1')
+    with open(journal_path, 'a') as file:
+        file.write('{"operation": "upgrade_xnet_fir')
+    assert journal.completed() == {'SN1'}
+
+
+def test_journal_drops_line_cut_short_before_appending(journal_path):
+    journal = Journal(journal_path, 'upgrade_xnet_firmware')
+    journal.record(Journal.FINISHED, 'SN1')
+    with open(journal_path, 'a') as file:
+        file.write('{"operation": "upgrade_xnet_fir')
+    journal.record(Journal.FINISHED, 'SN2')
+    journal.record(Journal.FINISHED, 'SN3')
+    assert journal.completed() == {'SN1', 'SN2', 'SN3'}
+    with open(journal_path, 'w') as file:
+        file.write('{"operation": "upgrade_xnet_fir')
+    journal.record(Journal.FINISHED, 'SN4')
+    assert journal.completed() == {'SN4'}
+
+
+def test_journal_raises_error_for_corrupt_or_missing_journal(journal_path):
+    journal = Journal(journal_path, 'upgrade_xnet_firmware')
+    with pytest.raises(JournalError) as error:
+        journal.read()
+    assert error.value.message == 'Could not find journal "{}"'.format(journal_path)
+    with open(journal_path, 'w') as file:
+        file.write('garbage\n\n')
+    with pytest.raises(JournalError) as error:
+        journal.read()
+    assert error.value.message == 'Journal "{}" is corrupt at line 1'.format(journal_path)
+
+
+def test_journal_selection_returns_latest_selection_of_operation(journal_path):
+    journal = Journal(journal_path, 'upgrade_xnet_firmware')
+    journal.record(Journal.FINISHED, 'SN1')
+    assert journal.selection() is None
+    journal.record_selection(['SN1', 'SN2'])
+    journal.record_selection(['SN3'])
+    Journal(journal_path, 'self_test_xnet_device').record_selection(['SN4'])
+    assert journal.selection() == ['SN3']
+    assert journal.completed() == {'SN1'}
@@ -0,0 +1,302 @@
+import io
+import json
+from nixnetconfig import __main__
+from nixnetconfig import api
+from nixnetconfig import locking
+from nixnetconfig import plan
+from nixnetconfig import transaction
+from nixnetconfig import utilities
+import multiprocessing
+import os
+import pytest
+import threading
+import time
+from unittest import mock
+
+
+@pytest.fixture(autouse=True)
+def lock_timeout():
+    locking.configure(timeout=0.2)
+    yield
+    locking.configure()
+
+
+SIMULATED_BACKEND = 'sim:1x2x2'
+
+
+def _hold_in_thread(context_manager):
+    # Holds the lock on another thread until the returned event is set
+    acquired, release = threading.Event(), threading.Event()
+
+    def hold():
+        with context_manager:
+            acquired.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    assert acquired.wait(5)
+    return release, thread
+
+
+def _hold_in_process(link_name, acquired, release):
+    with locking.changing_device(link_name, 'the device'):
+        acquired.set()
+        release.wait()
+
+
+def test_readers_share_the_hardware():
+    release, thread = _hold_in_thread(locking.reading())
+    try:
+        with locking.reading():
+            pass
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_changes_to_different_devices_run_at_once():
+    release, thread = _hold_in_thread(locking.changing_device('PXI1Slot2', 'the first device'))
+    try:
+        with locking.changing_device('PXI1Slot3', 'the second device'):
+            pass
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_changes_to_one_device_wait_and_name_the_holder():
+    release, thread = _hold_in_thread(locking.changing_device('PXI1Slot2', 'the first device'))
+    try:
+        with pytest.raises(locking.LockTimeoutError) as error:
+            with locking.changing_device('PXI1Slot2', 'the device with serial number "00010001"'):
+                pass
+    finally:
+        release.set()
+        thread.join()
+    assert error.value.message.startswith(
+        'Timed out after 0.2 s waiting for the device with serial number "00010001". The lock is held by pid {} "'.format(os.getpid()))
+    with locking.changing_device('PXI1Slot2', 'the device'):
+        pass
+
+
+@pytest.mark.parametrize('held, wanted, description', [
+    (lambda: locking.reading(), lambda: locking.changing_device('PXI1Slot2', 'the device'), 'reads of the hardware to finish'),
+    (lambda: locking.changing_device('PXI1Slot2', 'the device'), lambda: locking.reading(), 'changes to the hardware to finish'),
+])
+def test_readers_and_writers_exclude_each_other(held, wanted, description):
+    release, thread = _hold_in_thread(held())
+    try:
+        with pytest.raises(locking.LockTimeoutError) as error:
+            with wanted():
+                pass
+    finally:
+        release.set()
+        thread.join()
+    assert 'waiting for {}. The lock is held by pid {}'.format(description, os.getpid()) in error.value.message
+
+
+def test_locks_of_other_targets_do_not_wait():
+    release, thread = _hold_in_thread(locking.changing_device('PXI1Slot2', 'the device'))
+    try:
+        with locking.changing_device('PXI1Slot2', 'the device', target='rack:1'), locking.reading('rack:1'):
+            pass
+    finally:
+        release.set()
+        thread.join()
+    assert 'rack_1.write.lock' in os.listdir(locking.get_directory())
+
+
+def test_nested_locks_of_one_thread_do_not_wait():
+    with locking.changing_device('PXI1Slot2', 'the device'):
+        with locking.reading(), locking.changing_device('PXI1Slot2', 'the device'):
+            pass
+        with locking.changing_device('PXI1Slot3', 'another device'):
+            pass
+    assert not [name for name in os.listdir(locking.get_directory()) if name.endswith('.holder')]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_locks_exclude_other_processes():
+    context = multiprocessing.get_context('fork')
+    acquired, release = context.Event(), context.Event()
+    process = context.Process(target=_hold_in_process, args=('PXI1Slot2', acquired, release))
+    process.start()
+    try:
+        assert acquired.wait(5)
+        with pytest.raises(locking.LockTimeoutError) as error:
+            with locking.changing_device('PXI1Slot2', 'the device'):
+                pass
+        assert 'held by pid {} '.format(process.pid) in error.value.message
+    finally:
+        release.set()
+        process.join()
+    with locking.changing_device('PXI1Slot2', 'the device'):
+        pass
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_locks_of_killed_processes_are_released():
+    context = multiprocessing.get_context('fork')
+    acquired, release = context.Event(), context.Event()
+    process = context.Process(target=_hold_in_process, args=('PXI1Slot2', acquired, release))
+    process.start()
+    assert acquired.wait(5)
+    process.kill()
+    process.join()
+    path = os.path.join(locking.get_directory(), 'local.device.PXI1Slot2.lock')
+    assert [name for name in os.listdir(locking.get_directory()) if name.endswith('.holder')]
+    with locking.changing_device('PXI1Slot2', 'the device'):
+        pass
+    # The notes of the killed process are stale, so they are cleaned up instead of being reported
+    assert locking.get_holders(path) == []
+    assert locking.get_holders(os.path.join(locking.get_directory(), 'local.write.lock')) == []
+    assert not [name for name in os.listdir(locking.get_directory()) if name.endswith('.holder')]
+
+
+def test_timeout_of_zero_waits_forever():
+    locking.configure(timeout=0)
+    release, thread = _hold_in_thread(locking.changing_device('PXI1Slot2', 'the device'))
+    threading.Timer(0.3, release.set).start()
+    start_time = time.monotonic()
+    with locking.changing_device('PXI1Slot2', 'the device'):
+        assert time.monotonic() - start_time >= 0.3
+    thread.join()
+
+
+def test_settings_default_to_environment(monkeypatch, lock_directory):
+    locking.configure()
+    monkeypatch.setenv('NIXNETCONFIG_LOCK_TIMEOUT', '5')
+    assert locking.get_timeout() == 5.0
+    assert locking.get_directory() == str(lock_directory)
+    monkeypatch.delenv('NIXNETCONFIG_LOCK_TIMEOUT')
+    monkeypatch.delenv('NIXNETCONFIG_LOCK_DIR')
+    assert locking.get_timeout() == locking._DEFAULT_TIMEOUT
+    assert locking.get_directory() == locking._DEFAULT_LOCK_DIRECTORY
+    locking.configure(directory='locks', timeout=1)
+    assert (locking.get_directory(), locking.get_timeout()) == ('locks', 1.0)
+
+
+def test_holders_are_unknown_while_a_holder_starts(tmp_path):
+    path = str(tmp_path / 'local.read.lock')
+    note_path = path + '.1-1.holder'
+    with open(note_path, 'w') as note:
+        locking._try_lock(note, shared=False)
+        assert locking.get_holders(path) == ['a starting process']
+    with mock.patch('builtins.open', side_effect=OSError('no access')):
+        assert locking.get_holders(path) == []
+
+
+@pytest.mark.skipif(not hasattr(os, 'O_NOFOLLOW'), reason='requires symbolic links')
+def test_holders_never_write_through_links_in_the_lock_directory(tmp_path):
+    victim = tmp_path / 'victim.txt'
+    victim.write_text('precious')
+    path = locking._lock_path(None, 'read')
+    os.makedirs(locking.get_directory(), exist_ok=True)
+    os.symlink(str(victim), '{}.{}-{}.holder'.format(path, os.getpid(), threading.get_ident()))
+    with locking.reading():
+        assert locking.get_holders(path)[0].startswith('pid {} '.format(os.getpid()))
+    assert victim.read_text() == 'precious'
+
+
+def test_readers_do_not_wait_for_self_tests_and_firmware_updates(simulated_system):
+    simulated_system.latency['self_test'] = simulated_system.latency['upgrade_firmware'] = 0.6
+    for operation, call in [(utilities.self_test_xnet_device, 'self_test'), (utilities.upgrade_xnet_firmware, 'upgrade_firmware')]:
+        thread = threading.Thread(target=operation, args=('00010001',))
+        thread.start()
+        try:
+            deadline = time.monotonic() + 5
+            while not simulated_system.call_counts[call]:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            utilities.enumerate_xnet_devices('ndjson')
+            with locking.reading():
+                pass
+            # Other changes to the device still wait
+            with pytest.raises(locking.LockTimeoutError):
+                utilities.assign_xnet_port_name('00010001', 1, 'ENGINE')
+        finally:
+            thread.join()
+
+
+def test_commands_change_devices_under_their_locks(simulated_system):
+    release, thread = _hold_in_thread(locking.changing_device('PXI1Slot2', 'the first device'))
+    try:
+        for command, message in [
+                (lambda: utilities.rename_xnet_port_name('CAN1', 'ENGINE'), 'the device of interface "CAN1"'),
+                (lambda: utilities.blink_xnet_port('CAN2', 'on'), 'the device of interface "CAN2"'),
+                (lambda: utilities.assign_xnet_port_name('00010001', 1, 'ENGINE'), 'the device with serial number "00010001"'),
+                (lambda: utilities.upgrade_xnet_firmware('00010001'), 'the device with serial number "00010001"'),
+                (lambda: utilities.self_test_xnet_device('00010001'), 'the device with serial number "00010001"')]:
+            with pytest.raises(locking.LockTimeoutError) as error:
+                command()
+            assert 'waiting for {}.'.format(message) in error.value.message
+        # The second device is free
+        utilities.assign_xnet_port_name('00010002', 1, 'ENGINE')
+        with pytest.raises(locking.LockTimeoutError) as error:
+            utilities.enumerate_xnet_devices('ndjson')
+        assert 'waiting for changes to the hardware to finish' in error.value.message
+    finally:
+        release.set()
+        thread.join()
+    assert simulated_system.call_counts['rename'] == 1
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_plans_transactions_and_api_change_devices_under_their_locks(stdout_mock, simulated_system, tmp_path):
+    plan_file = tmp_path / 'plan.json'
+    plan_file.write_text(json.dumps({'00010001': {'1': 'ENGINE'}, '00010002': {'1': 'BODY'}}))
+    release, thread = _hold_in_thread(locking.changing_device('PXI1Slot2', 'the first device'))
+    try:
+        with pytest.raises(plan.PlanApplyError) as error:
+            plan.apply_plan(str(plan_file))
+        assert 'waiting for the device of interface "CAN1"' in error.value.message
+        with pytest.raises(transaction.TransactionError) as error:
+            transaction.blink_xnet_ports('on', ['CAN1', 'CAN3'])
+        assert [name for name, _ in error.value.failures] == ['CAN1']
+        with api.XnetSystem() as system:
+            for call in [lambda: system.rename('CAN1', 'ENGINE'), lambda: system.assign('00010001', 2, 'ENGINE'),
+                         lambda: system.blink('CAN2', 'on'), lambda: system.update('00010001'), lambda: system.self_test('00010001')]:
+                with pytest.raises(locking.LockTimeoutError):
+                    call()
+            # The second device is free
+            system.rename('CAN3', 'BODY')
+    finally:
+        release.set()
+        thread.join()
+    assert simulated_system.call_counts['rename'] == 1
+    assert simulated_system.call_counts['save_changes'] == 1
+
+
+def test_abandoned_device_operation_keeps_its_lock_until_the_driver_returns(simulated_system):
+    simulated_system.latency['self_test'] = 0.6
+    with utilities.using_timeout(0.1), pytest.raises(utilities.OperationTimeoutError):
+        utilities.self_test_xnet_device('00010001')
+    with pytest.raises(locking.LockTimeoutError) as error:
+        with locking.changing_device('PXI1Slot2', 'the device'):
+            pass
+    assert 'held by pid {} '.format(os.getpid()) in error.value.message
+    locking.configure(timeout=5)
+    start_time = time.monotonic()
+    with locking.changing_device('PXI1Slot2', 'the device'):
+        assert time.monotonic() - start_time > 0.1
+
+
+@mock.patch('platform.system', return_value='Windows')
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_version_reads_under_shared_lock(stdout_mock, platform_mock, simulated_system):
+    release, thread = _hold_in_thread(locking.reading())
+    try:
+        utilities.get_xnet_expert_version()
+    finally:
+        release.set()
+        thread.join()
+    assert stdout_mock.getvalue() == 'ni-xnet 20.0.0\n'
+
+
+@mock.patch('nixnetconfig.locking.configure', spec=True)
+@mock.patch('nixnetconfig.utilities.rename_xnet_port_name', spec=True)
+def test_lock_timeout_option_configures_locking(rename_xnet_port_name_mock, configure_mock):
+    __main__.main(['rename', 'CAN1', 'ENGINE', '--lock-timeout', '2.5'])
+    configure_mock.assert_called_once_with(timeout=2.5)
+    rename_xnet_port_name_mock.assert_called_once_with(current_port_name='CAN1', new_port_name='ENGINE')
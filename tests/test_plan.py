@@ -0,0 +1,133 @@
+import io
+import json
+from nixnetconfig import __main__
+from nixnetconfig import plan
+from nixnetconfig import simulation
+from nixnetconfig import utilities
+import pytest
+import sys
+from unittest import mock
+
+
+SIMULATED_BACKEND = 'sim:1x2x2'
+
+
+def _write_plan(tmp_path, content, name='plan.yaml'):
+    path = tmp_path / name
+    path.write_text(content)
+    return str(path)
+
+
+def _aliases(system):
+    return [resource.expert_user_alias[0] for resource in system.resources if not resource.is_device and not resource.is_chassis]
+
+
+@pytest.mark.parametrize('name, content', [
+    ('plan.yaml', '"00010001":\n  1: can1\n  2: Engine\n"00010002": {2: body}\n'),
+    ('plan.json', json.dumps({'00010001': {'1': 'CAN1', '2': 'ENGINE'}, '00010002': {'2': 'BODY'}})),
+])
+def test_load_plan_reads_yaml_and_json(tmp_path, name, content):
+    assert plan.load_plan(_write_plan(tmp_path, content, name)) == {
+        ('00010001', 1): 'CAN1', ('00010001', 2): 'ENGINE', ('00010002', 2): 'BODY'}
+
+
+@pytest.mark.parametrize('content, message', [
+    ('- CAN1\n', 'must map serial numbers to port numbers and interface names'),
+    ('A1: {one: CAN1}\n', 'must map serial numbers to port numbers and interface names'),
+    ('A1: [CAN1\n', 'Could not parse plan'),
+])
+def test_load_plan_raises_error_for_invalid_plan(tmp_path, content, message):
+    with pytest.raises(utilities.XnetConfigError) as error:
+        plan.load_plan(_write_plan(tmp_path, content))
+    assert message in error.value.message
+
+
+def test_load_plan_requires_pyyaml_for_yaml(tmp_path):
+    with mock.patch.dict(sys.modules, {'yaml': None}):
+        with pytest.raises(utilities.XnetConfigError) as error:
+            plan.load_plan(_write_plan(tmp_path, 'A1: {1: CAN1}\n'))
+        assert plan.load_plan(_write_plan(tmp_path, '{}', 'plan.json')) == {}
+    assert 'requires PyYAML' in error.value.message
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_apply_plan_renames_only_changed_ports(stdout_mock, tmp_path, simulated_system):
+    plan_file = _write_plan(tmp_path, '"00010001": {1: CAN1, 2: ENGINE}\n"00010002": {2: BODY}\n')
+    plan.apply_plan(plan_file)
+    assert _aliases(simulated_system) == ['CAN1', 'ENGINE', 'CAN3', 'BODY']
+    assert stdout_mock.getvalue() == '00010001 port 2: CAN2 -> ENGINE\n00010002 port 2: CAN4 -> BODY\n'
+    assert simulated_system.call_counts == {'find_hardware': 1, 'rename': 2}
+
+    # Applying the same plan again finds nothing to change
+    plan.apply_plan(plan_file)
+    assert stdout_mock.getvalue().endswith('No changes\n')
+    assert simulated_system.call_counts == {'find_hardware': 2, 'rename': 2}
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_apply_plan_dry_run_prints_changes_without_renaming(stdout_mock, tmp_path, simulated_system):
+    plan.apply_plan(_write_plan(tmp_path, '"00010002": {1: ENGINE}\n'), dry_run=True)
+    assert stdout_mock.getvalue() == '00010002 port 1: CAN3 -> ENGINE\n'
+    assert _aliases(simulated_system) == ['CAN1', 'CAN2', 'CAN3', 'CAN4']
+    assert simulated_system.call_counts == {'find_hardware': 1}
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_apply_plan_swaps_names_through_temporary_name(stdout_mock, tmp_path, simulated_system):
+    plan.apply_plan(_write_plan(tmp_path, '"00010001": {1: CAN2, 2: CAN3}\n"00010002": {1: CAN1}\n'))
+    assert _aliases(simulated_system) == ['CAN2', 'CAN3', 'CAN1', 'CAN4']
+    assert simulated_system.call_counts['rename'] == 4
+
+
+@pytest.mark.parametrize('content, error_type, message', [
+    ('"0001000F": {1: CAN1}\n', utilities.DeviceWithSerialNumberNotFoundError, 'Could not find a device with serial number "0001000F"'),
+    ('"00010001": {3: CAN9}\n', utilities.PortNotFoundError, 'Device with serial number "00010001" does not have port number 3'),
+    ('"00010001": {1: CAN4}\n', utilities.XnetConfigError, 'Interface name "CAN4" is already used by port 2 of device with serial number "00010002"'),
+    ('"00010001": {1: ENGINE, 2: engine}\n', utilities.XnetConfigError,
+     'Interface name "ENGINE" is planned for port 1 of device with serial number "00010001" and port 2 of device with serial number "00010001"'),
+])
+def test_apply_plan_validates_plan_before_renaming(tmp_path, simulated_system, content, error_type, message):
+    with pytest.raises(error_type) as error:
+        plan.apply_plan(_write_plan(tmp_path, content))
+    assert error.value.message == message
+    assert simulated_system.call_counts['rename'] == 0
+
+
+def _failing_renames(system, fails):
+    # Renames to the names for which fails returns True raise like the driver
+    rename = simulation.SimulatedResource.rename
+
+    def failing_rename(resource, new_name, *args, **kwargs):
+        if fails(new_name):
+            raise simulation.SimulatedDriverError(-1, 'rename failed')
+        return rename(resource, new_name, *args, **kwargs)
+    return mock.patch.object(simulation.SimulatedResource, 'rename', failing_rename)
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_apply_plan_renames_ports_back_when_a_rename_fails(stdout_mock, tmp_path, simulated_system):
+    # The swap renames CAN1 to a temporary name and CAN2 to CAN1, then fails to give the temporary name CAN2
+    failures = ['CAN2']
+    with _failing_renames(simulated_system, lambda new_name: new_name in failures and not failures.remove(new_name)):
+        with pytest.raises(plan.PlanApplyError) as error:
+            plan.apply_plan(_write_plan(tmp_path, '"00010001": {1: CAN2, 2: CAN1}\n'))
+    assert error.value.message == 'Could not rename "NIXNETCONFIG_00010001_1" to "CAN2": -1: rename failed. Undid 2 renames'
+    assert error.value.unrestored == []
+    assert _aliases(simulated_system) == ['CAN1', 'CAN2', 'CAN3', 'CAN4']
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_apply_plan_reports_ports_it_could_not_rename_back(stdout_mock, tmp_path, simulated_system):
+    with _failing_renames(simulated_system, lambda new_name: not new_name.startswith('NIXNETCONFIG_')):
+        with pytest.raises(plan.PlanApplyError) as error:
+            plan.apply_plan(_write_plan(tmp_path, '"00010001": {1: CAN2, 2: CAN1}\n'))
+    assert error.value.message == (
+        'Could not rename "CAN2" to "CAN1": -1: rename failed. Could not rename back: "NIXNETCONFIG_00010001_1" (was "CAN1")')
+    assert _aliases(simulated_system) == ['NIXNETCONFIG_00010001_1', 'CAN2', 'CAN3', 'CAN4']
+
+
+@pytest.mark.parametrize('arguments, dry_run', [([], False), (['--dry-run'], True), (['-n'], True)])
+@mock.patch('nixnetconfig.plan.apply_plan', spec=True)
+def test_apply_plan_runs_when_apply_is_specified(apply_plan_mock, arguments, dry_run):
+    __main__.main(['apply', 'plan.yaml'] + arguments)
+    apply_plan_mock.assert_called_once_with(plan_file='plan.yaml', dry_run=dry_run)
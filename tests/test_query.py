@@ -0,0 +1,135 @@
+import io
+import json
+from nixnetconfig import __main__
+from nixnetconfig import cache
+from nixnetconfig import query
+from nixnetconfig import utilities
+import pytest
+from unittest import mock
+
+
+SIMULATED_BACKEND = 'sim:2x3x2,standalone=1'
+
+
+def _interfaces(records):
+    return [(record['serial_number'], interface['name']) for record in records for interface in record['interfaces']]
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('product = "NI PXI-8513"', ('and', [])),
+    ('serial = 00010001', ('compare', 'serial_number', '=', '00010001')),
+    ("NOT alias ~ 'CAN 1*'", ('not', ('compare', 'interface', '~', 'CAN 1*'))),
+    ('port>=2 and (slot = 4 or chassis != x)', ('and', [
+        ('compare', 'port_number', '>=', '2'),
+        ('or', [('compare', 'slot', '=', '4'), ('compare', 'chassis', '!=', 'x')])])),
+    (r'firmware < "19\"07" or serial = a or serial = b', ('or', [
+        ('compare', 'firmware_revision', '<', '19"07'), ('compare', 'serial_number', '=', 'a'), ('compare', 'serial_number', '=', 'b')])),
+])
+def test_parse_query_builds_expression_tree(expression, expected):
+    if expected == ('and', []):
+        expected = ('compare', 'product_name', '=', 'NI PXI-8513')
+    assert query.parse_query(expression.replace('NOT', 'not')) == expected
+
+
+@pytest.mark.parametrize('expression, problem', [
+    ('', 'the query is empty'),
+    ('serial =', 'expected a value at the end'),
+    ('serial', 'expected an operator at the end'),
+    ('serial serial', 'expected an operator after "serial", not "serial"'),
+    ('serial = )', 'expected a value after "=", not ")"'),
+    ('colour = red', 'unknown field "colour", use one of product, serial, firmware, alias, port, chassis, slot'),
+    ('(port = 1', 'expected ")" at the end'),
+    ('(port = 1 port', 'expected ")"'),
+    ('port = 1 port = 2', 'unexpected "port"'),
+    ('port = "1', 'unexpected ""1"'),
+    ('port ! 1', 'unexpected "! 1"'),
+])
+def test_parse_query_raises_error_for_invalid_query(expression, problem):
+    with pytest.raises(query.QueryError) as error:
+        query.parse_query(expression)
+    assert error.value.message == 'Invalid query "{}": {}'.format(expression, problem)
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('slot = 4 and chassis = chassis2', [('00020003', 'CAN11'), ('00020003', 'CAN12')]),
+    ('port = 2 and chassis = Chassis1', [('00010001', 'CAN2'), ('00010002', 'CAN4'), ('00010003', 'CAN6')]),
+    ('alias ~ can1? and not port = 1', [('00000001', 'CAN14'), ('00020002', 'CAN10'), ('00020003', 'CAN12')]),
+    ('serial = 00000001', [('00000001', 'CAN13'), ('00000001', 'CAN14')]),
+    ('serial = 1', []),
+    ('serial = 00020002 and alias = can10', [('00020002', 'CAN10')]),
+    ('serial = 00020002 and alias = can11', []),
+    ('alias = CAN99', []),
+    ('chassis = Chassis9', []),
+    ('chassis != Chassis1 and chassis != Chassis2', [('00000001', 'CAN13'), ('00000001', 'CAN14')]),
+    ('firmware >= 19072316 and slot > 3', [('00010003', 'CAN5'), ('00010003', 'CAN6'), ('00020003', 'CAN11'), ('00020003', 'CAN12')]),
+])
+def test_find_records_matches_devices_and_interfaces(simulated_system, expression, expected):
+    assert _interfaces(query.find_records(expression)) == expected
+
+
+def test_find_records_pushes_predicates_down_to_driver(simulated_system):
+    query.find_records('serial = 00020002 and port = 1')
+    # The chassis query is the only one that is not restricted to the device
+    assert simulated_system.call_counts['find_hardware'] == 3
+    session = simulated_system.create_session()
+    with mock.patch.object(session, 'find_hardware', wraps=session.find_hardware) as find_hardware_mock:
+        records = query.query_records(session, query.parse_query('chassis = Chassis2 and alias = CAN11 and port = 1'))
+    assert _interfaces(records) == [('00020003', 'CAN11')]
+    assert [call[1]['filter'].properties for call in find_hardware_mock.call_args_list] == [
+        {'is_chassis': True, 'user_alias': 'Chassis2'},
+        {'is_device': True, 'connects_to_link_name': 'PXI2'},
+        {'is_device': False, 'user_alias': 'CAN11'},
+    ]
+
+
+def test_find_records_leaves_out_devices_of_unknown_chassis(simulated_system):
+    next(resource for resource in simulated_system.resources if resource.serial_number == '00010001').connects_to_link_name = 'PXI9'
+    assert [record['serial_number'] for record in query.find_records('port = 1 and slot = 2')] == ['00000001', '00020001']
+
+
+def test_find_records_uses_inventory_cache(simulated_system):
+    cache.configure(in_memory=True)
+    try:
+        utilities.get_system_tree()
+        query_count = simulated_system.call_counts['find_hardware']
+        assert _interfaces(query.find_records('alias = can3')) == [('00010002', 'CAN3')]
+        assert simulated_system.call_counts['find_hardware'] == query_count
+    finally:
+        cache.configure()
+
+
+def test_find_records_keeps_devices_without_interfaces(simulated_backend):
+    simulated_backend('sim:1x1x0')
+    records = query.find_records('product ~ *8513')
+    assert [(record['serial_number'], record['interfaces']) for record in records] == [('00010001', [])]
+    assert query.find_records('port = 1') == []
+    stream = io.StringIO()
+    query.find_xnet_devices(['slot', '=', '2'], stream=stream)
+    assert stream.getvalue().splitlines()[1].split() == ['00010001', 'NI', 'PXI-8513', 'Chassis1', '2', '19072316']
+
+
+def test_find_xnet_devices_prints_table(simulated_system):
+    stream = io.StringIO()
+    query.find_xnet_devices('serial = 00000001 or (chassis = Chassis2 and slot = 2 and port = 1)', stream=stream)
+    assert stream.getvalue().splitlines() == [
+        'Serial    Product      Chassis   Slot  Firmware  Interface  Port',
+        '00000001  NI PXI-8513            2     19072316  CAN13      1',
+        '00000001  NI PXI-8513            2     19072316  CAN14      2',
+        '00020001  NI PXI-8513  Chassis2  2     19072316  CAN7       1',
+    ]
+    stream = io.StringIO()
+    query.find_xnet_devices('serial = 0', stream=stream)
+    assert stream.getvalue() == 'No matching devices\n'
+
+
+def test_find_xnet_devices_writes_records(simulated_system):
+    stream = io.StringIO()
+    query.find_xnet_devices('alias = CAN4', output_format='json', stream=stream)
+    device, = json.loads(stream.getvalue())['devices']
+    assert (device['serial_number'], device['chassis'], device['interfaces']) == ('00010002', 'Chassis1', [{'name': 'CAN4', 'port_number': 2}])
+
+
+@mock.patch('nixnetconfig.query.find_xnet_devices', spec=True)
+def test_find_xnet_devices_runs_when_find_is_specified(find_xnet_devices_mock):
+    __main__.main(['find', 'port', '=', '1', '-f', 'csv'])
+    find_xnet_devices_mock.assert_called_once_with(query=['port', '=', '1'], output_format='csv')
@@ -0,0 +1,131 @@
+import csv
+import io
+import json
+from nixnetconfig import __main__
+from nixnetconfig import fleet
+from nixnetconfig import remote
+from nixnetconfig import utilities
+import pytest
+import threading
+import time
+from unittest import mock
+
+
+SIMULATED_BACKEND = 'sim:1x1x2'
+
+
+def _main(*argv):
+    # Keep the simulated system of the fixture rather than the backend selected by main
+    with mock.patch('nixnetconfig.utilities.set_backend'), \
+            mock.patch('sys.stdout', new_callable=io.StringIO) as stdout_mock, mock.patch('sys.stderr', new_callable=io.StringIO) as stderr_mock:
+        try:
+            __main__.main(list(argv))
+            exit_code = 0
+        except SystemExit as exit:
+            exit_code = exit.code
+    return exit_code, stdout_mock.getvalue(), stderr_mock.getvalue()
+
+
+def test_parse_targets_merges_options_and_file(tmp_path):
+    targets_file = tmp_path / 'targets.txt'
+    targets_file.write_text('# rack 1\npxi-01\npxi-02  # spare\n\npxi-03\n')
+    assert remote.parse_targets(['pxi-02,pxi-04', 'pxi-05'], str(targets_file)) == ['pxi-02', 'pxi-04', 'pxi-05', 'pxi-01', 'pxi-03']
+
+
+@pytest.mark.parametrize('targets, targets_file, message', [
+    ([' , '], None, 'No targets were specified'),
+    (None, 'missing.txt', 'Could not read targets file "missing.txt"'),
+])
+def test_parse_targets_raises_error_without_targets(targets, targets_file, message):
+    with pytest.raises(utilities.XnetConfigError) as error:
+        remote.parse_targets(targets, targets_file)
+    assert error.value.message.startswith(message)
+
+
+def test_run_on_targets_opens_a_session_per_target_concurrently(simulated_system):
+    running = {'count': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    def enumerate_target():
+        with lock:
+            running['count'] += 1
+            running['peak'] = max(running['peak'], running['count'])
+        time.sleep(0.05)
+        print('reading', utilities.current_target())
+        tree = utilities.get_system_tree()
+        with lock:
+            running['count'] -= 1
+        return len(list(tree.iter_devices()))
+
+    targets = ['pxi-{:02}'.format(index) for index in range(6)]
+    results = remote.run_on_targets(enumerate_target, targets, jobs=3)
+    assert [(result.target, result.value, result.output, result.error) for result in results] == [
+        (target, 1, 'reading {}\n'.format(target), None) for target in targets]
+    assert running['peak'] == 3
+    assert sorted(simulated_system.targets) == targets
+    assert simulated_system.call_counts['find_hardware'] == 0
+    assert utilities.current_target() is None
+
+
+def test_commands_run_on_every_target(simulated_system):
+    exit_code, stdout, _ = _main('rename', 'can1', 'engine', '--target', 'pxi-01,pxi-02', '-e')
+    assert exit_code == 0
+    assert '[pxi-01] My System:' in stdout
+    assert '[pxi-02]             Interface: ENGINE' in stdout
+    for target in ('pxi-01', 'pxi-02'):
+        assert simulated_system.targets[target].call_counts['rename'] == 1
+    assert simulated_system.call_counts['rename'] == 0
+
+
+def test_commands_report_failed_targets(simulated_system):
+    simulated_system.create_session('pxi-02')
+    simulated_system.targets['pxi-02'].resources.pop()
+    exit_code, stdout, stderr = _main('--target', 'pxi-01', '--target', 'pxi-02', 'blink', 'on', 'CAN2')
+    assert exit_code == 1
+    assert stderr == '[pxi-02] ERROR: Could not find port "CAN2"\nERROR: 1 of 2 targets failed\n'
+    with mock.patch('nixnetconfig.utilities.blink_xnet_port', side_effect=RuntimeError('connection refused')):
+        assert '[pxi-01] ERROR: connection refused' in _main('blink', 'on', 'CAN2', '--target', 'pxi-01')[2]
+
+
+@mock.patch('platform.system', return_value='Linux')
+def test_version_reads_installed_software_of_each_target(platform_mock, simulated_system):
+    exit_code, stdout, _ = _main('version', '--target', 'pxi-01,pxi-02')
+    assert stdout == '[pxi-01] ni-xnet 20.0.0\n[pxi-02] ni-xnet 20.0.0\n'
+
+
+@pytest.mark.parametrize('output_format', ['json', 'ndjson', 'csv'])
+def test_enumerate_merges_records_of_every_target(simulated_system, tmp_path, output_format):
+    targets_file = tmp_path / 'targets.txt'
+    targets_file.write_text('pxi-01\npxi-02\n')
+    exit_code, stdout, _ = _main('enumerate', '-f', output_format, '--targets-file', str(targets_file), '--target-jobs', '1')
+    assert exit_code == 0
+    if output_format == 'json':
+        targets = [record['target'] for record in json.loads(stdout)['devices']]
+    elif output_format == 'ndjson':
+        targets = [json.loads(line)['target'] for line in stdout.splitlines()]
+    else:
+        targets = [row['target'] for row in csv.DictReader(io.StringIO(stdout))]
+    assert targets == (['pxi-01', 'pxi-02'] if output_format != 'csv' else ['pxi-01', 'pxi-01', 'pxi-02', 'pxi-02'])
+
+
+def test_enumerate_merges_records_of_targets_given_before_the_command(simulated_system):
+    exit_code, stdout, _ = _main('--target', 'pxi-01,pxi-02', 'enumerate', '--format', 'json')
+    assert exit_code == 0
+    assert [record['target'] for record in json.loads(stdout)['devices']] == ['pxi-01', 'pxi-02']
+
+
+def test_enumerate_watch_is_not_supported_with_targets(simulated_system):
+    exit_code, _, stderr = _main('enumerate', '--watch', '--target', 'pxi-01')
+    assert exit_code == 1
+    assert 'not supported with remote targets' in stderr
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_fleet_workers_connect_to_the_target_of_the_parent(stdout_mock, simulated_system):
+    with utilities.using_target('pxi-01'):
+        results = fleet.run_operation('self_test_xnet_device', [fleet.FleetTarget('00010001', 'Chassis1')])
+    assert results[0].passed
+    with mock.patch('nixnetconfig.utilities.using_target', wraps=utilities.using_target) as using_target_mock:
+        fleet.run_worker('self_test_xnet_device', '00010001', mock.Mock(), 'pxi-01')
+    # The worker, and the thread that runs the self-test under its deadline, connect to the target
+    assert using_target_mock.mock_calls == [mock.call('pxi-01')] * 2
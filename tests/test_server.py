@@ -0,0 +1,334 @@
+import argparse
+import contextlib
+import copy
+import io
+import json
+import logging
+from nixnetconfig import __main__
+from nixnetconfig import cache
+from nixnetconfig import client
+from nixnetconfig import server
+from nixnetconfig import utilities
+import os
+import pytest
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from tests.test_utilities import _sysapi_data
+from tests.test_utilities import SessionMock
+from unittest import mock
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def socket_path(monkeypatch):
+    # Unix socket paths are limited to about 100 characters, so avoid the long pytest tmp_path
+    directory = tempfile.mkdtemp(prefix='nixnetconfig-')
+    path = os.path.join(directory, 'daemon.sock')
+    monkeypatch.setenv('NIXNETCONFIG_SOCKET', path)
+    yield path
+    shutil.rmtree(directory)
+
+
+@pytest.fixture
+def session_mock():
+    sysapi_data = copy.deepcopy(_sysapi_data)
+    sysapi_data['device1_port1_mock']['expert_user_alias'] = ['CAN1']
+    return SessionMock(sysapi_data)
+
+
+@pytest.fixture
+def daemon(socket_path, session_mock):
+    cache.configure(in_memory=True, ttl=3600)
+    # Commands must use the daemon's warm session
+    with mock.patch('nisyscfg.Session', side_effect=AssertionError('unexpected session')):
+        yield server.Daemon(session_mock, socket_path, rescan_interval=3600)
+    cache.configure()
+
+
+@contextlib.contextmanager
+def _serving(daemon):
+    # Start serving inside the test body, because pytest replaces sys.stdout between setup and call
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    _wait_for(lambda: daemon._server is not None)
+    try:
+        yield
+    finally:
+        daemon.shutdown()
+        thread.join()
+
+
+def _request(socket_path, *argv, **request):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(socket_path)
+    connection.sendall((json.dumps(dict(request, argv=list(argv))) + '\n').encode('utf-8'))
+    with connection.makefile('r', encoding='utf-8') as response_file:
+        response = json.loads(response_file.readline())
+    connection.close()
+    return response
+
+
+def test_daemon_serves_enumerate_from_warm_inventory(daemon, socket_path, session_mock):
+    with _serving(daemon):
+        daemon.rescan()
+        query_count = session_mock.find_hardware_count
+        response = _request(socket_path, 'enumerate')
+        assert response['exit_code'] == 0
+        assert 'Interface: CAN1' in response['stdout']
+        assert session_mock.find_hardware_count == query_count
+
+
+def test_daemon_rescans_after_mutating_command(daemon, socket_path, session_mock):
+    with _serving(daemon):
+        daemon.rescan()
+        query_count = session_mock.find_hardware_count
+        response = _request(socket_path, 'rename', 'can1', 'can2', '-e')
+        assert response['exit_code'] == 0
+        assert 'My System:' in response['stdout']
+        session_mock.device1_port1_mock.rename.assert_called_once_with('CAN2')
+        assert session_mock.find_hardware_count == query_count + 3
+
+
+def test_daemon_rescans_when_refresh_is_requested(daemon, socket_path, session_mock):
+    with _serving(daemon):
+        daemon.rescan()
+        query_count = session_mock.find_hardware_count
+        assert _request(socket_path, '--refresh', 'enumerate')['exit_code'] == 0
+        assert session_mock.find_hardware_count == query_count + 1
+
+
+def test_daemon_reports_command_errors(daemon, socket_path, session_mock):
+    with _serving(daemon):
+        response = _request(socket_path, 'rename', 'can9', 'can2')
+        assert response == {'exit_code': 1, 'stdout': '', 'stderr': 'ERROR: Could not find port "CAN9"\n'}
+        session_mock.device1_mock.self_test.side_effect = RuntimeError('driver failure')
+        response = _request(socket_path, 'test', 'A2345678')
+        assert response == {'exit_code': 1, 'stdout': '', 'stderr': 'ERROR: Operation failed\n'}
+
+
+@pytest.mark.parametrize('command, arguments', [('batch', ['commands.txt']), ('serve', []), ('enumerate', ['--watch'])])
+def test_daemon_rejects_local_commands(daemon, socket_path, command, arguments):
+    with _serving(daemon):
+        response = _request(socket_path, command, *arguments)
+        assert response['exit_code'] == 1
+        assert '"{}" command cannot be run by the daemon'.format(command) in response['stderr']
+
+
+def test_daemon_returns_help_and_usage_errors(daemon, socket_path):
+    with _serving(daemon):
+        response = _request(socket_path, 'version', '-h')
+        assert response['exit_code'] == 0
+        assert 'usage:' in response['stdout']
+        response = _request(socket_path, 'assign', 'A2345678')
+        assert response['exit_code'] == 2
+        assert 'usage:' in response['stderr']
+
+
+def test_daemon_rescans_periodically(daemon, session_mock):
+    daemon.rescan_interval = 0.01
+    thread = threading.Thread(target=daemon._rescan_periodically)
+    thread.start()
+    query_count = session_mock.find_hardware_count
+    _wait_for(lambda: session_mock.find_hardware_count >= query_count + 2)
+    daemon._stopped.set()
+    thread.join()
+
+
+def test_daemon_rescan_ignores_driver_errors(daemon, session_mock):
+    with mock.patch.object(session_mock, 'find_hardware', side_effect=RuntimeError('driver failure')):
+        daemon.rescan()
+    assert cache.load() is None
+
+
+def test_daemon_replaces_stale_socket_file(socket_path, session_mock):
+    open(socket_path, 'w').close()
+    daemon = server.Daemon(session_mock, socket_path)
+    with _serving(daemon):
+        assert _request(socket_path, 'version', '-h')['exit_code'] == 0
+    assert not os.path.exists(socket_path)
+
+
+def test_daemon_socket_is_private_to_its_user(session_mock, socket_path):
+    path = os.path.join(os.path.dirname(socket_path), 'run', 'daemon.sock')
+    daemon = server.Daemon(session_mock, path)
+    with _serving(daemon):
+        assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        assert _request(path, 'version', '-h')['exit_code'] == 0
+
+
+def test_default_socket_path_is_in_home_directory(monkeypatch):
+    monkeypatch.delenv('NIXNETCONFIG_SOCKET', raising=False)
+    assert client.get_socket_path() == os.path.join(os.path.expanduser('~'), '.nixnetconfig', 'daemon.sock')
+
+
+@pytest.fixture
+def daemon_logger():
+    logger = logging.getLogger('nixnetconfig')
+    level = logger.level
+    __main__.configure_logger(argparse.Namespace(verbose=None))
+    yield logger
+    for handler in __main__._log_handlers:
+        logger.removeHandler(handler)
+    logger.setLevel(level)
+
+
+def test_daemon_logs_at_level_of_request(daemon, socket_path, daemon_logger):
+    with _serving(daemon):
+        # Without a deadline, the self-test runs in the daemon's session
+        response = _request(socket_path, 'test', 'A2345678', '-v', '--timeout', '0')
+        assert response['exit_code'] == 0
+        assert 'INFO: Starting self test\n' in response['stdout']
+        response = _request(socket_path, 'test', 'A2345678', '--timeout', '0')
+        assert response['exit_code'] == 0
+        assert 'INFO' not in response['stdout']
+    assert daemon_logger.getEffectiveLevel() == logging.WARNING
+    assert daemon_logger.filters == []
+
+
+def test_session_pool_opens_session_only_when_all_are_busy():
+    first_session, second_session = mock.Mock(), mock.Mock()
+    closed = []
+
+    @contextlib.contextmanager
+    def open_session():
+        yield second_session
+        closed.append(second_session)
+
+    pool = server.SessionPool(first_session)
+    with mock.patch.object(utilities, 'open_session', open_session):
+        with pool.borrow() as session:
+            assert session is first_session
+            with pool.borrow() as other_session:
+                assert other_session is second_session
+        with pool.borrow() as session, pool.borrow() as other_session:
+            assert {session, other_session} == {first_session, second_session}
+    pool.close()
+    assert closed == [second_session]
+
+
+def test_read_write_lock_shares_reads_and_serializes_writes():
+    lock = server.ReadWriteLock()
+    events = []
+    lock.acquire_read()
+    lock.acquire_read()
+
+    def write():
+        lock.acquire_write()
+        events.append('write')
+        lock.release_write()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    time.sleep(0.05)
+    events.append('reads')
+    lock.release_read()
+    lock.release_read()
+    writer.join()
+    lock.acquire_write()
+    reader = threading.Thread(target=lambda: (lock.acquire_read(), events.append('read'), lock.release_read()))
+    reader.start()
+    time.sleep(0.05)
+    events.append('writes')
+    lock.release_write()
+    reader.join()
+    assert events == ['reads', 'write', 'writes', 'read']
+
+
+@mock.patch('nixnetconfig.client.sys')
+def test_client_forward_prints_daemon_output(sys_mock, daemon):
+    with _serving(daemon):
+        sys_mock.stdout, sys_mock.stderr = io.StringIO(), io.StringIO()
+        assert client.forward(['rename', 'can9', 'can2']) == 1
+        assert sys_mock.stderr.getvalue() == 'ERROR: Could not find port "CAN9"\n'
+
+
+def test_client_forward_resolves_files_against_client_directory(daemon, socket_path, tmp_path):
+    # The client runs in its own process, so that its directory differs from the daemon's
+    (tmp_path / 'plan.json').write_text(json.dumps({'A2345678': {'1': 'ENGINE'}}))
+    environment = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__main__.__file__))))
+    with _serving(daemon):
+        result = subprocess.run(
+            [sys.executable, '-m', 'nixnetconfig', 'apply', '--dry-run', 'plan.json'], cwd=str(tmp_path), env=environment,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert (result.returncode, result.stderr) == (0, '')
+    assert result.stdout == 'A2345678 port 1: CAN1 -> ENGINE\n'
+
+
+def test_daemon_keeps_absolute_file_arguments(daemon, socket_path, tmp_path):
+    plan_file = tmp_path / 'plan.json'
+    plan_file.write_text(json.dumps({'A2345678': {'1': 'CAN1'}}))
+    with _serving(daemon):
+        response = _request(socket_path, 'apply', str(plan_file), cwd=tempfile.gettempdir())
+    assert response == {'exit_code': 0, 'stdout': 'No changes\n', 'stderr': ''}
+
+
+def test_client_forward_returns_none_without_daemon(socket_path, monkeypatch):
+    assert client.forward(['enumerate']) is None
+    open(socket_path, 'w').close()
+    assert client.forward(['enumerate']) is None
+    monkeypatch.setattr(client, 'is_supported', lambda: False)
+    assert client.forward(['enumerate']) is None
+
+
+@mock.patch('nixnetconfig.client.forward', return_value=0)
+@mock.patch('nixnetconfig.utilities.enumerate_xnet_devices', spec=True)
+def test_main_forwards_commands_to_running_daemon(enumerate_xnet_devices_mock, forward_mock):
+    __main__.main(['enumerate'])
+    forward_mock.assert_called_once_with(['enumerate'])
+    enumerate_xnet_devices_mock.assert_not_called()
+    forward_mock.return_value = 3
+    with pytest.raises(SystemExit) as exit:
+        __main__.main(['enumerate'])
+    assert exit.value.code == 3
+
+
+@mock.patch('nixnetconfig.client.forward', return_value=0)
+@mock.patch('nixnetconfig.batch.run_batch', spec=True)
+def test_main_does_not_forward_local_commands(run_batch_mock, forward_mock):
+    __main__.main(['batch', 'commands.txt'])
+    forward_mock.assert_not_called()
+    run_batch_mock.assert_called_once_with(batch_file='commands.txt', keep_going=False)
+
+
+@mock.patch('nixnetconfig.client.forward', return_value=0)
+@mock.patch('nixnetconfig.server.serve', spec=True)
+def test_main_does_not_forward_local_commands_after_option_values(serve_mock, forward_mock):
+    with mock.patch('nixnetconfig.utilities.set_backend'):
+        __main__.main(['--backend', 'sim:1x1x1', 'serve'])
+    forward_mock.assert_not_called()
+    serve_mock.assert_called_once_with(socket_path=None, rescan_interval=60.0)
+
+
+@pytest.mark.parametrize('side_effect', [None, KeyboardInterrupt])
+@mock.patch('nixnetconfig.server.Daemon', autospec=True)
+def test_serve_runs_daemon_with_warm_session(daemon_mock, socket_path, session_mock, side_effect):
+    daemon_mock.return_value.serve_forever.side_effect = side_effect
+    with mock.patch('nisyscfg.Session', new_callable=lambda: session_mock):
+        server.serve(rescan_interval=5)
+    daemon_mock.assert_called_once_with(session_mock, socket_path, 5)
+    daemon_mock.return_value.rescan.assert_called_once_with()
+    cache.configure()
+
+
+def test_serve_requires_unix_socket_support(monkeypatch):
+    monkeypatch.setattr(client, 'is_supported', lambda: False)
+    with pytest.raises(server.utilities.XnetConfigError):
+        server.serve()
+
+
+@mock.patch('nixnetconfig.server.serve', spec=True)
+def test_serve_runs_when_serve_is_specified(serve_mock):
+    __main__.main(['serve', '--socket', 'daemon.sock', '--rescan-interval', '2.5'])
+    serve_mock.assert_called_once_with(socket_path='daemon.sock', rescan_interval=2.5)
@@ -0,0 +1,192 @@
+import io
+import json
+from nixnetconfig import __main__
+from nixnetconfig import fleet
+from nixnetconfig import simulation
+from nixnetconfig.system import SystemTree
+from nixnetconfig import utilities
+import pytest
+import time
+from unittest import mock
+
+
+def _find(session, mode=simulation.MATCH_VALUES_ALL, expert_names='xnet', **properties):
+    filter = session.create_filter()
+    for name, value in properties.items():
+        if name.startswith('xnet_'):
+            setattr(filter.xnet, name[len('xnet_'):], value)
+        else:
+            setattr(filter, name, value)
+    return list(session.find_hardware(filter=filter, mode=mode, expert_names=expert_names))
+
+
+def test_from_spec_generates_system_of_requested_size():
+    system = simulation.SimulatedSystem.from_spec('3x4x2,standalone=2')
+    session = system.create_session()
+    assert len(_find(session, expert_names='', is_chassis=True)) == 3
+    assert len(_find(session, is_device=True)) == 3 * 4 + 2
+    assert len(_find(session, is_device=False)) == (3 * 4 + 2) * 2
+    assert system.call_counts['find_hardware'] == 3
+
+
+def test_from_spec_sets_per_call_latency():
+    system = simulation.SimulatedSystem.from_spec('1x1x1, latency=0.5, upgrade_firmware=30')
+    assert system.latency == {
+        'find_hardware': 0.5, 'rename': 0.5, 'save_changes': 0.5, 'self_test': 0.5, 'upgrade_firmware': 30.0}
+    session = system.create_session()
+    with mock.patch('time.sleep') as sleep_mock:
+        device = next(session.find_hardware(filter=None, expert_names=['xnet']))
+        device.upgrade_firmware(version='0')
+    assert sleep_mock.mock_calls == [mock.call(0.5), mock.call(30.0)]
+
+
+@pytest.mark.parametrize('spec', ['', '2x3', '1x-1x1', 'axbxc', '1x1x1,latency', '1x1x1,blink=1', '1x1x1,latency=fast'])
+def test_from_spec_raises_error_for_invalid_spec(spec):
+    with pytest.raises(simulation.SimulationSpecError):
+        simulation.SimulatedSystem.from_spec(spec)
+
+
+def test_find_hardware_filters_like_the_driver():
+    session = simulation.SimulatedSystem(chassis=2, devices=1, ports=2).create_session()
+    assert [resource.xnet.port_number for resource in _find(session, connects_to_link_name='PXI1Slot2')] == [1, 2]
+    assert [resource.expert_user_alias[0] for resource in _find(session, user_alias='can3')] == ['CAN3']
+    assert [resource.expert_user_alias[0] for resource in _find(session, is_device=False, xnet_port_number=2)] == ['CAN2', 'CAN4']
+    assert len(_find(session, mode=simulation.MATCH_VALUES_ANY, serial_number='00010001', user_alias='CAN4')) == 2
+    assert len(_find(session, mode=simulation.MATCH_VALUES_NONE, is_device=True)) == 4
+    assert len(_find(session, mode=simulation.ALL_PROPERTIES_EXIST, xnet_port_number=0)) == 4
+    assert _find(session, expert_names='pxi') == []
+    assert len(_find(session, expert_names=' XNET, pxi')) == 6
+
+
+def test_system_tree_scales_without_extra_queries():
+    system = simulation.SimulatedSystem.from_spec('50x17x4')
+    tree = SystemTree('xnet', system.create_session())
+    assert len(tree.chassis) == 50
+    assert sum(len(device.interfaces) for device in tree.iter_devices()) == 50 * 17 * 4
+    assert tree.query_count == system.call_counts['find_hardware'] == 2
+
+
+def test_from_spec_sets_property_read_latency():
+    system = simulation.SimulatedSystem.from_spec('1x1x1,get=0.25')
+    assert system.property_latency == 0.25
+    session = system.create_session()
+    with mock.patch('time.sleep') as sleep_mock:
+        device = _find(session, serial_number='00010001')[0]
+        assert device.serial_number == '00010001'
+    assert sleep_mock.mock_calls == [mock.call(0.25)]
+
+
+@pytest.mark.parametrize('spec', ['3x2x2,standalone=2', '2x0x0,standalone=1', '0x0x0'])
+def test_system_tree_from_subtrees_matches_sequential_tree(spec):
+    system = simulation.SimulatedSystem.from_spec(spec)
+    tree = SystemTree('xnet', system.create_session())
+    parallel_tree = SystemTree.from_subtrees('xnet', system.create_session(), system.create_session, 2)
+    assert parallel_tree.to_dict() == tree.to_dict()
+    assert [device.indent for device in parallel_tree.iter_devices()] == [device.indent for device in tree.iter_devices()]
+    assert parallel_tree.query_count == system.call_counts['find_hardware'] - tree.query_count
+
+
+def test_system_tree_from_subtrees_spreads_property_reads_over_workers():
+    system = simulation.SimulatedSystem.from_spec('4x4x2,get=0.002')
+    start_time = time.perf_counter()
+    tree = SystemTree('xnet', system.create_session())
+    sequential_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    parallel_tree = SystemTree.from_subtrees('xnet', system.create_session(), system.create_session, 4)
+    assert time.perf_counter() - start_time < sequential_time / 2
+    assert parallel_tree.to_dict() == tree.to_dict()
+
+
+def test_enumerate_xnet_devices_with_jobs_prints_same_report(simulated_backend):
+    simulated_backend('sim:3x2x1,standalone=1')
+    outputs = []
+    for jobs in (1, 3):
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout_mock:
+            utilities.enumerate_xnet_devices(jobs=jobs)
+        outputs.append(stdout_mock.getvalue())
+    assert outputs[1] == outputs[0]
+    assert outputs[0].count('00010001') == 1
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_enumerate_xnet_devices_with_jobs_writes_records_in_report_order(stdout_mock, simulated_backend):
+    simulated_backend('sim:3x2x1,standalone=1')
+    utilities.enumerate_xnet_devices('ndjson', jobs=3)
+    records = [json.loads(line) for line in stdout_mock.getvalue().splitlines()]
+    assert records == list(utilities.get_system_tree().iter_records())
+    assert [record['serial_number'] for record in records][:2] == ['00000001', '00010001']
+
+
+def test_enumerate_xnet_devices_with_jobs_opens_worker_sessions_on_target(simulated_backend):
+    system = simulated_backend('sim:2x1x1')
+    with mock.patch.object(system, 'create_session', wraps=system.create_session) as create_session_mock:
+        with utilities.using_target('rack1'), mock.patch('sys.stdout', new_callable=io.StringIO):
+            utilities.enumerate_xnet_devices(jobs=2)
+    # One session for the chassis query, and one for each of the three subtrees
+    assert create_session_mock.mock_calls == [mock.call(target='rack1')] * 4
+
+
+def test_utilities_run_against_simulated_backend(simulated_backend):
+    system = simulated_backend('sim:1x2x2')
+    utilities.rename_xnet_port_name('CAN1', 'CAN10')
+    utilities.assign_xnet_port_name('00010002', 2, 'CAN20')
+    utilities.blink_xnet_port('CAN10', 'on')
+    utilities.upgrade_xnet_firmware('00010001')
+    utilities.self_test_xnet_device('00010002')
+    aliases = [interface.name for device in utilities.get_system_tree().iter_devices() for interface in device.interfaces]
+    assert aliases == ['CAN10', 'CAN2', 'CAN3', 'CAN20']
+    assert system.call_counts == {'find_hardware': 8, 'rename': 2, 'save_changes': 1, 'upgrade_firmware': 1, 'self_test': 1}
+
+
+@mock.patch('platform.system', return_value='Windows')
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_get_xnet_expert_version_reads_simulated_software(stdout_mock, platform_mock, simulated_backend):
+    simulated_backend('sim:0x0x0')
+    utilities.get_xnet_expert_version()
+    assert stdout_mock.getvalue() == 'ni-xnet 20.0.0\n'
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_fleet_self_test_runs_against_simulated_backend(stdout_mock, simulated_backend):
+    simulated_backend('sim:2x2x1')
+    fleet.self_test_xnet_devices([], all_devices=True)
+    assert stdout_mock.getvalue().count('PASS') == 4
+
+
+@pytest.mark.parametrize('spec, message', [
+    ('sim:bogus', 'Invalid simulation spec "bogus"'),
+    ('remote', 'Unknown backend "remote"'),
+])
+def test_set_backend_raises_error_for_invalid_backend(spec, message):
+    with pytest.raises(utilities.XnetConfigError) as error:
+        utilities.set_backend(spec)
+    assert error.value.message == message
+
+
+@pytest.mark.parametrize('arguments, environment, expected_spec', [
+    (['--backend', 'sim:1x1x1'], None, 'sim:1x1x1'),
+    (['enumerate', '--backend', 'sim:2x1x1'], 'sim:3x1x1', 'sim:2x1x1'),
+    (['enumerate'], 'sim:3x1x1', 'sim:3x1x1'),
+    (['enumerate'], None, None),
+])
+@mock.patch('nixnetconfig.utilities.enumerate_xnet_devices', spec=True)
+@mock.patch('nixnetconfig.utilities.set_backend', spec=True)
+def test_backend_option_selects_backend(set_backend_mock, enumerate_xnet_devices_mock, monkeypatch, arguments, environment, expected_spec):
+    if environment:
+        monkeypatch.setenv('NIXNETCONFIG_BACKEND', environment)
+    else:
+        monkeypatch.delenv('NIXNETCONFIG_BACKEND', raising=False)
+    __main__.main(arguments)
+    set_backend_mock.assert_called_once_with(expected_spec)
+    enumerate_xnet_devices_mock.assert_called_once_with()
+
+
+def test_rename_raises_name_collision_like_the_driver(simulated_backend):
+    session = simulated_backend('sim:1x1x2').create_session()
+    first, second = _find(session, is_device=False)
+    with pytest.raises(simulation.SimulatedDriverError) as error:
+        first.rename('CAN2')
+    assert error.value.code == -2147220613
+    assert first.expert_user_alias[0] == 'CAN1'
+    assert first.rename('CAN2', overwrite_conflict=True) is second
+    assert (first.expert_user_alias[0], second.expert_user_alias[0]) == ('CAN2', '')
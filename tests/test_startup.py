@@ -0,0 +1,64 @@
+from nixnetconfig import parser
+import pytest
+import subprocess
+import sys
+
+
+# Cumulative import time of nixnetconfig.__main__, in microseconds, reported by "python -X importtime".
+# It measures about 45 ms, so the budget leaves room for slow machines but not for a heavy import.
+_STARTUP_BUDGET_US = 150000
+# Modules that parsing the command line must not import; commands import them when they run
+_HEAVY_MODULES = (
+    'nisyscfg', 'multiprocessing', 'concurrent.futures', 'socket', 'nixnetconfig.api', 'nixnetconfig.batch', 'nixnetconfig.fleet',
+    'nixnetconfig.locking', 'nixnetconfig.system', 'nixnetconfig.utilities')
+
+
+def _import_times(*argv):
+    script = 'from nixnetconfig import __main__; __main__.parse_args({!r})'.format(list(argv))
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    import_times = {}
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, module = line.split('|')
+            if cumulative.strip().isdigit():
+                import_times[module.strip()] = int(cumulative)
+    return import_times
+
+
+@pytest.mark.parametrize('argv', [['version'], ['enumerate'], ['rename', 'can1', 'can2'], []])
+def test_startup_does_not_import_driver_or_worker_modules(argv):
+    import_times = _import_times(*argv)
+    assert 'nixnetconfig.__main__' in import_times
+    assert [module for module in _HEAVY_MODULES if module in import_times] == []
+
+
+def test_startup_import_time_is_within_budget():
+    assert _import_times('version')['nixnetconfig.__main__'] < _STARTUP_BUDGET_US
+
+
+def _subcommand_names(command_parser):
+    return list(command_parser._subparsers._group_actions[0].choices)
+
+
+def test_get_parser_builds_only_the_invoked_subparser():
+    assert _subcommand_names(parser.get_parser(['-v', 'version'])) == ['version']
+    assert _subcommand_names(parser.get_parser(['assign', 'a1', '1', 'can1'])) == ['assign']
+
+
+@pytest.mark.parametrize('argv, command_name', [
+    (['--backend', 'sim:1x1x1', 'serve'], 'serve'),
+    (['--target', 'pxi-01,pxi-02', 'enumerate', '--format', 'json'], 'enumerate'),
+    (['--back', 'sim:1x1x1', '-v', 'rename', 'CAN1', 'CAN2'], 'rename'),
+    (['--backend=sim:1x1x1', '--trace', 'trace.json', '--lock-timeout', '5', 'version'], 'version'),
+    (['--cache', '--target-jobs', '2'], None),
+])
+def test_get_command_name_skips_option_values(argv, command_name):
+    assert parser.get_command_name(argv) == command_name
+    assert _subcommand_names(parser.get_parser(argv)) == ([command_name] if command_name else list(parser._COMMAND_PARSERS))
+
+
+@pytest.mark.parametrize('argv', [None, [], ['-h'], ['bogus']])
+def test_get_parser_builds_all_subparsers_when_the_command_is_unknown(argv):
+    assert _subcommand_names(parser.get_parser(argv)) == list(parser._COMMAND_PARSERS)
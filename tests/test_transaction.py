@@ -0,0 +1,107 @@
+from nixnetconfig import __main__
+from nixnetconfig import transaction
+from nixnetconfig import utilities
+import pytest
+from unittest import mock
+
+
+SIMULATED_BACKEND = 'sim:2x2x2'
+
+
+def _interfaces(system):
+    return dict((resource.expert_user_alias[0], resource) for resource in system.resources if resource.expert_names and not resource.is_device)
+
+
+def _resource(link_name='PXI1Slot2'):
+    return mock.Mock(is_device=False, connects_to_link_name=link_name)
+
+
+def test_transaction_saves_each_resource_once():
+    first, second = _resource(), _resource('PXI1Slot3')
+    with transaction.Transaction() as staged:
+        staged.set_property('CAN1', first, 'xnet.blink', 1)
+        staged.set_property('CAN1', first, 'xnet.blink', 0)
+        staged.set_property('CAN1', first, 'name', 'CAN9')
+        staged.set_property('CAN2', second, 'xnet.blink', 1)
+        assert len(staged) == 2
+        first.save_changes.assert_not_called()
+    assert (first.xnet.blink, first.name, second.xnet.blink) == (0, 'CAN9', 1)
+    first.save_changes.assert_called_once_with()
+    second.save_changes.assert_called_once_with()
+    assert staged.commit() == 0
+
+
+def test_transaction_discards_changes_when_block_raises():
+    resource = mock.Mock()
+    with pytest.raises(RuntimeError):
+        with transaction.Transaction() as staged:
+            staged.set_property('CAN1', resource, 'xnet.blink', 1)
+            raise RuntimeError('interrupted')
+    assert len(staged) == 0
+    resource.save_changes.assert_not_called()
+
+
+def test_transaction_saves_remaining_resources_and_reports_failures():
+    resources = [_resource() for _ in range(4)]
+    resources[1].save_changes.side_effect = RuntimeError('driver failure')
+    resources[3].save_changes.side_effect = utilities.XnetConfigError('resource busy')
+    staged = transaction.Transaction()
+    for index, resource in enumerate(resources):
+        staged.set_property('CAN{}'.format(index + 1), resource, 'xnet.blink', 1)
+    with pytest.raises(transaction.TransactionError) as error:
+        staged.commit()
+    assert error.value.message == 'Could not save changes to 2 of 4 resources: CAN2, CAN4'
+    assert error.value.failures == [('CAN2', 'driver failure'), ('CAN4', 'resource busy')]
+    resources[2].save_changes.assert_called_once_with()
+
+
+@pytest.mark.parametrize('mode, expected_value', [('on', 1), ('off', 0)])
+def test_blink_xnet_ports_saves_each_named_interface_once(simulated_system, mode, expected_value):
+    transaction.blink_xnet_ports(mode, ['CAN2', 'can7', 'CAN2'])
+    interfaces = _interfaces(simulated_system)
+    assert [interfaces[name].xnet.blink for name in ('CAN1', 'CAN2', 'CAN7')] == [0, expected_value, expected_value]
+    assert simulated_system.call_counts == {'find_hardware': 1, 'save_changes': 2}
+
+
+def test_blink_xnet_ports_selects_interfaces_of_chassis(simulated_system):
+    transaction.blink_xnet_ports('on', ['CAN1'], chassis='chassis2')
+    blinking = [name for name, resource in _interfaces(simulated_system).items() if resource.xnet.blink]
+    assert blinking == ['CAN1', 'CAN5', 'CAN6', 'CAN7', 'CAN8']
+    assert simulated_system.call_counts == {'find_hardware': 2, 'save_changes': 5}
+
+
+@pytest.mark.parametrize('port_names, chassis, message', [
+    ([], None, 'Specify at least one interface name or a chassis'),
+    (['CAN1', 'CAN99'], None, 'Could not find port "CAN99"'),
+    ([], 'Chassis9', 'Could not find a chassis "Chassis9" with NI-XNET devices'),
+])
+def test_blink_xnet_ports_raises_error_before_saving(simulated_system, port_names, chassis, message):
+    with pytest.raises(utilities.XnetConfigError) as error:
+        transaction.blink_xnet_ports('on', port_names, chassis)
+    assert error.value.message == message
+    assert simulated_system.call_counts['save_changes'] == 0
+
+
+def test_blink_xnet_ports_reports_interfaces_that_failed(simulated_system):
+    _interfaces(simulated_system)['CAN3'].save_changes = mock.Mock(side_effect=RuntimeError('driver failure'))
+    with pytest.raises(transaction.TransactionError) as error:
+        transaction.blink_xnet_ports('on', [], chassis='Chassis1')
+    assert error.value.message == 'Could not save changes to 1 of 4 resources: CAN3'
+    assert simulated_system.call_counts['save_changes'] == 3
+
+
+@mock.patch('nixnetconfig.utilities.blink_xnet_port', spec=True)
+def test_blink_xnet_ports_blinks_single_port_directly(blink_xnet_port_mock):
+    transaction.blink_xnet_ports('off', ['CAN1'])
+    blink_xnet_port_mock.assert_called_once_with('CAN1', 'off')
+
+
+@pytest.mark.parametrize('arguments, port_names, chassis', [
+    (['on', 'can1', 'can2'], ['CAN1', 'CAN2'], None),
+    (['on', '--chassis', 'Chassis1'], [], 'Chassis1'),
+    (['off', 'can3', '-c', 'Chassis2'], ['CAN3'], 'Chassis2'),
+])
+@mock.patch('nixnetconfig.transaction.blink_xnet_ports', spec=True)
+def test_blink_xnet_ports_runs_when_several_ports_are_specified(blink_xnet_ports_mock, arguments, port_names, chassis):
+    __main__.main(['blink'] + arguments)
+    blink_xnet_ports_mock.assert_called_once_with(mode=arguments[0], port_names=port_names, chassis=chassis)
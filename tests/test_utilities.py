@@ -1,8 +1,14 @@
 import copy
+import csv
 import io
+import json
 from nisyscfg.component_info import ComponentInfo
+from nisyscfg.errors import LibraryError
+from nixnetconfig import cache
 from nixnetconfig import utilities
+from nixnetconfig.system import SystemTree
 import pytest
+import threading
 from unittest import mock
 
 
@@ -21,6 +27,7 @@ _sysapi_data = {
         'connects_to_link_name': '',
         'expert_name': ['xnet'],
         'expert_user_alias': ['Unknown'],
+        'available_firmware_version': ['19072316'],
         'firmware_revision': '19072316',
         'is_device': True,
         'provides_link_name': 'Device1 Link',
@@ -82,6 +89,7 @@ class ResourceMock(object):
 class SessionMock(object):
     def __init__(self, sysapi_data):
         self._sysapi_cache = copy.deepcopy(sysapi_data)
+        self.find_hardware_count = 0
         for name, resource_cache in self._sysapi_cache.items():
             setattr(self, name, ResourceMock(resource_cache))
 
@@ -106,10 +114,13 @@ class SessionMock(object):
                 self[name] = value
         return MockFilter()
 
-    def find_hardware(self, filter={}, **kwargs):
+    def find_hardware(self, filter={}, expert_names='', **kwargs):
+        self.find_hardware_count += 1
+        if isinstance(expert_names, str):
+            expert_names = [expert_names] if expert_names else []
         return (getattr(self, name)
                 for name, entry in self._sysapi_cache.items()
-                if all(get_nisyscfg_resource_filter_value(entry, k) == v for k, v in filter.items()))
+                if (not expert_names or set(expert_names) & set(entry['expert_name'])) and all(get_nisyscfg_resource_filter_value(entry, k) == v for k, v in filter.items()))
 
 
 @mock.patch('sys.stdout', new_callable=io.StringIO)
@@ -149,6 +160,160 @@ def test_enumerate_xnet_devices_prints_device_info_when_xnet_devices_are_present
     assert _sysapi_data['device1_port1_mock']['expert_user_alias'][0] in stdout_mock.getvalue()
 
 
+def test_system_tree_queries_hardware_once_when_no_device_is_in_a_chassis():
+    session_mock = SessionMock(_sysapi_data)
+    tree = SystemTree(utilities._XNET_EXPERT_NAME, session_mock)
+    assert [device.serial_num for device in tree.devices] == ['A2345678']
+    assert [interface.name for interface in tree.devices[0].interfaces] == ['myPort1']
+    assert tree.chassis == []
+    assert tree.query_count == session_mock.find_hardware_count == 1
+
+
+def test_system_tree_queries_hardware_twice_for_devices_in_several_chassis():
+    sysapi_data = copy.deepcopy(_sysapi_data)
+    sysapi_data['chassis2_mock'] = dict(sysapi_data['chassis1_mock'], expert_user_alias=['otherChassis'], provides_link_name='chassis2')
+    sysapi_data['device2_mock'] = dict(sysapi_data['device1_mock'], serial_number='B2345678', provides_link_name='Device2 Link')
+    sysapi_data['device2_port1_mock'] = dict(sysapi_data['device1_port1_mock'], connects_to_link_name='Device2 Link', expert_user_alias=['myPort2'])
+    sysapi_data['device3_mock'] = dict(sysapi_data['device1_mock'], serial_number='C2345678', provides_link_name='Device3 Link')
+    session_mock = SessionMock(sysapi_data)
+    session_mock.insert_device_to_chassis('chassis2_mock', 'device1_mock')
+    session_mock.insert_device_to_chassis('chassis1_mock', 'device2_mock')
+    tree = SystemTree(utilities._XNET_EXPERT_NAME, session_mock)
+    assert [device.serial_num for device in tree.devices] == ['C2345678']
+    assert tree.devices[0].interfaces == []
+    assert [chassis.name for chassis in tree.chassis] == ['myChassis', 'otherChassis']
+    assert [[device.serial_num for device in chassis.devices] for chassis in tree.chassis] == [['B2345678'], ['A2345678']]
+    assert [interface.name for interface in tree.chassis[0].devices[0].interfaces] == ['myPort2']
+    assert tree.query_count == session_mock.find_hardware_count == 2
+
+
+def _make_mixed_sysapi_data():
+    sysapi_data = copy.deepcopy(_sysapi_data)
+    sysapi_data['device1_mock']['connects_to_link_name'] = 'chassis1'
+    sysapi_data['device2_mock'] = dict(sysapi_data['device1_mock'], serial_number='B2345678', provides_link_name='Device2 Link', connects_to_link_name='')
+    sysapi_data['device3_mock'] = dict(sysapi_data['device1_mock'], serial_number='C2345678', connects_to_link_name='not a chassis')
+    return sysapi_data
+
+
+_expected_records = [
+    {'chassis': 'myChassis', 'chassis_serial_number': 'A8765432', 'product_name': 'NI PXI-8513', 'serial_number': 'A2345678',
+     'firmware_revision': '19072316', 'link_name': 'Device1 Link', 'connects_to_link_name': 'chassis1',
+     'interfaces': [{'name': 'myPort1', 'port_number': 1}]},
+    {'chassis': None, 'chassis_serial_number': None, 'product_name': 'NI PXI-8513', 'serial_number': 'B2345678',
+     'firmware_revision': '19072316', 'link_name': 'Device2 Link', 'connects_to_link_name': '', 'interfaces': []},
+]
+
+
+@pytest.mark.parametrize('output_format', ['json', 'ndjson'])
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_enumerate_xnet_devices_prints_json_records(stdout_mock, output_format):
+    with mock.patch('nisyscfg.Session', new_callable=SessionMock(_make_mixed_sysapi_data())) as session_mock:
+        utilities.enumerate_xnet_devices(output_format)
+    if output_format == 'json':
+        records = json.loads(stdout_mock.getvalue())['devices']
+    else:
+        records = [json.loads(line) for line in stdout_mock.getvalue().splitlines()]
+    assert records == _expected_records
+    assert session_mock.find_hardware_count == 3
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('nisyscfg.Session', new_callable=SessionMock(_make_mixed_sysapi_data()))
+def test_enumerate_xnet_devices_prints_one_csv_row_per_interface(session_mock, stdout_mock):
+    utilities.enumerate_xnet_devices('csv')
+    rows = list(csv.DictReader(io.StringIO(stdout_mock.getvalue())))
+    assert [(row['serial_number'], row['chassis'], row['interface'], row['port_number']) for row in rows] == [
+        ('A2345678', 'myChassis', 'myPort1', '1'),
+        ('B2345678', '', '', ''),
+    ]
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+@mock.patch('nisyscfg.Session', new_callable=SessionMock(_sysapi_data))
+def test_enumerate_xnet_devices_streams_records_without_querying_chassis(session_mock, stdout_mock):
+    records = utilities.iter_device_records(utilities._XNET_EXPERT_NAME, session_mock)
+    assert next(records)['serial_number'] == 'A2345678'
+    assert session_mock.find_hardware_count == 2
+
+
+@pytest.fixture
+def inventory_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv('NIXNETCONFIG_CACHE', raising=False)
+    cache.configure(enabled=True, path=str(tmp_path / 'inventory.json'))
+    yield
+    cache.configure()
+
+
+def test_system_tree_round_trips_through_dict():
+    session_mock = SessionMock(_sysapi_data)
+    session_mock.insert_device_to_chassis()
+    tree = SystemTree(utilities._XNET_EXPERT_NAME, session_mock)
+    restored = SystemTree.from_dict(tree.to_dict())
+    assert restored.to_dict() == tree.to_dict()
+    assert restored.find_device('A2345678').interfaces[0].port_number == 1
+    assert restored.find_interface('MYPORT1').name == 'myPort1'
+    assert restored.find_device('B2345678') is None
+    assert restored.find_interface('myPort9') is None
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_enumerate_xnet_devices_reads_inventory_cache_without_session(stdout_mock, inventory_cache):
+    with mock.patch('nisyscfg.Session', new_callable=SessionMock(_sysapi_data)):
+        utilities.enumerate_xnet_devices()
+    with mock.patch('nisyscfg.Session') as session_mock:
+        utilities.enumerate_xnet_devices()
+        session_mock.assert_not_called()
+    first_report, second_report = stdout_mock.getvalue().split('My System:')[1:]
+    assert first_report == second_report
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_enumerate_xnet_devices_prints_records_from_inventory_cache(stdout_mock, inventory_cache):
+    with mock.patch('nisyscfg.Session', new_callable=SessionMock(_make_mixed_sysapi_data())):
+        utilities.get_system_tree()
+    with mock.patch('nisyscfg.Session') as session_mock:
+        utilities.enumerate_xnet_devices('ndjson')
+        session_mock.assert_not_called()
+    records = [json.loads(line) for line in stdout_mock.getvalue().splitlines()]
+    assert records == _expected_records[::-1]
+
+
+@pytest.mark.parametrize(
+    'function, arguments',
+    [(utilities.rename_xnet_port_name, ('myPort1', 'myPort2')),
+     (utilities.blink_xnet_port, ('myPort1', 'on')),
+     (utilities.assign_xnet_port_name, ('A2345678', 1, 'myPort2')),
+     (utilities.upgrade_xnet_firmware, ('A2345678',)),
+     (utilities.self_test_xnet_device, ('A2345678',))])
+def test_commands_find_hardware_missing_from_stale_inventory_cache(inventory_cache, function, arguments):
+    # The cache was built before the device was installed, but the driver decides what exists
+    with mock.patch('nisyscfg.Session', new_callable=SessionMock({})):
+        utilities.get_system_tree()
+    with mock.patch('nisyscfg.Session', new_callable=SessionMock(_sysapi_data)) as session_mock:
+        function(*arguments)
+    assert session_mock.find_hardware_count
+
+
+def test_inventory_cache_is_not_shared_between_backends(inventory_cache, simulated_backend):
+    simulated_backend('sim:2x1x1')
+    assert len(utilities.get_system_tree().chassis) == 2
+    simulated_backend('sim:1x1x1,standalone=1')
+    tree = utilities.get_system_tree()
+    assert (len(tree.chassis), len(tree.devices)) == (1, 1)
+    utilities.set_backend()
+    with mock.patch('nisyscfg.Session', new_callable=SessionMock(_sysapi_data)) as session_mock:
+        utilities.get_system_tree()
+    assert session_mock.find_hardware_count
+
+
+@mock.patch('nisyscfg.Session', new_callable=SessionMock(_sysapi_data))
+def test_rename_xnet_port_name_invalidates_inventory_cache(session_mock, inventory_cache):
+    utilities.get_system_tree()
+    utilities.rename_xnet_port_name('myPort1', 'myPort2')
+    session_mock.device1_port1_mock.rename.assert_called_once_with('myPort2')
+    assert cache.load() is None
+
+
 @pytest.mark.parametrize('mode, expected_value',
                          [('off', 0),
                           ('on', 1)])
@@ -257,3 +422,68 @@ def test_get_xnet_expert_version_prints_xnet_version_on_windows_platform(session
     ps_mock.return_value = 'Windows'
     utilities.get_xnet_expert_version()
     assert 'ni-xnet {}'.format(expected_version) in stdout_mock.getvalue()
+
+
+@mock.patch('nisyscfg.Session', new_callable=SessionMock(_sysapi_data))
+def test_self_test_xnet_device_reports_driver_error_code(session_mock):
+    session_mock.device1_mock.self_test.side_effect = LibraryError(-2147418113, '')
+    with pytest.raises(utilities.XnetConfigError) as error:
+        utilities.self_test_xnet_device('A2345678')
+    assert error.value.message == 'Self test of device with serial number "A2345678" failed with error code -2147418113'
+    session_mock.device1_mock.self_test.side_effect = RuntimeError('driver failure')
+    with pytest.raises(RuntimeError):
+        utilities.self_test_xnet_device('A2345678')
+
+
+@pytest.mark.parametrize('function_name, device_method', [
+    ('self_test_xnet_device', 'self_test'),
+    ('upgrade_xnet_firmware', 'upgrade_firmware'),
+])
+@mock.patch('nisyscfg.Session', new_callable=SessionMock(_sysapi_data))
+def test_device_operation_gives_up_after_timeout(session_mock, function_name, device_method):
+    release = threading.Event()
+    getattr(session_mock.device1_mock, device_method).side_effect = lambda *args, **kwargs: release.wait(5)
+    try:
+        with utilities.using_timeout(0.05):
+            with pytest.raises(utilities.OperationTimeoutError) as error:
+                getattr(utilities, function_name)('A2345678')
+    finally:
+        release.set()
+    assert error.value.message == 'Device with serial number "A2345678" did not finish within 0.05 s'
+    assert (error.value.serial_number, error.value.timeout) == ('A2345678', 0.05)
+
+
+def test_call_with_deadline_returns_result_or_raises_error_of_function():
+    assert utilities.call_with_deadline(lambda: 'result', 5, 'A2345678') == 'result'
+    assert utilities.call_with_deadline(lambda: 'result', None, 'A2345678') == 'result'
+    with pytest.raises(ValueError):
+        utilities.call_with_deadline(mock.Mock(side_effect=ValueError), 5, 'A2345678')
+
+
+def test_call_with_deadline_runs_in_a_session_of_its_own():
+    with utilities.using_session(mock.sentinel.session):
+        assert utilities.call_with_deadline(lambda: utilities._thread_state.session, None, 'A2345678') is mock.sentinel.session
+        assert utilities.call_with_deadline(lambda: utilities._thread_state.session, 5, 'A2345678') is None
+
+
+def test_call_with_deadline_leaves_uninterruptible_call_to_finish_before_exit():
+    release = threading.Event()
+    with pytest.raises(utilities.OperationTimeoutError):
+        utilities.call_with_deadline(release.wait, 0.05, 'A2345678', interruptible=False)
+    thread = next(thread for thread in threading.enumerate() if thread.name == 'nixnetconfig A2345678')
+    # The interpreter joins threads that are not daemons before it exits
+    assert not thread.daemon
+    release.set()
+    thread.join()
+
+
+def test_get_timeout_prefers_argument_then_thread_then_default():
+    assert utilities.get_timeout('self_test_xnet_device') == 300.0
+    assert utilities.get_timeout('upgrade_xnet_firmware') is None
+    with utilities.using_timeout(20):
+        assert utilities.current_timeout() == 20
+        assert utilities.get_timeout('self_test_xnet_device') == 20
+        assert utilities.get_timeout('self_test_xnet_device', 3) == 3
+        with utilities.using_timeout(0):
+            assert utilities.get_timeout('upgrade_xnet_firmware') is None
+    assert utilities.current_timeout() is None
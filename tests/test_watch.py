@@ -0,0 +1,109 @@
+import io
+import json
+from nixnetconfig import __main__
+from nixnetconfig import cache
+from nixnetconfig import utilities
+from nixnetconfig import watch
+import pytest
+from unittest import mock
+
+
+SIMULATED_BACKEND = 'sim:1x2x2'
+
+
+def _resource(system, name):
+    return next(resource for resource in system.resources if resource.expert_user_alias[0] == name)
+
+
+def _sleep_running(*changes):
+    # Apply one change per poll, then interrupt the watch
+    changes = list(changes)
+
+    def sleep(seconds):
+        if not changes:
+            raise KeyboardInterrupt
+        changes.pop(0)()
+    return mock.Mock(side_effect=sleep)
+
+
+def test_diff_snapshots_reports_added_removed_and_changed_hardware(simulated_system):
+    session = simulated_system.create_session()
+    previous = watch.take_snapshot(session)
+    _resource(simulated_system, '00010001').firmware_revision = '20000000'
+    _resource(simulated_system, 'CAN3').expert_user_alias[0] = 'ENGINE'
+    simulated_system.resources.remove(_resource(simulated_system, 'CAN4'))
+    simulated_system.resources.remove(_resource(simulated_system, '00010002'))
+    simulated_system._add_device('PXI1', 1, 3, 1)
+    assert [watch.format_event(event) for event in watch.diff_snapshots(previous, watch.take_snapshot(session))] == [
+        '~ 00010001 firmware_revision: 19072316 -> 20000000',
+        '- 00010002: NI PXI-8513',
+        '- 00010002 port 1: CAN3',
+        '- 00010002 port 2: CAN4',
+        '+ 00010003: NI PXI-8513',
+        '+ 00010003 port 1: CAN5',
+    ]
+    assert simulated_system.call_counts['find_hardware'] == 2
+
+
+def test_diff_snapshots_reports_renamed_interfaces_and_moved_devices(simulated_system):
+    session = simulated_system.create_session()
+    previous = watch.take_snapshot(session)
+    _resource(simulated_system, 'CAN2').expert_user_alias[0] = 'ENGINE'
+    _resource(simulated_system, 'CAN4').xnet.port_number = 3
+    _resource(simulated_system, '00010002').connects_to_link_name = ''
+    events = watch.diff_snapshots(previous, watch.take_snapshot(session))
+    assert events == [
+        watch.WatchEvent('changed', '00010001', 2, 'name', 'CAN2', 'ENGINE'),
+        watch.WatchEvent('changed', '00010002', None, 'connects_to_link_name', 'PXI1', ''),
+        watch.WatchEvent('removed', '00010002', 2, 'name', 'CAN4', None),
+        watch.WatchEvent('added', '00010002', 3, 'name', None, 'CAN4'),
+    ]
+    assert watch.diff_snapshots(previous, previous) == []
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_watch_prints_changes_and_backs_off_while_nothing_changes(stdout_mock, simulated_system):
+    def rename():
+        _resource(simulated_system, 'CAN1').expert_user_alias[0] = 'ENGINE'
+    sleep_mock = _sleep_running(lambda: None, lambda: None, lambda: None, lambda: None, rename, lambda: None)
+    with mock.patch('time.sleep', sleep_mock), mock.patch.object(cache, 'invalidate') as invalidate_mock:
+        watch.watch_xnet_devices(interval=0.5)
+    assert [call[0][0] for call in sleep_mock.call_args_list] == [0.5, 1.0, 2.0, 4.0, 4.0, 0.5, 1.0]
+    lines = stdout_mock.getvalue().splitlines()
+    assert lines[:2] == ['+ 00010001: NI PXI-8513', '+ 00010001 port 1: CAN1']
+    assert lines[6:] == ['~ 00010001 port 1 name: CAN1 -> ENGINE']
+    invalidate_mock.assert_called_once_with()
+    assert simulated_system.call_counts['find_hardware'] == 7
+
+
+@mock.patch('sys.stdout', new_callable=io.StringIO)
+def test_watch_writes_ndjson_events(stdout_mock, simulated_system):
+    with mock.patch('time.sleep', _sleep_running()):
+        watch.watch_xnet_devices(output_format='ndjson')
+    records = [json.loads(line) for line in stdout_mock.getvalue().splitlines()]
+    assert len(records) == 6
+    assert records[1] == {'event': 'added', 'serial_number': '00010001', 'port_number': 1, 'field': 'name', 'old': None, 'new': 'CAN1'}
+
+
+@pytest.mark.parametrize('interval, output_format', [(2.0, 'json'), (2.0, 'csv'), (0, 'text')])
+def test_watch_raises_error_for_invalid_arguments(interval, output_format):
+    with pytest.raises(utilities.XnetConfigError):
+        watch.watch_xnet_devices(interval, output_format)
+
+
+@pytest.mark.parametrize('arguments, expected_arguments', [
+    (['--watch'], {'watch': True}),
+    (['-w', '--interval', '0.5', '-f', 'ndjson'], {'watch': True, 'interval': 0.5, 'output_format': 'ndjson'}),
+])
+@mock.patch('nixnetconfig.client.forward', return_value=0)
+@mock.patch('nixnetconfig.utilities.enumerate_xnet_devices', spec=True)
+def test_watch_runs_locally_when_watch_is_specified(enumerate_xnet_devices_mock, forward_mock, arguments, expected_arguments):
+    __main__.main(['enumerate'] + arguments)
+    enumerate_xnet_devices_mock.assert_called_once_with(**expected_arguments)
+    forward_mock.assert_not_called()
+
+
+@mock.patch('nixnetconfig.watch.watch_xnet_devices', spec=True)
+def test_enumerate_xnet_devices_watches_when_watch_is_requested(watch_xnet_devices_mock):
+    utilities.enumerate_xnet_devices('ndjson', watch=True, interval=3.0)
+    watch_xnet_devices_mock.assert_called_once_with(3.0, 'ndjson')